@@ -1,5 +1,28 @@
 import random
 import unittest
+import numpy
+
+
+def wrapped_offset(offset, length):
+    """
+    Return the shortest distance equivalent to `offset` on a wrapped axis.
+
+    Parameters
+    ----------
+    offset : int
+        Absolute offset between two positions on the axis.
+    length : int
+        Length of the wrapped axis.
+
+    Returns
+    -------
+    int
+        The shortest offset, taking wrap-around into account.
+
+    """
+
+    offset %= length
+    return min(offset, length - offset)
 
 class Agent():
     """
@@ -7,7 +30,8 @@ class Agent():
     with its environment and other agents.
     """
 
-    def __init__(self, environment, agents, y, x, store_size=0, bite_size=10):
+    def __init__(self, environment, agents, y, x, store_size=0, bite_size=10,
+                 move_range=1):
         """
         Instantiate an Agent.
         
@@ -24,6 +48,10 @@ class Agent():
         store_size : int
             Maximum capacity for the store. If < 0 is specified, there is no
             store limit
+        bite_size : int, optional
+            Amount of resources consumed in a single bite. The default is 10.
+        move_range : int, optional
+            Maximum number of steps moved along each axis. The default is 1.
 
         Returns
         -------
@@ -46,6 +74,9 @@ class Agent():
         # Initialize bite size
         self.bite_size = bite_size
 
+        # Set the movement range
+        self.move_range = move_range
+
         # Set the start position
         self.x = x if x != None else random.randint(0, environment.x_length)
         self.y = y if y != None else random.randint(0, environment.y_length)
@@ -100,6 +131,9 @@ class Agent():
         The agent will move at most one step in a random direction along
         the x-axis and y-axis of its environment. The agent has an equal chance
         to move forward, backward or nowhere for each axis.
+
+        Agents with a movement range above 1 move any number of steps up to
+        their range, with an equal chance of each, along each axis.
         
         Returns
         -------
@@ -108,8 +142,14 @@ class Agent():
         """
 
         # Walk a random step on each axis
-        self.x = (self.x + self._get_random_step_value()) % self.environment.x_length
-        self.y = (self.y + self._get_random_step_value()) % self.environment.y_length
+        if self.move_range == 1:
+            x_step = self._get_random_step_value()
+            y_step = self._get_random_step_value()
+        else:
+            x_step = random.randint(-self.move_range, self.move_range)
+            y_step = random.randint(-self.move_range, self.move_range)
+        self.x = (self.x + x_step) % self.environment.x_length
+        self.y = (self.y + y_step) % self.environment.y_length
 
     
     def _get_random_step_value(self):
@@ -151,7 +191,7 @@ class Agent():
         if self.resources_available() and self.can_eat():
             
             # Eat a portion of the environment and store it locally
-            self.environment.plane[self.y][self.x] -= self.bite_size
+            self.environment.plane[self.y, self.x] -= self.bite_size
             self.store += self.bite_size
     
 
@@ -167,7 +207,7 @@ class Agent():
 
         """
         
-        return self.environment.plane[self.y][self.x] > self.bite_size
+        return self.environment.plane[self.y, self.x] > self.bite_size
     
 
     def can_eat(self):
@@ -186,7 +226,8 @@ class Agent():
             (self.store + self.bite_size) <= self.store_size
         
     
-    def share_with_neighbours(self, neighbourhood_size):
+    def share_with_neighbours(self, neighbourhood_size, toroidal=False,
+                              index=None):
         """
         Share the store contents with nearby agents.
 
@@ -197,26 +238,107 @@ class Agent():
         ----------
         neighbourhood_size : int
             Size of the neighbourhood to search for other agents.
+        toroidal : bool, optional
+            Measure distances across the environment edges, matching the
+            wrap-around used by `move`. The default is False.
+        index : neighbourhood.NeighbourIndex, optional
+            Spatial index used to find neighbours. If None, all agents are
+            checked. The default is None.
 
         Returns
         -------
-        None.
+        int
+            Number of neighbours shared with.
+
+        """
+
+        # Find neighbours using the index, if provided
+        if index is not None:
+            neighbours = index.neighbours(self)
+        else:
+            neighbours = self.neighbours(neighbourhood_size, toroidal)
+
+        # Share with each neighbour in turn
+        for agent in neighbours:
+
+            # Share store contents by having each agent take
+            # half of the average
+            average = (self.store + agent.store) / 2
+            self.store = average
+            agent.store = average
+
+        return len(neighbours)
+
+
+    def neighbours(self, neighbourhood_size, toroidal=False):
+        """
+        Return all other agents within the given neighbourhood.
+
+        Agents are returned in the same order as they appear in the model
+        agents list.
+
+        Parameters
+        ----------
+        neighbourhood_size : int
+            Size of the neighbourhood to search for other agents.
+        toroidal : bool, optional
+            Measure distances across the environment edges. The default
+            is False.
+
+        Returns
+        -------
+        list[Agent]
+            Agents within the neighbourhood, excluding this agent.
+
+        """
+
+        return [agent for agent in self.agents
+                if agent is not self
+                and self.is_neighbour(agent, neighbourhood_size, toroidal)]
+
+
+    def is_neighbour(self, agent, neighbourhood_size, toroidal=False):
+        """
+        Check if the given `agent` is within the neighbourhood.
+
+        Agents outside the neighbourhood bounding box are rejected before
+        the squared distance is compared, so no square root is needed.
+
+        When `toroidal` is True, the shortest offset along each axis is used,
+        allowing for wrap-around at the environment edges.
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent to check.
+        neighbourhood_size : int
+            Size of the neighbourhood.
+        toroidal : bool, optional
+            Measure distances across the environment edges. The default
+            is False.
+
+        Returns
+        -------
+        bool
+            Returns True if the agent is within the neighbourhood, otherwise
+            False is returned.
 
         """
 
-        # Check all agents that are not this agent
-        for agent in self.agents:
-            if agent != self:
-                
-                # Check if within the distance threshold
-                distance = self._distance_between(agent)
-                if distance <= neighbourhood_size:
-                    
-                    # Share store contents by having each agent take
-                    # half of the average
-                    average = (self.store + agent.store) / 2
-                    self.store = average
-                    agent.store = average
+        # Reject agents outside the bounding box
+        dx = abs(self.x - agent.x)
+        if toroidal:
+            dx = wrapped_offset(dx, self.environment.x_length)
+        if dx > neighbourhood_size:
+            return False
+        dy = abs(self.y - agent.y)
+        if toroidal:
+            dy = wrapped_offset(dy, self.environment.y_length)
+        if dy > neighbourhood_size:
+            return False
+
+        # Compare the squared distance with the squared neighbourhood size
+        return dx * dx + dy * dy <= neighbourhood_size * neighbourhood_size
 
 
     def _distance_between(self, agent):
@@ -242,6 +364,394 @@ class Agent():
 
 
 
+class Species():
+    """
+    The Species class describes a type of agent. Its values are shared by
+    every agent of the type, so they take no space per agent.
+    """
+
+    def __init__(self, name="agents", store_size=0, bite_size=10,
+                 move_range=1):
+        """
+        Instantiate a Species.
+
+        Parameters
+        ----------
+        name : str, optional
+            Name of the species. The default is "agents".
+        store_size : int, optional
+            Maximum capacity for each store. If <= 0, there is no store
+            limit. The default is 0.
+        bite_size : int, optional
+            Amount of resources consumed in a single bite. The default is 10.
+        move_range : int, optional
+            Maximum number of steps moved along each axis. The default is 1.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.name = name
+        self.store_size = store_size
+        self.bite_size = bite_size
+        self.move_range = move_range
+
+
+    def __repr__(self):
+        return "Species({!r}, store_size={}, bite_size={}, move_range={})" \
+            .format(self.name, self.store_size, self.bite_size,
+                    self.move_range)
+
+
+
+class AgentArrays():
+    """
+    The AgentArrays class stores a population of agents as a structure of
+    arrays, with one array per agent property.
+
+    Agents may be of several species. The agents of each species are held in
+    a contiguous block of the arrays, and share the store size, bite size and
+    movement range of their species. Each block can be used as an
+    AgentArrays of its own, viewing the same arrays.
+
+    It can be used as a sequence of agents, where each item is an ArrayAgent
+    that reads and writes its values directly in the arrays.
+
+    Public Methods:
+
+        can_eat - returns which agents can eat any more resources
+
+        blocks - returns the agents of each species
+
+        species_of - returns the species of an agent
+
+        species_values - returns a species value for each agent
+    """
+
+    def __init__(self, environment, y, x, store=None, store_size=0,
+                 bite_size=10, species=None):
+        """
+        Instantiate an AgentArrays.
+
+        Parameters
+        ----------
+        environment : Environment
+            The environment the agents interact with.
+        y : array_like
+            Initial y-axis positions.
+        x : array_like
+            Initial x-axis positions.
+        store : array_like, optional
+            Initial store contents. If None, all stores are empty.
+        store_size : int, optional
+            Maximum capacity for each store. If <= 0, there is no store
+            limit. The default is 0.
+        bite_size : int, optional
+            Amount of resources consumed in a single bite. The default is 10.
+        species : list[tuple[Species, int]], optional
+            Species of the agents and the number of agents of each, in the
+            order the agents are held in the arrays. If None, all agents are
+            of a single species with the given store size and bite size.
+
+        Raises
+        ------
+        ValueError
+            If the species counts do not add up to the number of agents.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Set a reference to the environment
+        self.environment = environment
+
+        # Set the per-agent arrays
+        self.y = numpy.array(y, dtype=numpy.int64)
+        self.x = numpy.array(x, dtype=numpy.int64)
+        self.store = numpy.zeros(len(self.y)) if store is None \
+            else numpy.array(store, dtype=numpy.float64)
+
+        # Set the species and the bounds of their blocks
+        if species is None:
+            species = [(Species(store_size=store_size, bite_size=bite_size),
+                        len(self.y))]
+        self.species = [kind for kind, _ in species]
+        self.bounds = numpy.concatenate(
+            ([0], numpy.cumsum([count for _, count in species],
+                               dtype=numpy.int64)))
+        if self.bounds[-1] != len(self.y):
+            raise ValueError("Species counts must add up to the number of "
+                             "agents")
+
+        # Agent views are created when first accessed
+        self._views = {}
+
+
+    def __len__(self):
+        return len(self.y)
+
+
+    def __getitem__(self, index):
+        """
+        Return the agent at the given index as an ArrayAgent.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Agent index out of range")
+
+        # Reuse views so that agent identity is preserved
+        view = self._views.get(index)
+        if view is None:
+            view = self._views[index] = ArrayAgent(self, index)
+        return view
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    @property
+    def store_size(self):
+        """
+        Get the maximum store capacity, as a single value if all agents are
+        of one species, otherwise as an array of values for each agent.
+        """
+        if len(self.species) == 1:
+            return self.species[0].store_size
+        return self.species_values("store_size")
+
+
+    @store_size.setter
+    def store_size(self, value):
+        """
+        Set the maximum store capacity of every species.
+        """
+        for kind in self.species:
+            kind.store_size = value
+
+
+    @property
+    def bite_size(self):
+        """
+        Get the bite size, as a single value if all agents are of one
+        species, otherwise as an array of values for each agent.
+        """
+        if len(self.species) == 1:
+            return self.species[0].bite_size
+        return self.species_values("bite_size")
+
+
+    @bite_size.setter
+    def bite_size(self, value):
+        """
+        Set the bite size of every species.
+        """
+        for kind in self.species:
+            kind.bite_size = value
+
+
+    def can_eat(self):
+        """
+        Check which agents can eat any more resources.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array that is True for each agent that can still eat.
+
+        """
+
+        can_eat = numpy.ones(len(self), dtype=bool)
+        for block in self.blocks():
+            kind = block.species[0]
+            if kind.store_size > 0:
+                start = block.bounds[0]
+                numpy.less_equal(block.store + kind.bite_size,
+                                 kind.store_size,
+                                 out=can_eat[start:start + len(block)])
+        return can_eat
+
+
+    def blocks(self):
+        """
+        Return the agents of each species.
+
+        Returns
+        -------
+        list[AgentArrays]
+            An AgentArrays for each species, viewing its block of the
+            arrays. The `bounds` of each start at the block position.
+
+        """
+
+        if len(self.species) == 1:
+            return [self]
+
+        blocks = []
+        for kind, start, stop in zip(self.species, self.bounds[:-1],
+                                     self.bounds[1:]):
+            block = AgentArrays(self.environment, [], [], species=[(kind, 0)])
+            block.y = self.y[start:stop]
+            block.x = self.x[start:stop]
+            block.store = self.store[start:stop]
+            block.bounds = numpy.array([start, stop])
+            blocks.append(block)
+        return blocks
+
+
+    def species_of(self, index):
+        """
+        Return the species of the agent at the given index.
+
+        Parameters
+        ----------
+        index : int
+            Index of the agent.
+
+        Returns
+        -------
+        Species
+            The species of the agent.
+
+        """
+
+        return self.species[
+            numpy.searchsorted(self.bounds, index, side="right") - 1]
+
+
+    def species_values(self, name):
+        """
+        Return the value of a species attribute for each agent.
+
+        Parameters
+        ----------
+        name : str
+            Name of the attribute, such as "bite_size".
+
+        Returns
+        -------
+        numpy.ndarray
+            The attribute value of the species of each agent.
+
+        """
+
+        return numpy.repeat([getattr(kind, name) for kind in self.species],
+                            numpy.diff(self.bounds))
+
+
+
+class ArrayAgent(Agent):
+    """
+    The ArrayAgent class is an Agent whose position and store are held in an
+    AgentArrays population, so that changes made through either are visible
+    in both.
+    """
+
+    def __init__(self, arrays, index):
+        """
+        Instantiate an ArrayAgent.
+
+        Parameters
+        ----------
+        arrays : AgentArrays
+            The population holding the agent values.
+        index : int
+            Index of the agent in the population.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self._arrays = arrays
+        self._index = index
+        self._species = arrays.species_of(index)
+
+        # Set references matching those of a regular Agent
+        self.environment = arrays.environment
+        self.agents = arrays
+
+
+    @property
+    def x(self):
+        """
+        Get the current x-axis position in the environment.
+        """
+        return int(self._arrays.x[self._index])
+
+
+    @x.setter
+    def x(self, value):
+        """
+        Set the current x-axis position in the environment.
+        """
+        self._arrays.x[self._index] = value
+
+
+    @property
+    def y(self):
+        """
+        Get the current y-axis position in the environment.
+        """
+        return int(self._arrays.y[self._index])
+
+
+    @y.setter
+    def y(self, value):
+        """
+        Set the current y-axis position in the environment.
+        """
+        self._arrays.y[self._index] = value
+
+
+    @property
+    def store(self):
+        """
+        Get the current store contents.
+        """
+        return float(self._arrays.store[self._index])
+
+
+    @store.setter
+    def store(self, value):
+        """
+        Set the current store contents.
+        """
+        self._arrays.store[self._index] = value
+
+
+    @property
+    def store_size(self):
+        """
+        Get the maximum store capacity shared by the species.
+        """
+        return self._species.store_size
+
+
+    @property
+    def bite_size(self):
+        """
+        Get the bite size shared by the species.
+        """
+        return self._species.bite_size
+
+
+    @property
+    def move_range(self):
+        """
+        Get the movement range shared by the species.
+        """
+        return self._species.move_range
+
+
+
 class Environment():
     """
     The Environment class represents the model environment. It consists of a
@@ -256,9 +766,10 @@ class Environment():
 
         Parameters
         ----------
-        environment_plane : list[list[int]]
+        environment_plane : array_like
             2-D environment plane with values representing the amount of
-            resources available at that coordinate.
+            resources available at that coordinate. NumPy arrays are used
+            directly, and other planes are converted to one.
         x_lim : int, optional
             Limit for the x-axis. The default is None.
         y_lim : TYPE, optional
@@ -271,7 +782,7 @@ class Environment():
         """
 
         # Clear the current environment
-        self._plane = environment_plane
+        self._plane = numpy.asarray(environment_plane)
         
         # Set the y-axis length
         self._y_length = len(self._plane)
@@ -293,6 +804,14 @@ class Environment():
         return self._plane
 
 
+    @property
+    def limited_plane(self):
+        """
+        Get a view of the plane within the x-axis and y-axis limits.
+        """
+        return self._plane[:self._y_length, :self._x_length]
+
+
     @property
     def y_length(self):
         """
@@ -422,6 +941,80 @@ class AgentTestCase(unittest.TestCase):
         # Verify distance calculation
         self.assertEqual(agent1._distance_between(agent2), 5)
 
+
+    def test_is_neighbour(self):
+        """
+        Test that neighbours are detected using the neighbourhood size.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Setup test case
+        agent = Agent([[]], [], 0, 0)
+
+        # Verify agents on and within the neighbourhood boundary
+        self.assertTrue(agent.is_neighbour(Agent([[]], [], 4, 3), 5))
+        self.assertTrue(agent.is_neighbour(Agent([[]], [], 0, 5), 5))
+
+        # Verify agents outside the bounding box and the radius
+        self.assertFalse(agent.is_neighbour(Agent([[]], [], 0, 6), 5))
+        self.assertFalse(agent.is_neighbour(Agent([[]], [], 4, 4), 5))
+
+
+    def test_neighbours(self):
+        """
+        Test that only other agents within the neighbourhood are returned.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Setup test case
+        environment = EnvironmentTestCase.create_environment()
+        agents = []
+        for y, x in [(0, 0), (3, 4), (10, 0), (1, 1)]:
+            agents.append(Agent(environment, agents, y, x))
+
+        # Verify neighbours are returned in agents list order
+        self.assertEqual(agents[0].neighbours(5), [agents[1], agents[3]])
+        self.assertEqual(agents[2].neighbours(5), [])
+
+
+    def test_toroidal_neighbours(self):
+        """
+        Test that toroidal neighbourhoods wrap around the environment edges.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Setup test case with agents on opposite edges
+        environment = EnvironmentTestCase.create_environment()
+        agents = []
+        agent1 = Agent(environment, agents, 0, 0)
+        agent1.store = 10
+        agents.append(agent1)
+        agent2 = Agent(environment, agents, 99, 98)
+        agents.append(agent2)
+
+        # Verify edges are only connected in toroidal mode
+        self.assertEqual(agent1.neighbours(3), [])
+        self.assertEqual(agent1.neighbours(3, True), [agent2])
+        self.assertFalse(agent1.is_neighbour(agent2, 2, True))
+
+        # Verify store is shared across the edges
+        agent1.share_with_neighbours(3, True)
+        self.assertEqual(agent1.store, 5)
+        self.assertEqual(agent2.store, 5)
+
+
     def test_share_with_neighbours(self):
         """
         Test that agents share their resources correctly.
@@ -455,6 +1048,104 @@ class AgentTestCase(unittest.TestCase):
 
                         
 
+class AgentArraysTestCase(unittest.TestCase):
+    """
+    The AgentArraysTestCase class provides a collection of unit tests for
+    the AgentArrays and ArrayAgent classes.
+    """
+
+    def test_views(self):
+        """
+        Test that agent views read and write the population arrays.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Setup test case
+        environment = EnvironmentTestCase.create_environment(11, 1, 1)
+        arrays = AgentArrays(environment, [0, 3], [0, 4])
+
+        # Verify views are reused and read the arrays
+        agent = arrays[1]
+        self.assertIs(arrays[1], agent)
+        self.assertIs(arrays[-1], agent)
+        self.assertEqual((agent.y, agent.x), (3, 4))
+        self.assertEqual(list(arrays), [arrays[0], agent])
+
+        # Verify agent behaviour writes to the arrays
+        arrays[0].eat()
+        self.assertEqual(arrays.store[0], 10)
+        self.assertEqual(environment.plane[0][0], 1)
+        self.assertEqual(arrays[0].neighbours(5), [agent])
+
+
+    def test_can_eat(self):
+        """
+        Test that the agents able to eat are found using their stores.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Setup test case
+        environment = EnvironmentTestCase.create_environment()
+        arrays = AgentArrays(environment, [0, 0], [0, 0], [0, 95], 100, 10)
+
+        # Verify the store limit is applied to each agent
+        self.assertEqual(arrays.can_eat().tolist(), [True, False])
+        arrays.store_size = 0
+        self.assertEqual(arrays.can_eat().tolist(), [True, True])
+
+
+    def test_species(self):
+        """
+        Test that each species uses its own values in its own block.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Setup test case
+        environment = EnvironmentTestCase.create_environment(100)
+        grazers = Species("grazers", 100, 10)
+        browsers = Species("browsers", 0, 30, move_range=3)
+        arrays = AgentArrays(environment, [0, 1, 2], [0, 1, 2], [95, 95, 95],
+                             species=[(grazers, 1), (browsers, 2)])
+
+        # Verify values are looked up by species
+        self.assertEqual(arrays.can_eat().tolist(), [False, True, True])
+        self.assertEqual(arrays.bite_size.tolist(), [10, 30, 30])
+        self.assertIs(arrays.species_of(2), browsers)
+        self.assertEqual((arrays[0].bite_size, arrays[1].bite_size), (10, 30))
+        arrays[2].eat()
+        self.assertEqual(environment.plane[2][2], 70)
+
+        # Verify blocks view the arrays of each species
+        blocks = arrays.blocks()
+        self.assertEqual([len(block) for block in blocks], [1, 2])
+        blocks[1].x[:] = 50
+        self.assertEqual(arrays.x.tolist(), [0, 50, 50])
+
+        # Verify agents move within their range
+        random.seed(0)
+        steps = set()
+        for _ in range(50):
+            x = arrays.x[1]
+            arrays[1].move()
+            steps.add(wrapped_offset(abs(arrays.x[1] - x), 100))
+        self.assertEqual(steps, {0, 1, 2, 3})
+        with self.assertRaises(ValueError):
+            AgentArrays(environment, [0], [0], species=[(grazers, 2)])
+
+
+
 class EnvironmentTestCase(unittest.TestCase):
     """
     The EnvironmentTestCase class provides a collection of unit tests for
@@ -480,6 +1171,7 @@ class EnvironmentTestCase(unittest.TestCase):
         self.assertEqual(environment.plane[0][0], 11)
         self.assertEqual(environment.x_length, 2)
         self.assertEqual(environment.y_length, 1)
+        self.assertEqual(environment.limited_plane.tolist(), [[11, 10]])
         
 
     def create_environment(initial_value=0, rows=100, columns=100):
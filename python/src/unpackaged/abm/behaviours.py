@@ -0,0 +1,699 @@
+"""
+Agent Behaviours
+================
+
+Runs each model iteration as a pipeline of behaviour stages: movement,
+feeding and interaction.
+
+Each stage is a Behaviour with a per-agent implementation, `apply`, and
+optionally a batched implementation over agents stored as arrays,
+`apply_batch`. When every stage of a pipeline has a batched implementation
+the model stores its agents as arrays and runs the batched path:
+
+    1. Agents that can eat are found and shuffled into a turn order
+    2. All of them move
+    3. All of them feed, in turn order
+    4. All of them interact, in turn order
+
+The turn order is drawn from the model random state, so batched runs are
+reproducible from the model seed, and agents competing for a cell are
+resolved in that order.
+
+Otherwise the per-agent path runs each agent through every stage in turn,
+as a sequential model iteration always has. The batched path is
+statistically similar to the per-agent path rather than identical to it,
+as agents no longer feed and interact between the moves of other agents.
+
+Parallel execution always runs the built-in behaviours in its workers.
+"""
+
+import random
+import unittest
+import numpy
+import agentframework
+import kernels
+import neighbourhood
+import sharing
+
+
+class Context():
+    """
+    The Context class holds the state shared by behaviour stages within an
+    iteration.
+    """
+
+    def __init__(self, model, index=None, rng=None):
+        """
+        Instantiate a Context.
+
+        Parameters
+        ----------
+        model : Model
+            The model being iterated.
+        index : neighbourhood.NeighbourIndex, optional
+            Neighbour index of the agents, on the per-agent path. The
+            default is None.
+        rng : numpy.random.Generator, optional
+            Random number generator for the iteration, on the batched path.
+            The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.model = model
+        self.index = index
+        self.rng = rng
+
+
+
+class Behaviour():
+    """
+    The Behaviour class is the base class of behaviour stages.
+
+    Subclasses implement `apply`, and implement `apply_batch` if the stage
+    can run on all agents at once.
+
+    Public Methods:
+
+        apply - applies the behaviour to a single agent
+
+        apply_batch - applies the behaviour to agents stored as arrays
+    """
+
+    @property
+    def supports_batch(self):
+        """
+        Get whether the behaviour has a batched implementation.
+        """
+        return type(self).apply_batch is not Behaviour.apply_batch
+
+
+    def apply(self, agent, context):
+        """
+        Apply the behaviour to a single agent.
+
+        Parameters
+        ----------
+        agent : agentframework.Agent
+            The agent taking its turn.
+        context : Context
+            The iteration context.
+
+        Returns
+        -------
+        float
+            Resource eaten by feeding stages, or share events counted by
+            interaction stages. Movement stages return 0.
+
+        """
+
+        raise NotImplementedError
+
+
+    def apply_batch(self, agents, order, context):
+        """
+        Apply the behaviour to agents stored as arrays.
+
+        Parameters
+        ----------
+        agents : agentframework.AgentArrays
+            All agents in the model.
+        order : numpy.ndarray
+            Indices of the agents taking a turn, in turn order.
+        context : Context
+            The iteration context.
+
+        Returns
+        -------
+        float
+            Total resource eaten by feeding stages, or share events counted
+            by interaction stages. Movement stages return 0.
+
+        """
+
+        raise NotImplementedError
+
+
+
+def random_steps(agents, order, rng):
+    """
+    Return random x-axis and y-axis steps for the given agents, within the
+    movement range of their species.
+
+    Parameters
+    ----------
+    agents : agentframework.AgentArrays
+        All agents in the model.
+    order : numpy.ndarray
+        Indices of the agents to step.
+    rng : numpy.random.Generator
+        Random number generator.
+
+    Returns
+    -------
+    numpy.ndarray
+        Steps with shape (2, len(order)), x-axis first.
+
+    """
+
+    # Use the same step chances as Agent.move
+    chances = rng.random((2, len(order)))
+    steps = numpy.where(chances < 0.33, 1, numpy.where(chances < 0.66, -1, 0))
+
+    # Step agents of species with a longer range any distance within it
+    if any(kind.move_range != 1 for kind in agents.species):
+        ranges = agents.species_values("move_range")[order]
+        wide = numpy.flatnonzero(ranges != 1)
+        steps[:, wide] = rng.integers(-ranges[wide], ranges[wide] + 1,
+                                      (2, len(wide)))
+    return steps
+
+
+
+class RandomWalk(Behaviour):
+    """
+    The RandomWalk class moves agents a random step on each axis, up to the
+    movement range of their species, wrapping around the environment edges.
+    """
+
+    def apply(self, agent, context):
+        y, x = agent.y, agent.x
+        agent.move()
+        context.index.move(agent, y, x)
+        return 0
+
+
+    def apply_batch(self, agents, order, context):
+        environment = context.model.environment
+        steps = random_steps(agents, order, context.rng)
+        agents.x[order] = (agents.x[order] + steps[0]) % environment.x_length
+        agents.y[order] = (agents.y[order] + steps[1]) % environment.y_length
+        return 0
+
+
+
+class Grazing(Behaviour):
+    """
+    The Grazing class has agents eat a bite of their environment cell, if
+    it holds more than a bite.
+
+    In a batch, agents sharing a cell compete for it in turn order, so each
+    agent eats exactly as it would have in a sequential loop over the same
+    order. Agents are grouped by cell and the bites eaten before each agent
+    are summed within its group, so all agents are resolved at once and the
+    cells are updated in a single pass.
+    """
+
+    def apply(self, agent, context):
+        if agent.resources_available():
+            agent.eat()
+            return agent.bite_size
+        return 0
+
+
+    def apply_batch(self, agents, order, context):
+        plane = context.model.environment.plane
+        x_length = plane.shape[1]
+        if len(order) == 0:
+            return 0
+
+        # Group the agents by cell, keeping turn order within each cell
+        cells = agents.y[order] * x_length + agents.x[order]
+        grouping = numpy.argsort(cells, kind="stable")
+        order = order[grouping]
+        cells = cells[grouping]
+        starts = numpy.flatnonzero(numpy.diff(cells, prepend=-1))
+        sizes = numpy.diff(numpy.append(starts, len(cells)))
+        ys, xs = numpy.divmod(cells[starts], x_length)
+        available = numpy.repeat(plane[ys, xs], sizes)
+        group_starts = numpy.repeat(starts, sizes)
+        bites = numpy.broadcast_to(agents.bite_size, len(agents))[order]
+
+        # Each agent eats if its cell holds more than a bite after the bites
+        # eaten before it. Starting by assuming every earlier agent ate, each
+        # pass settles at least one more agent per cell. When all agents
+        # share a bite size, the first pass is exact.
+        eats = numpy.ones(len(order), dtype=bool)
+        while True:
+            fed_bites = numpy.where(eats, bites, 0)
+            eaten_before = numpy.cumsum(fed_bites) - fed_bites
+            eaten_before -= eaten_before[group_starts]
+            settled = available - eaten_before > bites
+            if numpy.isscalar(agents.bite_size) or \
+                    numpy.array_equal(settled, eats):
+                break
+            eats = settled
+
+        # Apply the bites, totalling them for each cell
+        fed_bites = numpy.where(settled, bites, 0)
+        totals = numpy.add.reduceat(fed_bites, starts)
+        plane[ys, xs] -= totals
+        agents.store[order] += fed_bites
+        return float(totals.sum())
+
+
+
+class ShareWithNeighbours(Behaviour):
+    """
+    The ShareWithNeighbours class has agents share their store equally with
+    each neighbour in turn.
+    """
+
+    def apply(self, agent, context):
+        model = context.model
+        return agent.share_with_neighbours(model.neighbourhood_size,
+                                           model.toroidal_neighbourhood,
+                                           context.index)
+
+
+
+class NeighbourSharing(ShareWithNeighbours):
+    """
+    The NeighbourSharing class has agents share their store with their
+    neighbours, with a batched implementation that finds all neighbours at
+    once and shares using one of the `sharing.modes`.
+
+    The neighbour graph is kept between iterations, so only the neighbours
+    of agents that have moved are found again. Agents that can no longer
+    eat do not move, so this saves more as the run goes on.
+
+    The per-agent implementation always shares sequentially.
+    """
+
+    def __init__(self, mode="sequential"):
+        """
+        Instantiate a NeighbourSharing.
+
+        Parameters
+        ----------
+        mode : str, optional
+            Batched sharing mode, one of `sharing.modes`. The default is
+            "sequential".
+
+        Raises
+        ------
+        ValueError
+            If the mode is unknown.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if mode not in sharing.modes:
+            raise ValueError("Unknown sharing mode: {}".format(mode))
+        self.mode = mode
+        self.graph = None
+
+
+    def apply_batch(self, agents, order, context):
+        model = context.model
+        environment = model.environment
+
+        # Create a new graph when the neighbourhood or environment changes
+        settings = (model.neighbourhood_size, environment.y_length,
+                    environment.x_length, model.toroidal_neighbourhood)
+        graph = self.graph
+        if graph is None or settings != (graph.neighbourhood_size,
+                                         graph.y_length, graph.x_length,
+                                         graph.toroidal):
+            self.graph = graph = neighbourhood.NeighbourGraph(*settings)
+
+        indptr, indices = graph.update(agents.y, agents.x)
+        return sharing.share(agents.store, order, indptr, indices, self.mode)
+
+
+
+class NoInteraction(Behaviour):
+    """
+    The NoInteraction class leaves agents to keep their own store.
+    """
+
+    def apply(self, agent, context):
+        return 0
+
+
+    def apply_batch(self, agents, order, context):
+        return 0
+
+
+
+class Pipeline():
+    """
+    The Pipeline class runs model iterations through movement, feeding and
+    interaction stages.
+
+    Public Methods:
+
+        run - runs a single iteration of the given model
+    """
+
+    def __init__(self, movement=None, feeding=None, interaction=None):
+        """
+        Instantiate a Pipeline.
+
+        Parameters
+        ----------
+        movement : Behaviour, optional
+            Movement stage. The default is RandomWalk.
+        feeding : Behaviour, optional
+            Feeding stage. The default is Grazing.
+        interaction : Behaviour, optional
+            Interaction stage. The default is ShareWithNeighbours.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.movement = movement if movement is not None else RandomWalk()
+        self.feeding = feeding if feeding is not None else Grazing()
+        self.interaction = interaction if interaction is not None \
+            else ShareWithNeighbours()
+
+
+    @property
+    def batched(self):
+        """
+        Get whether every stage has a batched implementation.
+        """
+        return all(stage.supports_batch for stage in
+                   (self.movement, self.feeding, self.interaction))
+
+
+    def run(self, model):
+        """
+        Run a single iteration of the given model.
+
+        The batched path is used if every stage supports it and the agents
+        are stored as arrays.
+
+        Parameters
+        ----------
+        model : Model
+            The model to iterate.
+
+        Returns
+        -------
+        tuple[int, float, int]
+            Number of agents that were able to eat at the start of their
+            turn, the resource eaten and the number of share events.
+
+        """
+
+        if self.batched and isinstance(model.agents,
+                                       agentframework.AgentArrays):
+            return self._run_batched(model)
+        return self._run_per_agent(model)
+
+
+    def _run_per_agent(self, model):
+        """
+        Run each agent through every stage in turn.
+        """
+
+        active = 0
+        eaten = 0
+        share_events = 0
+
+        # Agents stored as arrays are shuffled as a list of agent views
+        agents = model.agents
+        if isinstance(agents, agentframework.AgentArrays):
+            agents = list(agents)
+
+        # Shuffle agents to remove artifacts from ordered lists
+        random.shuffle(agents)
+
+        # Index the shuffled agents for neighbour queries
+        index = neighbourhood.create_index(model.neighbour_strategy, agents,
+                                           model.environment,
+                                           model.neighbourhood_size,
+                                           model.toroidal_neighbourhood)
+        context = Context(model, index)
+
+        # Only agents with store capacity take a turn
+        for agent in agents:
+            if agent.can_eat():
+                active += 1
+                self.movement.apply(agent, context)
+                eaten += self.feeding.apply(agent, context)
+                share_events += self.interaction.apply(agent, context)
+
+        return active, eaten, share_events
+
+
+    def _run_batched(self, model):
+        """
+        Run each stage on all agents with store capacity at once.
+        """
+
+        agents = model.agents
+        context = Context(model,
+                          rng=numpy.random.default_rng(random.getrandbits(32)))
+
+        # Shuffle the agents with store capacity into a turn order
+        order = context.rng.permutation(numpy.flatnonzero(agents.can_eat()))
+
+        self.movement.apply_batch(agents, order, context)
+        eaten = self.feeding.apply_batch(agents, order, context)
+        share_events = self.interaction.apply_batch(agents, order, context)
+        return len(order), eaten, share_events
+
+
+
+class CompiledPipeline(Pipeline):
+    """
+    The CompiledPipeline class runs model iterations with each agent in turn
+    moving, eating and sharing with its neighbours, as a compiled kernel
+    over the agent arrays.
+
+    Agents are always stored as arrays. The kernel is compiled with Numba
+    if it is installed, and otherwise runs as plain Python with the same
+    results. Agents take their turns in a random order drawn from the model
+    random state, and share with their neighbours in agent order.
+
+    Public Methods:
+
+        run - runs a single iteration of the given model
+    """
+
+    def __init__(self, compiled=True):
+        """
+        Instantiate a CompiledPipeline.
+
+        The built-in stages are used if the agents are not stored as arrays.
+
+        Parameters
+        ----------
+        compiled : bool, optional
+            Run the compiled kernel, if Numba is installed. The default is
+            True.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        super().__init__()
+        self.compiled = compiled
+
+
+    @property
+    def batched(self):
+        """
+        Get whether agents are stored as arrays, which they always are.
+        """
+        return True
+
+
+    def _run_batched(self, model):
+        """
+        Run each agent in turn through the kernel.
+        """
+
+        agents = model.agents
+        rng = numpy.random.default_rng(random.getrandbits(32))
+
+        # Every agent takes a turn, if it has store capacity at the time
+        order = rng.permutation(len(agents))
+        steps = random_steps(agents, order, rng)
+        return kernels.iterate_agents(agents, order, steps,
+                                      model.neighbourhood_size,
+                                      model.toroidal_neighbourhood,
+                                      self.compiled)
+
+
+
+class PipelineTestCase(unittest.TestCase):
+    """
+    The PipelineTestCase class provides a collection of unit tests for the
+    Pipeline class and the built-in behaviours.
+    """
+
+    class FakeModel():
+        """
+        A minimal model holding an environment and agents.
+        """
+
+        def __init__(self, agents):
+            self.environment = agents.environment
+            self.agents = agents
+            self.neighbourhood_size = 2
+            self.toroidal_neighbourhood = False
+            self.neighbour_strategy = "auto"
+
+
+    def create_model(self, num_of_agents=200, length=20, value=25):
+        """
+        Return a model with randomly placed agents stored as arrays.
+        """
+        rng = numpy.random.default_rng(0)
+        environment = agentframework.Environment(
+            numpy.full((length, length), float(value)))
+        return self.FakeModel(agentframework.AgentArrays(
+            environment, rng.integers(0, length, num_of_agents),
+            rng.integers(0, length, num_of_agents), None, 100, 10))
+
+
+    def test_batched(self):
+        """
+        Test that pipelines are batched only if every stage is.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.assertFalse(Pipeline().batched)
+        self.assertTrue(Pipeline(interaction=NoInteraction()).batched)
+        self.assertTrue(Pipeline(interaction=NeighbourSharing()).batched)
+
+
+    def test_run_batched(self):
+        """
+        Test that batched iterations conserve resources and never feed
+        agents from cells without enough resource.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for interaction in (NoInteraction(), NeighbourSharing(),
+                            NeighbourSharing("diffusion")):
+            random.seed(0)
+            model = self.create_model()
+            agents = model.agents
+            pipeline = Pipeline(interaction=interaction)
+            total = agents.store.sum() + model.environment.plane.sum()
+
+            for _ in range(10):
+                active, eaten, share_events = pipeline.run(model)
+                self.assertAlmostEqual(agents.store.sum() +
+                                       model.environment.plane.sum(), total)
+
+            # Verify agents only ate from cells holding more than a bite
+            self.assertTrue((model.environment.plane >= 5).all())
+            self.assertEqual(share_events > 0,
+                             not isinstance(interaction, NoInteraction))
+            self.assertGreater(active, 0)
+
+
+    def test_grazing_order(self):
+        """
+        Test that batched feeding matches feeding each agent in turn order,
+        for agents of several species crowded onto few cells.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        rng = numpy.random.default_rng(1)
+        species = [(agentframework.Species("small", 0, 10), 60),
+                   (agentframework.Species("large", 0, 25), 40)]
+        models = []
+        for _ in range(2):
+            environment = agentframework.Environment(
+                rng.integers(0, 80, (4, 4)).astype(numpy.float64))
+            models.append(self.FakeModel(agentframework.AgentArrays(
+                environment, numpy.arange(100) % 4, numpy.arange(100) // 25,
+                species=species)))
+        models[1].environment.plane[:] = models[0].environment.plane
+        order = rng.permutation(100)
+
+        # Feed each agent in turn, then all agents at once
+        grazing = Grazing()
+        eaten = sum(grazing.apply(models[0].agents[i], None) for i in order)
+        self.assertEqual(grazing.apply_batch(models[1].agents, order,
+                                             Context(models[1])), eaten)
+        self.assertTrue(numpy.array_equal(models[0].environment.plane,
+                                          models[1].environment.plane))
+        self.assertTrue(numpy.array_equal(models[0].agents.store,
+                                          models[1].agents.store))
+        self.assertGreater(eaten, 0)
+
+
+    def test_run_per_agent(self):
+        """
+        Test that the per-agent path counts eaten resource and shares.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        random.seed(0)
+        model = self.create_model(num_of_agents=50)
+        agents = model.agents
+        before = agents.store.sum()
+        active, eaten, share_events = Pipeline().run(model)
+        self.assertEqual(active, 50)
+        self.assertEqual(agents.store.sum() - before, eaten)
+        self.assertGreater(share_events, 0)
+
+
+    def test_run_compiled(self):
+        """
+        Test that compiled and Python kernels give the same iterations from
+        the same seed, conserving resources.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        results = []
+        for compiled in (True, False):
+            random.seed(0)
+            model = self.create_model()
+            agents = model.agents
+            pipeline = CompiledPipeline(compiled)
+            self.assertTrue(pipeline.batched)
+            total = agents.store.sum() + model.environment.plane.sum()
+            counts = [pipeline.run(model) for _ in range(5)]
+            self.assertAlmostEqual(agents.store.sum() +
+                                   model.environment.plane.sum(), total)
+            results.append((counts, agents.y, agents.store))
+
+        (counts, ys, stores), (other_counts, other_ys, other_stores) = results
+        self.assertEqual(counts, other_counts)
+        self.assertTrue(numpy.array_equal(ys, other_ys))
+        self.assertTrue(numpy.array_equal(stores, other_stores))
+        self.assertGreater(counts[0][2], 0)
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,644 @@
+"""
+Agent-Based Model Benchmarks
+============================
+
+Timings for the performance-sensitive parts of the model. Run this module
+as a script to print the results:
+
+    python benchmark.py
+"""
+
+import os
+import random
+import tempfile
+import time
+import types
+import numpy
+import agentframework
+import behaviours
+import ensemble
+import kernels
+import loaders
+import model
+import neighbourhood
+import parallel
+import regrowth
+import sharing
+
+
+def time_call(function, repeat=3):
+    """
+    Return the best time taken to call the given function.
+
+    Parameters
+    ----------
+    function : callable
+        Function to time, called with no arguments.
+    repeat : int, optional
+        Number of times to call the function. The default is 3.
+
+    Returns
+    -------
+    float
+        The shortest call duration in seconds.
+
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def create_agents(num_of_agents, x_length, y_length, seed=0):
+    """
+    Return a randomly placed set of agents in an empty environment.
+
+    Parameters
+    ----------
+    num_of_agents : int
+        Number of agents to create.
+    x_length : int
+        Environment x-axis length.
+    y_length : int
+        Environment y-axis length.
+    seed : int, optional
+        Random seed for the agent positions. The default is 0.
+
+    Returns
+    -------
+    list[agentframework.Agent]
+        The created agents.
+
+    """
+
+    random.seed(seed)
+    environment = agentframework.Environment(
+        [[0] * x_length for _ in range(y_length)])
+    agents = []
+    for _ in range(num_of_agents):
+        agents.append(agentframework.Agent(
+            environment, agents, random.randint(0, y_length - 1),
+            random.randint(0, x_length - 1)))
+    return agents
+
+
+def benchmark_neighbour_strategies(agent_counts=(50, 500, 1000),
+                                   neighbourhood_sizes=(2, 5, 10, 20, 50),
+                                   x_length=100, y_length=100):
+    """
+    Time one iteration of neighbour searches for each strategy.
+
+    Each timing covers building the index, then moving every agent and
+    finding its neighbours, as done in `Model.iterate`.
+
+    Parameters
+    ----------
+    agent_counts : tuple[int], optional
+        Numbers of agents to test.
+    neighbourhood_sizes : tuple[int], optional
+        Neighbourhood sizes to test.
+    x_length : int, optional
+        Environment x-axis length. The default is 100.
+    y_length : int, optional
+        Environment y-axis length. The default is 100.
+
+    Returns
+    -------
+    list[tuple]
+        Rows of (agents, neighbourhood size, auto strategy, brute time,
+        grid time, sweep time).
+
+    """
+
+    results = []
+    for num_of_agents in agent_counts:
+        agents = create_agents(num_of_agents, x_length, y_length)
+        environment = agents[0].environment
+
+        for neighbourhood_size in neighbourhood_sizes:
+            timings = []
+            for strategy in ("brute", "grid", "sweep"):
+
+                def iterate():
+                    index = neighbourhood.create_index(
+                        strategy, agents, environment, neighbourhood_size)
+                    for agent in agents:
+                        y, x = agent.y, agent.x
+                        agent.move()
+                        index.move(agent, y, x)
+                        index.neighbours(agent)
+
+                timings.append(time_call(iterate))
+
+            results.append((num_of_agents, neighbourhood_size,
+                            neighbourhood.select_strategy(
+                                num_of_agents, neighbourhood_size,
+                                x_length, y_length))
+                           + tuple(timings))
+    return results
+
+
+def benchmark_sharing(agent_counts=(1000, 10000, 50000), length=500,
+                      neighbourhood_size=5):
+    """
+    Time sharing stores between all neighbours, agent by agent using a grid
+    index and in bulk using each sharing mode.
+
+    Parameters
+    ----------
+    agent_counts : tuple[int], optional
+        Numbers of agents to time. The default is (1000, 10000, 50000).
+    length : int, optional
+        Environment x-axis and y-axis length. The default is 500.
+    neighbourhood_size : int, optional
+        Size of the neighbourhood. The default is 5.
+
+    Returns
+    -------
+    list[tuple[int, int, float, float, float, float]]
+        Rows of (agents, neighbour pairs, per-agent seconds, graph seconds,
+        sequential seconds, diffusion seconds).
+
+    """
+
+    results = []
+    for num_of_agents in agent_counts:
+        rng = numpy.random.default_rng(0)
+        environment = agentframework.Environment(
+            numpy.zeros((length, length)))
+        agents = agentframework.AgentArrays(
+            environment, rng.integers(0, length, num_of_agents),
+            rng.integers(0, length, num_of_agents),
+            rng.integers(0, 100, num_of_agents))
+        order = rng.permutation(num_of_agents)
+        stores = agents.store.copy()
+
+        def share_per_agent():
+            agents.store[:] = stores
+            index = neighbourhood.create_index(
+                "grid", list(agents), environment, neighbourhood_size)
+            for i in order:
+                agents[i].share_with_neighbours(neighbourhood_size,
+                                                index=index)
+
+        def build_graph():
+            return neighbourhood.neighbour_graph(
+                agents.y, agents.x, neighbourhood_size, length, length)
+
+        graph = build_graph()
+        results.append((num_of_agents, len(graph[1]),
+                        time_call(share_per_agent, 1),
+                        time_call(build_graph))
+                       + tuple(time_call(lambda: sharing.share(
+                           stores.copy(), order, *graph, mode))
+                               for mode in sharing.modes))
+    return results
+
+
+def benchmark_neighbour_graph(agent_counts=(10000, 50000), length=1000,
+                              neighbourhood_size=10,
+                              moving_fractions=(1.0, 0.1, 0.01),
+                              skins=(0, 2, 4), num_of_iterations=10):
+    """
+    Time finding the neighbours of moving agents, building a new graph each
+    iteration and updating a reused graph with each skin.
+
+    Parameters
+    ----------
+    agent_counts : tuple[int], optional
+        Numbers of agents to time. The default is (10000, 50000).
+    length : int, optional
+        Environment x-axis and y-axis length. The default is 1000.
+    neighbourhood_size : int, optional
+        Size of the neighbourhood. The default is 10.
+    moving_fractions : tuple[float], optional
+        Fractions of the agents taking a random step each iteration. The
+        default is (1.0, 0.1, 0.01).
+    skins : tuple[int], optional
+        Skins of the reused graphs. The default is (0, 2, 4).
+    num_of_iterations : int, optional
+        Number of iterations to time. The default is 10.
+
+    Returns
+    -------
+    list[tuple]
+        Rows of (agents, moving fraction, new graph seconds, then reused
+        graph seconds for each skin), per iteration.
+
+    """
+
+    results = []
+    for num_of_agents in agent_counts:
+        for fraction in moving_fractions:
+            row = [num_of_agents, fraction]
+            for skin in (None,) + tuple(skins):
+                rng = numpy.random.default_rng(0)
+                ys = rng.integers(0, length, num_of_agents)
+                xs = rng.integers(0, length, num_of_agents)
+                graph = None
+                if skin is not None:
+                    graph = neighbourhood.NeighbourGraph(
+                        neighbourhood_size, length, length, skin=skin)
+                    graph.update(ys, xs)
+
+                duration = 0
+                for _ in range(num_of_iterations):
+                    # Move some of the agents a random step
+                    moved = rng.random(num_of_agents) < fraction
+                    steps = rng.integers(-1, 2, (2, num_of_agents)) * moved
+                    ys = (ys + steps[0]) % length
+                    xs = (xs + steps[1]) % length
+
+                    start = time.perf_counter()
+                    if graph is None:
+                        neighbourhood.neighbour_graph(
+                            ys, xs, neighbourhood_size, length, length)
+                    else:
+                        graph.update(ys, xs)
+                    duration += time.perf_counter() - start
+                row.append(duration / num_of_iterations)
+            results.append(tuple(row))
+    return results
+
+
+def benchmark_kernels(agent_counts=(1000, 5000), length=300,
+                      neighbourhood_size=5):
+    """
+    Time one iteration of agents taking turns to move, eat and share, on
+    the per-agent path of a pipeline and with the Python and compiled
+    kernels.
+
+    Parameters
+    ----------
+    agent_counts : tuple[int], optional
+        Numbers of agents to time. The default is (1000, 5000).
+    length : int, optional
+        Environment x-axis and y-axis length. The default is 300.
+    neighbourhood_size : int, optional
+        Size of the neighbourhood. The default is 5.
+
+    Returns
+    -------
+    list[tuple[int, float, float, float]]
+        Rows of (agents, per-agent seconds, Python kernel seconds, compiled
+        kernel seconds). The compiled kernel timing is None if Numba is not
+        installed.
+
+    """
+
+    results = []
+    for num_of_agents in agent_counts:
+        row = [num_of_agents]
+        pipelines = [behaviours.Pipeline(), behaviours.CompiledPipeline(False)]
+        if kernels.numba is not None:
+            pipelines.append(behaviours.CompiledPipeline())
+        for pipeline in pipelines:
+
+            def iterate():
+                random.seed(0)
+                rng = numpy.random.default_rng(0)
+                environment = agentframework.Environment(
+                    numpy.full((length, length), 100.0))
+                agents = agentframework.AgentArrays(
+                    environment, rng.integers(0, length, num_of_agents),
+                    rng.integers(0, length, num_of_agents))
+                model = types.SimpleNamespace(
+                    environment=environment, agents=agents,
+                    neighbourhood_size=neighbourhood_size,
+                    toroidal_neighbourhood=False, neighbour_strategy="auto")
+                pipeline.run(model)
+
+            # The first call compiles the kernel, so is not counted
+            iterate()
+            row.append(time_call(iterate))
+        if kernels.numba is None:
+            row.append(None)
+        results.append(tuple(row))
+    return results
+
+
+def benchmark_ensemble(replicate_counts=(10, 100), num_of_iterations=50):
+    """
+    Time running replicates of the default model, each as its own Model and
+    together as an ensemble in each sharing mode.
+
+    Parameters
+    ----------
+    replicate_counts : tuple[int], optional
+        Numbers of replicates to time. The default is (10, 100).
+    num_of_iterations : int, optional
+        Number of iterations of each replicate. The default is 50.
+
+    Returns
+    -------
+    list[tuple[int, float, float, float]]
+        Rows of (replicates, separate models seconds, sequential ensemble
+        seconds, diffusion ensemble seconds).
+
+    """
+
+    def create_model(seed):
+        replicate = model.Model(initialize=False)
+        replicate.set_parameters(
+            num_of_iterations=num_of_iterations, start_positions_url="",
+            environment_filepath=model.default_environment_filepath,
+            environment_x_lim=model.default_environment_limit,
+            environment_y_lim=model.default_environment_limit, seed=seed)
+        replicate.initialize()
+        return replicate
+
+    results = []
+    for num_of_replicates in replicate_counts:
+
+        def run_models():
+            for seed in range(num_of_replicates):
+                replicate = create_model(seed)
+                for _ in range(num_of_iterations):
+                    if replicate.iterate():
+                        break
+
+        row = [num_of_replicates, time_call(run_models, 1)]
+        for mode in sharing.modes:
+            row.append(time_call(lambda: ensemble.create_ensemble(
+                create_model(0), num_of_replicates, sharing_mode=mode).run(),
+                                 1))
+        results.append(tuple(row))
+    return results
+
+
+def benchmark_parallel(num_of_agents=100000, length=1000,
+                       neighbourhood_size=5, worker_counts=None,
+                       iterations=3):
+    """
+    Time parallel iterations for increasing numbers of worker processes.
+
+    The same tiling is used for every worker count, so each run does the
+    same work.
+
+    Parameters
+    ----------
+    num_of_agents : int, optional
+        Number of agents. The default is 100000.
+    length : int, optional
+        Environment x-axis and y-axis length. The default is 1000.
+    neighbourhood_size : int, optional
+        Size of the neighbourhood. The default is 5.
+    worker_counts : tuple[int], optional
+        Numbers of workers to test. If None, powers of two up to the number
+        of CPUs are used.
+    iterations : int, optional
+        Number of iterations to time. The default is 3.
+
+    Returns
+    -------
+    list[tuple[int, float]]
+        Rows of (workers, seconds per iteration).
+
+    """
+
+    if worker_counts is None:
+        cpus = os.cpu_count() or 1
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= cpus:
+            worker_counts.append(worker_counts[-1] * 2)
+
+    # Use enough tiles for the largest number of workers
+    tiles = parallel.tile_counts(length, length, neighbourhood_size,
+                                 max(worker_counts))
+
+    results = []
+    for num_of_workers in worker_counts:
+        rng = numpy.random.default_rng(0)
+        environment = agentframework.Environment(
+            numpy.full((length, length), 1000.0))
+        agents = agentframework.AgentArrays(
+            environment, rng.integers(0, length, num_of_agents),
+            rng.integers(0, length, num_of_agents), None, 0, 10)
+        executor = parallel.TiledExecutor(environment, agents,
+                                          neighbourhood_size,
+                                          num_of_workers=num_of_workers,
+                                          tiles=tiles)
+        try:
+            executor.iterate()
+            start = time.perf_counter()
+            for _ in range(iterations):
+                executor.iterate()
+            duration = (time.perf_counter() - start) / iterations
+        finally:
+            executor.close()
+        results.append((num_of_workers, duration))
+    return results
+
+
+def benchmark_loaders(length=1000):
+    """
+    Time loading the same environment plane from each file format.
+
+    Parameters
+    ----------
+    length : int, optional
+        Environment x-axis and y-axis length. The default is 1000.
+
+    Returns
+    -------
+    list[tuple[str, int, float]]
+        Rows of (format, bytes read, seconds).
+
+    """
+
+    plane = numpy.random.default_rng(0).integers(0, 256, (length, length))
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+
+        # Write the plane in each format
+        paths = {name: os.path.join(directory, "plane." + name)
+                 for name in ("csv", "npy", "npz", "grid")}
+        numpy.savetxt(paths["csv"], plane, fmt="%d", delimiter=",")
+        numpy.save(paths["npy"], plane.astype(numpy.float64))
+        numpy.savez(paths["npz"], plane=plane.astype(numpy.float64))
+        loaders.save_grid(paths["grid"], plane.astype(numpy.float64))
+
+        # Time loading each file
+        for name, path in paths.items():
+            seconds = time_call(lambda: loaders.load_environment(path))
+            _, report = loaders.load_environment(path)
+            results.append((name, report["bytes_read"], seconds))
+    return results
+
+
+def benchmark_reset(agent_counts=(1000, 100000), length=1000):
+    """
+    Time resetting the model from its initial state against initializing it
+    again, with agents as objects and as arrays.
+
+    Parameters
+    ----------
+    agent_counts : tuple[int], optional
+        Numbers of agents to time. The default is (1000, 100000).
+    length : int, optional
+        Environment x-axis and y-axis length. The default is 1000.
+
+    Returns
+    -------
+    list[tuple[int, str, float, float]]
+        Rows of (agents, agent storage, initialize seconds, reset seconds).
+
+    """
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "plane.npy")
+        numpy.save(path, numpy.random.default_rng(0).integers(
+            0, 256, (length, length)).astype(numpy.float64))
+        for num_of_agents in agent_counts:
+            for storage in ("objects", "arrays"):
+                benchmarked = model.Model(initialize=False)
+                benchmarked.set_parameters(
+                    num_of_agents, start_positions_url="",
+                    environment_filepath=path, environment_x_lim=length,
+                    environment_y_lim=length)
+                if storage == "arrays":
+                    benchmarked.behaviours = behaviours.Pipeline(
+                        interaction=behaviours.NoInteraction())
+                benchmarked.initialize()
+                results.append((num_of_agents, storage,
+                                time_call(benchmarked.initialize),
+                                time_call(benchmarked.reset)))
+    return results
+
+
+def benchmark_regrowth(agent_counts=(1000, 10000, 100000), length=2000,
+                       num_of_iterations=20, rate=5.0):
+    """
+    Time regrowing the environment after agents eat, checking only the
+    depleted cells and the cells under agents or scanning the whole plane.
+
+    Parameters
+    ----------
+    agent_counts : tuple[int], optional
+        Numbers of agents to time. The default is (1000, 10000, 100000).
+    length : int, optional
+        Environment x-axis and y-axis length. The default is 2000.
+    num_of_iterations : int, optional
+        Number of iterations to run. The default is 20.
+    rate : float, optional
+        Regrowth rate of every cell. The default is 5.0.
+
+    Returns
+    -------
+    list[tuple[int, int, float, float]]
+        Rows of (agents, depleted cells at the end, incremental seconds per
+        iteration, full scan seconds per iteration).
+
+    """
+
+    results = []
+    for num_of_agents in agent_counts:
+        row = [num_of_agents]
+        for incremental in (True, False):
+            rng = numpy.random.default_rng(0)
+            environment = agentframework.Environment(
+                numpy.full((length, length), 100.0))
+            agents = agentframework.AgentArrays(
+                environment, rng.integers(0, length, num_of_agents),
+                rng.integers(0, length, num_of_agents), None, 10 ** 9, 10)
+            regrower = regrowth.Regrowth(environment, rate)
+
+            # Move and feed the agents, timing only the regrowth
+            duration = 0
+            for _ in range(num_of_iterations):
+                agents.y[:] = (agents.y + rng.integers(-1, 2, num_of_agents)) \
+                    % length
+                agents.x[:] = (agents.x + rng.integers(-1, 2, num_of_agents)) \
+                    % length
+                environment.plane[agents.y, agents.x] -= agents.bite_size
+                start = time.perf_counter()
+                regrower.apply(agents if incremental else None)
+                duration += time.perf_counter() - start
+            if incremental:
+                row.append(len(regrower.depleted))
+            row.append(duration / num_of_iterations)
+        results.append(tuple(row))
+    return results
+
+
+def main():
+    print("Neighbour search, one iteration on a 100x100 environment (ms)")
+    print("{:>7} {:>6} {:>6} {:>9} {:>9} {:>9}".format(
+        "agents", "size", "auto", "brute", "grid", "sweep"))
+    for row in benchmark_neighbour_strategies():
+        print("{:>7} {:>6} {:>6} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+            *row[:3], *(timing * 1000 for timing in row[3:])))
+
+    print()
+    print("Sharing, one iteration on a 500x500 environment (ms)")
+    print("{:>7} {:>8} {:>10} {:>8} {:>11} {:>10}".format(
+        "agents", "pairs", "per-agent", "graph", "sequential", "diffusion"))
+    for row in benchmark_sharing():
+        print("{:>7} {:>8} {:>10.2f} {:>8.2f} {:>11.2f} {:>10.2f}".format(
+            *row[:2], *(timing * 1000 for timing in row[2:])))
+
+    print()
+    print("Neighbour graph, one iteration on a 1000x1000 environment (ms)")
+    print("{:>7} {:>7} {:>8} {:>8} {:>8} {:>8}".format(
+        "agents", "moving", "new", "skin 0", "skin 2", "skin 4"))
+    for row in benchmark_neighbour_graph():
+        print("{:>7} {:>7.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f}".format(
+            *row[:2], *(timing * 1000 for timing in row[2:])))
+
+    print()
+    print("Agent turns, one iteration on a 300x300 environment (ms)")
+    print("{:>7} {:>10} {:>8} {:>9}".format("agents", "per-agent", "python",
+                                           "compiled"))
+    for row in benchmark_kernels():
+        print("{:>7} {:>10.2f} {:>8.2f} {:>9}".format(
+            row[0], row[1] * 1000, row[2] * 1000,
+            "n/a" if row[3] is None else "{:.2f}".format(row[3] * 1000)))
+
+    print()
+    print("Replicates of the default model, 50 iterations (s)")
+    print("{:>10} {:>8} {:>11} {:>10}".format("replicates", "models",
+                                             "sequential", "diffusion"))
+    for row in benchmark_ensemble():
+        print("{:>10} {:>8.2f} {:>11.2f} {:>10.2f}".format(*row))
+
+    print()
+    print("Environment loading, 1000x1000 plane")
+    print("{:>6} {:>10} {:>9}".format("format", "bytes", "ms"))
+    for name, bytes_read, seconds in benchmark_loaders():
+        print("{:>6} {:>10} {:>9.2f}".format(name, bytes_read,
+                                            seconds * 1000))
+
+    print()
+    print("Model reset on a 1000x1000 environment (ms)")
+    print("{:>7} {:>8} {:>11} {:>7}".format("agents", "storage",
+                                            "initialize", "reset"))
+    for num_of_agents, storage, initialize, reset in benchmark_reset():
+        print("{:>7} {:>8} {:>11.2f} {:>7.2f}".format(
+            num_of_agents, storage, initialize * 1000, reset * 1000))
+
+    print()
+    print("Regrowth, one iteration on a 2000x2000 environment (ms)")
+    print("{:>7} {:>9} {:>11} {:>9}".format("agents", "depleted",
+                                            "incremental", "full"))
+    for num_of_agents, depleted, incremental, full in benchmark_regrowth():
+        print("{:>7} {:>9} {:>11.2f} {:>9.2f}".format(
+            num_of_agents, depleted, incremental * 1000, full * 1000))
+
+    print()
+    print("Parallel iteration, 100000 agents on a 1000x1000 environment")
+    print("{:>7} {:>9} {:>8}".format("workers", "s/iter", "speedup"))
+    results = benchmark_parallel()
+    for num_of_workers, duration in results:
+        print("{:>7} {:>9.3f} {:>8.2f}".format(
+            num_of_workers, duration, results[0][1] / duration))
+
+
+# Run the benchmarks when invoked as a script
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,558 @@
+"""
+Model Configuration
+===================
+
+Reads model parameters from TOML or JSON configuration files, validates
+them against a schema and records run manifests.
+
+A configuration file holds parameter values at its top level. It may also
+hold a list of runs, each overriding some of the top-level values:
+
+    num_of_agents = 100
+    environment_filepath = "in.txt"
+
+    [[runs]]
+    neighbourhood_size = 5
+
+    [[runs]]
+    neighbourhood_size = 10
+
+The top-level values are validated once and shared by every run, so only
+the overridden values are validated for each run.
+
+A manifest records everything needed to reproduce a run: its parameters,
+its random seed and a hash of each input file.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+
+try:
+    import tomllib
+except ImportError:
+    # TOML files are only supported from Python 3.11
+    tomllib = None
+
+# Size of the blocks read when hashing files, in bytes
+hash_block_size = 2 ** 20
+
+# File hashes, keyed by path, size and modification time
+_file_hashes = {}
+
+
+class ConfigError(Exception):
+    """
+    Raised when a configuration is invalid or cannot be read.
+    """
+
+
+
+class Parameter():
+    """
+    The Parameter class describes the type, default value and allowed values
+    of a model parameter.
+
+    Public Methods:
+
+        validate - returns the given value, if valid
+
+        parse - returns the value given as text, such as from an entry field
+    """
+
+    def __init__(self, kind, default, label, choices=None, minimum=None,
+                 nullable=False):
+        """
+        Instantiate a Parameter.
+
+        Parameters
+        ----------
+        kind : type
+            Type of the value: int, float, bool or str.
+        default : object
+            Default value.
+        label : str
+            Description of the parameter used in error messages.
+        choices : tuple, optional
+            Allowed values. If None, any value of the right type is allowed.
+            The default is None.
+        minimum : int or float, optional
+            Smallest allowed value. The default is None.
+        nullable : bool, optional
+            Whether None is allowed. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.kind = kind
+        self.default = default
+        self.label = label
+        self.choices = choices
+        self.minimum = minimum
+        self.nullable = nullable
+
+
+    def validate(self, value):
+        """
+        Return the given value, if it is valid.
+
+        Integers are accepted for float parameters and converted.
+
+        Parameters
+        ----------
+        value : object
+            The value to validate.
+
+        Raises
+        ------
+        ConfigError
+            If the value is not valid.
+
+        Returns
+        -------
+        object
+            The validated value.
+
+        """
+
+        if value is None:
+            if self.nullable:
+                return None
+            raise ConfigError("{} must be set".format(self.label))
+
+        # Check the type, noting that bool is a subclass of int
+        if self.kind is float and type(value) is int:
+            value = float(value)
+        if type(value) is not self.kind:
+            raise ConfigError("{} must be {}".format(
+                self.label, _type_names[self.kind]))
+
+        if self.choices is not None and value not in self.choices:
+            raise ConfigError("{} must be one of: {}".format(
+                self.label, ", ".join(str(choice)
+                                      for choice in self.choices)))
+        if self.minimum is not None and value < self.minimum:
+            raise ConfigError("{} must be at least {}".format(
+                self.label, self.minimum))
+        return value
+
+
+    def parse(self, text):
+        """
+        Return the value given as text, if it is valid.
+
+        Parameters
+        ----------
+        text : str
+            The value as text.
+
+        Raises
+        ------
+        ConfigError
+            If the text is not a valid value.
+
+        Returns
+        -------
+        object
+            The parsed value.
+
+        """
+
+        if self.kind is str:
+            return self.validate(text)
+        if self.kind is bool:
+            value = {"true": True, "false": False}.get(text.strip().lower())
+        else:
+            try:
+                value = self.kind(text)
+            except ValueError:
+                value = None
+        if value is None:
+            raise ConfigError("{} must be {}".format(
+                self.label, _type_names[self.kind]))
+        return self.validate(value)
+
+
+# Names of parameter types, used in error messages
+_type_names = {int: "an integer", float: "a number", bool: "true or false",
+               str: "text"}
+
+
+
+class Schema():
+    """
+    The Schema class validates sets of model parameters.
+
+    Public Methods:
+
+        defaults - returns the default value of each parameter
+
+        validate - returns validated parameters, merged over a base
+
+        parse - returns a parameter value given as text
+    """
+
+    def __init__(self, parameters):
+        """
+        Instantiate a Schema.
+
+        Parameters
+        ----------
+        parameters : dict[str, Parameter]
+            Parameters, keyed by name.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.parameters = dict(parameters)
+
+
+    def defaults(self):
+        """
+        Return the default value of each parameter.
+
+        Returns
+        -------
+        dict
+            Default values, keyed by parameter name.
+
+        """
+
+        return {name: parameter.default
+                for name, parameter in self.parameters.items()}
+
+
+    def validate(self, values, base=None):
+        """
+        Return the given values validated and merged over a base.
+
+        Parameters
+        ----------
+        values : dict
+            Parameter values to validate.
+        base : dict, optional
+            Values that have already been validated, which are not checked
+            again. If None, the defaults are used. The default is None.
+
+        Raises
+        ------
+        ConfigError
+            If any value is not valid or any parameter is unknown.
+
+        Returns
+        -------
+        dict
+            The base values updated with the validated values.
+
+        """
+
+        validated = self.defaults() if base is None else dict(base)
+        for name, value in values.items():
+            if name not in self.parameters:
+                raise ConfigError("Unknown parameter: {}".format(name))
+            validated[name] = self.parameters[name].validate(value)
+        return validated
+
+
+    def parse(self, name, text):
+        """
+        Return the value of the named parameter given as text.
+
+        Parameters
+        ----------
+        name : str
+            Parameter name.
+        text : str
+            The value as text.
+
+        Raises
+        ------
+        ConfigError
+            If the text is not a valid value.
+
+        Returns
+        -------
+        object
+            The parsed value.
+
+        """
+
+        return self.parameters[name].parse(text)
+
+
+
+def read_file(filepath):
+    """
+    Return the contents of a TOML or JSON configuration file.
+
+    The format is chosen from the file extension: ".toml" for TOML and
+    anything else for JSON.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the configuration file.
+
+    Raises
+    ------
+    ConfigError
+        If the file cannot be read or parsed.
+
+    Returns
+    -------
+    dict
+        The file contents.
+
+    """
+
+    try:
+        if filepath.lower().endswith(".toml"):
+            if tomllib is None:
+                raise ConfigError(
+                    "TOML configuration files require Python 3.11 or later")
+            with open(filepath, "rb") as f:
+                contents = tomllib.load(f)
+        else:
+            with open(filepath) as f:
+                contents = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ConfigError("Cannot read configuration file {}: {}".format(
+            filepath, e)) from e
+
+    if not isinstance(contents, dict):
+        raise ConfigError("Configuration file {} must hold a table".format(
+            filepath))
+    return contents
+
+
+def load_configs(filepath, schema):
+    """
+    Return the validated parameters of each run in a configuration file.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the TOML or JSON configuration file.
+    schema : Schema
+        Schema to validate the parameters with.
+
+    Raises
+    ------
+    ConfigError
+        If the file cannot be read or any value is not valid.
+
+    Returns
+    -------
+    list[dict]
+        Parameters of each run, or of a single run if the file has no list
+        of runs.
+
+    """
+
+    contents = read_file(filepath)
+    runs = contents.pop("runs", [{}])
+    if not isinstance(runs, list) or \
+            not all(isinstance(run, dict) for run in runs):
+        raise ConfigError("Runs must be a list of tables")
+
+    # Validate the shared values once, then only the values of each run
+    shared = schema.validate(contents)
+    return [schema.validate(run, shared) for run in runs]
+
+
+def file_hash(filepath):
+    """
+    Return the SHA-256 hash of a file.
+
+    Hashes are cached until the file size or modification time changes, so
+    inputs shared by many runs are only read once.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the file to hash.
+
+    Returns
+    -------
+    str
+        Hexadecimal hash of the file contents.
+
+    """
+
+    stat = os.stat(filepath)
+    key = (os.path.realpath(filepath), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(hash_block_size), b""):
+                digest.update(block)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+def create_manifest(parameters, seed, input_files=()):
+    """
+    Return a manifest recording how to reproduce a run.
+
+    Parameters
+    ----------
+    parameters : dict
+        Parameter values of the run.
+    seed : int
+        Random seed of the run.
+    input_files : tuple[str], optional
+        Paths of the files read by the run. Paths that are not local files,
+        such as URLs, are recorded without a hash. The default is ().
+
+    Returns
+    -------
+    dict
+        The parameters, seed and a hash of each input file.
+
+    """
+
+    return {
+        "parameters": dict(parameters),
+        "seed": seed,
+        "inputs": {path: file_hash(path) if os.path.isfile(path) else None
+                   for path in input_files},
+    }
+
+
+def write_manifest(filepath, manifest):
+    """
+    Write a manifest to a JSON file.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the file to write.
+    manifest : dict
+        The manifest to write.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    with open(filepath, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+
+class ConfigTestCase(unittest.TestCase):
+    """
+    The ConfigTestCase class provides a collection of unit tests for reading
+    and validating configurations.
+    """
+
+    schema = Schema({
+        "num_of_agents": Parameter(int, 10, "Number of agents", minimum=0),
+        "bite_size": Parameter(float, 5.0, "Bite size"),
+        "mode": Parameter(str, "a", "Mode", choices=("a", "b")),
+        "limit": Parameter(int, None, "Limit", nullable=True),
+    })
+
+
+    def write(self, directory, filename, text):
+        """
+        Write a file in the given directory, returning its path.
+        """
+        filepath = os.path.join(directory, filename)
+        with open(filepath, "w") as f:
+            f.write(text)
+        return filepath
+
+
+    def test_validate(self):
+        """
+        Test that values are checked and merged over the defaults.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        values = self.schema.validate({"bite_size": 2, "limit": None})
+        self.assertEqual(values, {"num_of_agents": 10, "bite_size": 2.0,
+                                  "mode": "a", "limit": None})
+        self.assertEqual(self.schema.parse("num_of_agents", "7"), 7)
+
+        for invalid in ({"num_of_agents": True}, {"num_of_agents": -1},
+                        {"mode": "c"}, {"bite_size": "2"},
+                        {"num_of_agents": None}, {"unknown": 1}):
+            with self.assertRaises(ConfigError):
+                self.schema.validate(invalid)
+        with self.assertRaises(ConfigError):
+            self.schema.parse("num_of_agents", "seven")
+
+
+    def test_load_configs(self):
+        """
+        Test that runs in TOML and JSON files share the top-level values.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [self.write(directory, "runs.json", json.dumps(
+                {"num_of_agents": 3, "runs": [{"mode": "b"}, {}]}))]
+            if tomllib is not None:
+                paths.append(self.write(
+                    directory, "runs.toml",
+                    "num_of_agents = 3\n[[runs]]\nmode = 'b'\n[[runs]]\n"))
+
+            for path in paths:
+                runs = load_configs(path, self.schema)
+                self.assertEqual([(run["num_of_agents"], run["mode"])
+                                  for run in runs], [(3, "b"), (3, "a")])
+
+            # Verify invalid files are reported
+            with self.assertRaises(ConfigError):
+                load_configs(self.write(directory, "bad.json", "[1]"),
+                             self.schema)
+            with self.assertRaises(ConfigError):
+                load_configs(os.path.join(directory, "missing.json"),
+                             self.schema)
+
+
+    def test_manifest(self):
+        """
+        Test that manifests record a hash of each input file.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = self.write(directory, "in.txt", "1,2\n")
+            manifest = create_manifest({"num_of_agents": 3}, 42,
+                                       (filepath, "http://example.com"))
+            self.assertEqual(manifest["inputs"][filepath],
+                             hashlib.sha256(b"1,2\n").hexdigest())
+            self.assertIsNone(manifest["inputs"]["http://example.com"])
+
+            manifest_path = os.path.join(directory, "manifest.json")
+            write_manifest(manifest_path, manifest)
+            with open(manifest_path) as f:
+                self.assertEqual(json.load(f), manifest)
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,446 @@
+"""
+Model Ensembles
+===============
+
+Runs many replicates of a small model together, stacking them along a
+leading array axis so that each iteration advances every replicate in a
+few array operations.
+
+Each replicate holds its own agents and its own copy of the environment,
+and draws from its own random number generator. A replicate gives the same
+results whichever ensemble it is run in, as long as it has the same seed.
+Once a replicate is done, because none of its agents can eat or it has run
+the configured number of iterations, it is left unchanged while the others
+carry on.
+
+Replicates behave as a model running the batched behaviours: agents that
+can eat move a random step, feed in a random turn order and share with
+their neighbours using one of the `sharing.modes`. Neighbours are found by
+comparing every pair of agents within each replicate, which suits the
+small models ensembles are meant for.
+"""
+
+import unittest
+import numpy
+import agentframework
+import sharing
+
+
+class Ensemble():
+    """
+    The Ensemble class runs replicates of a model stacked in arrays.
+
+    Agent positions and stores are held in arrays with a row per replicate,
+    and environment planes in an array with a plane per replicate.
+
+    Public Methods:
+
+        iterate - runs a single iteration of every replicate not yet done
+
+        run - iterates until every replicate is done
+
+        replicate - returns the agents and environment of a replicate
+    """
+
+    def __init__(self, plane, num_of_replicates, num_of_agents, seeds=None,
+                 num_of_iterations=100, neighbourhood_size=5, store_size=0,
+                 bite_size=10, toroidal=False, sharing_mode="sequential",
+                 regrowth_rate=0):
+        """
+        Instantiate an Ensemble.
+
+        Parameters
+        ----------
+        plane : array_like
+            2-D environment plane copied into each replicate.
+        num_of_replicates : int
+            Number of replicates.
+        num_of_agents : int
+            Number of agents in each replicate, placed at random.
+        seeds : int or list[int], optional
+            Random seed of each replicate, or a seed from which the seed of
+            each replicate is derived. If None, fresh entropy is used. The
+            default is None.
+        num_of_iterations : int, optional
+            Number of iterations after which a replicate is done. The
+            default is 100.
+        neighbourhood_size : int, optional
+            Size of the neighbourhood. The default is 5.
+        store_size : int, optional
+            Maximum capacity for each store. If <= 0, there is no store
+            limit. The default is 0.
+        bite_size : int, optional
+            Amount of resources consumed in a single bite. The default is 10.
+        toroidal : bool, optional
+            Measure distances across the environment edges. The default is
+            False.
+        sharing_mode : str, optional
+            Sharing mode, one of `sharing.modes`. The default is
+            "sequential".
+        regrowth_rate : float, optional
+            Amount each cell regrows per iteration, up to its initial value.
+            The default is 0.
+
+        Raises
+        ------
+        ValueError
+            If the number of seeds does not match the number of replicates,
+            or the sharing mode is unknown.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if sharing_mode not in sharing.modes:
+            raise ValueError("Unknown sharing mode: {}".format(sharing_mode))
+        self.num_of_iterations = num_of_iterations
+        self.neighbourhood_size = neighbourhood_size
+        self.store_size = store_size
+        self.bite_size = bite_size
+        self.toroidal = toroidal
+        self.sharing_mode = sharing_mode
+        self.regrowth_rate = regrowth_rate
+
+        # Create a random number generator for each replicate
+        if seeds is None or numpy.isscalar(seeds):
+            seeds = numpy.random.SeedSequence(seeds).spawn(num_of_replicates)
+        elif len(seeds) != num_of_replicates:
+            raise ValueError("A seed is needed for each replicate")
+        self.rngs = [numpy.random.default_rng(seed) for seed in seeds]
+
+        # Copy the environment into each replicate
+        self.capacity = numpy.array(plane, dtype=numpy.float64)
+        self.planes = numpy.repeat(self.capacity[numpy.newaxis],
+                                   num_of_replicates, axis=0)
+        y_length, x_length = self.capacity.shape
+
+        # Place the agents of each replicate at random
+        self.ys = numpy.empty((num_of_replicates, num_of_agents),
+                              dtype=numpy.int64)
+        self.xs = numpy.empty_like(self.ys)
+        for r, rng in enumerate(self.rngs):
+            self.ys[r] = rng.integers(0, y_length, num_of_agents)
+            self.xs[r] = rng.integers(0, x_length, num_of_agents)
+        self.stores = numpy.zeros((num_of_replicates, num_of_agents))
+
+        # Progress and totals of each replicate
+        self.iteration_counts = numpy.zeros(num_of_replicates,
+                                            dtype=numpy.int64)
+        self.done = numpy.zeros(num_of_replicates, dtype=bool)
+        self.active_agents = numpy.zeros(num_of_replicates, dtype=numpy.int64)
+        self.eaten = numpy.zeros(num_of_replicates)
+        self.share_events = numpy.zeros(num_of_replicates, dtype=numpy.int64)
+
+
+    def __len__(self):
+        return len(self.rngs)
+
+
+    def iterate(self):
+        """
+        Run a single iteration of every replicate that is not yet done.
+
+        Returns
+        -------
+        bool
+            True if every replicate is done, otherwise False.
+
+        """
+
+        num_of_replicates, num_of_agents = self.ys.shape
+        _, y_length, x_length = self.planes.shape
+        running = numpy.flatnonzero(~self.done)
+
+        # Find the agents that can eat in the running replicates
+        active = self.stores + self.bite_size <= self.store_size \
+            if self.store_size > 0 else numpy.ones(self.ys.shape, dtype=bool)
+        active &= ~self.done[:, numpy.newaxis]
+
+        # Draw each turn order and the steps from the replicate generators
+        draws = numpy.zeros((num_of_replicates, 3, num_of_agents))
+        for r in running:
+            draws[r] = self.rngs[r].random((3, num_of_agents))
+        ranks = numpy.argsort(numpy.where(active, draws[:, 0], 2), axis=1,
+                              kind="stable")
+
+        # Move the agents that can eat, with the step chances of Agent.move
+        steps = numpy.where(draws[:, 1:] < 0.33, 1,
+                            numpy.where(draws[:, 1:] < 0.66, -1, 0))
+        steps *= active[:, numpy.newaxis]
+        self.xs = (self.xs + steps[:, 0]) % x_length
+        self.ys = (self.ys + steps[:, 1]) % y_length
+
+        # Number the agents that can eat across replicates, in turn order
+        offsets = numpy.arange(num_of_replicates)[:, numpy.newaxis] \
+            * num_of_agents
+        order = (ranks + offsets)[numpy.take_along_axis(active, ranks, 1)]
+
+        eaten = self._graze(order)
+        share_events = self._share(order, running)
+        if self.regrowth_rate > 0:
+            self._regrow(running)
+
+        # Update the totals, marking replicates without active agents or
+        # at the iteration limit as done
+        self.active_agents = active.sum(axis=1)
+        self.eaten += eaten
+        self.share_events += share_events
+        self.iteration_counts[running] += 1
+        self.done |= (self.active_agents == 0) | \
+            (self.iteration_counts >= self.num_of_iterations)
+        return bool(self.done.all())
+
+
+    def run(self):
+        """
+        Iterate until every replicate is done.
+
+        Returns
+        -------
+        int
+            Number of iterations run.
+
+        """
+
+        num_of_iterations = 0
+        while not self.done.all():
+            self.iterate()
+            num_of_iterations += 1
+        return num_of_iterations
+
+
+    def replicate(self, r):
+        """
+        Return the agents of a replicate, on its environment.
+
+        Parameters
+        ----------
+        r : int
+            Index of the replicate.
+
+        Returns
+        -------
+        agentframework.AgentArrays
+            Copies of the agents of the replicate. Their environment views
+            the plane of the replicate.
+
+        """
+
+        environment = agentframework.Environment(self.planes[r])
+        return agentframework.AgentArrays(environment, self.ys[r],
+                                          self.xs[r], self.stores[r],
+                                          self.store_size, self.bite_size)
+
+
+    def _graze(self, order):
+        """
+        Feed the agents in turn order, returning the amount eaten in each
+        replicate.
+        """
+
+        num_of_replicates, num_of_agents = self.ys.shape
+        plane = self.planes.reshape(-1)
+        cells = plane.size // num_of_replicates * (order // num_of_agents) \
+            + self.ys.flat[order] * self.planes.shape[2] \
+            + self.xs.flat[order]
+
+        # Group the agents by cell, keeping turn order within each cell
+        grouping = numpy.argsort(cells, kind="stable")
+        order = order[grouping]
+        cells = cells[grouping]
+        starts = numpy.flatnonzero(numpy.diff(cells, prepend=-1))
+        sizes = numpy.diff(numpy.append(starts, len(cells)))
+        eaten_before = (numpy.arange(len(cells))
+                        - numpy.repeat(starts, sizes)) * self.bite_size
+
+        # Each agent eats if its cell holds more than a bite after the agents
+        # before it, which all share its bite size
+        eats = numpy.repeat(plane[cells[starts]], sizes) - eaten_before > \
+            self.bite_size
+        numpy.subtract.at(plane, cells[eats], self.bite_size)
+        self.stores.flat[order[eats]] += self.bite_size
+        return numpy.bincount(order[eats] // num_of_agents,
+                              minlength=num_of_replicates) * self.bite_size
+
+
+    def _share(self, order, running):
+        """
+        Share stores between neighbours within each running replicate,
+        returning the number of share events in each replicate.
+        """
+
+        num_of_replicates, num_of_agents = self.ys.shape
+        _, y_length, x_length = self.planes.shape
+
+        # Compare every pair of agents within each running replicate, in
+        # place on 32-bit offsets
+        ys = self.ys[running].astype(numpy.int32)
+        xs = self.xs[running].astype(numpy.int32)
+        dy = numpy.abs(ys[:, :, numpy.newaxis] - ys[:, numpy.newaxis, :])
+        dx = numpy.abs(xs[:, :, numpy.newaxis] - xs[:, numpy.newaxis, :])
+        if self.toroidal:
+            numpy.minimum(dy, y_length - dy, out=dy)
+            numpy.minimum(dx, x_length - dx, out=dx)
+        dy *= dy
+        dx *= dx
+        dy += dx
+        is_neighbour = dy <= self.neighbourhood_size * self.neighbourhood_size
+
+        # Number the neighbour pairs across replicates as a CSR adjacency
+        replicates, rows, columns = numpy.nonzero(is_neighbour)
+        is_other = rows != columns
+        replicates = replicates[is_other]
+        rows = rows[is_other]
+        columns = columns[is_other]
+        offsets = running[replicates] * num_of_agents
+        degrees = numpy.bincount(offsets + rows,
+                                 minlength=num_of_replicates * num_of_agents)
+        indptr = numpy.concatenate(([0], numpy.cumsum(degrees)))
+
+        sharing.share(self.stores.reshape(-1), order, indptr,
+                      offsets + columns, self.sharing_mode)
+        return numpy.bincount(order // num_of_agents, weights=degrees[order],
+                              minlength=num_of_replicates).astype(numpy.int64)
+
+
+    def _regrow(self, running):
+        """
+        Regrow the planes of the running replicates up to their capacity.
+        """
+        planes = self.planes[running]
+        self.planes[running] = numpy.maximum(
+            numpy.minimum(planes + self.regrowth_rate, self.capacity), planes)
+
+
+
+def create_ensemble(model, num_of_replicates, seeds=None,
+                    sharing_mode="sequential"):
+    """
+    Return an ensemble of replicates of an initialized model.
+
+    The replicates use the model parameters and a copy of its environment
+    within the environment limits. Agents are placed at random rather than
+    at the model start positions.
+
+    Parameters
+    ----------
+    model : Model
+        The model to replicate.
+    num_of_replicates : int
+        Number of replicates.
+    seeds : int or list[int], optional
+        Random seed of each replicate, or a seed from which the seed of each
+        replicate is derived. If None, the model seed is used. The default
+        is None.
+    sharing_mode : str, optional
+        Sharing mode, one of `sharing.modes`. The default is "sequential".
+
+    Returns
+    -------
+    Ensemble
+        The ensemble, ready to run.
+
+    """
+
+    return Ensemble(model.environment.limited_plane, num_of_replicates, model.num_of_agents,
+                    model.seed if seeds is None else seeds,
+                    model.num_of_iterations, model.neighbourhood_size,
+                    model.agent_store_size, model.agent_bite_size,
+                    model.toroidal_neighbourhood, sharing_mode,
+                    model.regrowth_rate)
+
+
+
+class EnsembleTestCase(unittest.TestCase):
+    """
+    The EnsembleTestCase class provides a collection of unit tests for the
+    Ensemble class.
+    """
+
+    def create_ensemble(self, seeds, **kwargs):
+        """
+        Return an ensemble of small replicates with the given seeds.
+        """
+        plane = numpy.random.default_rng(0).integers(0, 60, (20, 25))
+        return Ensemble(plane, len(seeds), 30, seeds, num_of_iterations=8,
+                        neighbourhood_size=4, store_size=200, bite_size=10,
+                        **kwargs)
+
+
+    def test_iterate(self):
+        """
+        Test that replicates conserve resources and never feed agents from
+        cells without enough resource.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for mode in sharing.modes:
+            for toroidal in (False, True):
+                ensemble = self.create_ensemble(
+                    [1, 2, 3], toroidal=toroidal, sharing_mode=mode)
+                totals = ensemble.stores.sum(axis=1) + \
+                    ensemble.planes.sum(axis=(1, 2))
+                self.assertEqual(ensemble.run(), 8)
+                self.assertTrue(numpy.allclose(
+                    ensemble.stores.sum(axis=1) +
+                    ensemble.planes.sum(axis=(1, 2)), totals))
+                self.assertTrue(numpy.allclose(
+                    ensemble.eaten, ensemble.stores.sum(axis=1)))
+                self.assertTrue((ensemble.share_events > 0).all())
+                self.assertTrue((ensemble.iteration_counts == 8).all())
+
+                # Verify eaten cells kept more than a bite
+                eaten = ensemble.planes < ensemble.capacity
+                self.assertTrue((ensemble.planes[eaten] > 0).all())
+
+
+    def test_replicates_are_independent(self):
+        """
+        Test that a replicate gives the same results in any ensemble, and
+        that replicates stop once done.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        ensemble = self.create_ensemble([5, 6])
+        single = self.create_ensemble([6])
+        ensemble.run()
+        single.run()
+        self.assertTrue(numpy.array_equal(ensemble.ys[1], single.ys[0]))
+        self.assertTrue(numpy.array_equal(ensemble.stores[1],
+                                          single.stores[0]))
+        self.assertTrue(numpy.array_equal(ensemble.planes[1],
+                                          single.planes[0]))
+        self.assertFalse(numpy.array_equal(ensemble.ys[0], ensemble.ys[1]))
+
+        # Verify a replicate whose agents are all full is done at once
+        ensemble = self.create_ensemble([5, 6])
+        ensemble.stores[0] = 200
+        ensemble.iterate()
+        self.assertEqual(ensemble.done.tolist(), [True, False])
+        self.assertEqual(ensemble.active_agents.tolist(), [0, 30])
+        ys = ensemble.ys[0].copy()
+        ensemble.iterate()
+        self.assertTrue(numpy.array_equal(ensemble.ys[0], ys))
+        self.assertEqual(ensemble.iteration_counts.tolist(), [1, 2])
+
+        agents = ensemble.replicate(1)
+        self.assertEqual(len(agents), 30)
+        self.assertIs(agents.environment.plane.base, ensemble.planes)
+
+        with self.assertRaises(ValueError):
+            self.create_ensemble([1, 2], sharing_mode="unknown")
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
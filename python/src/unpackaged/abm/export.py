@@ -0,0 +1,469 @@
+"""
+Result Export
+=============
+
+Writes the model environment and agent state to files during and at the end
+of a run.
+
+Supported formats:
+
+    csv - environment.csv with one row per plane row, and agents.csv with a
+          header row and one row per agent
+
+    npy - environment.npy holding the plane, and agents.npy holding a
+          structured array with one field per agent column
+
+    npz - a single compressed state.npz holding the plane and each agent
+          column as a separate array
+
+Files are named after the iteration they were recorded at, for example
+environment_000100.csv. Each file is written in a single bulk call. Writes
+can be run on a background thread, so recording the state only costs the
+time taken to copy it. A few copies are held while waiting to be written, so
+a slow disk holds up the model rather than filling memory.
+"""
+
+import os
+import queue
+import tempfile
+import threading
+import unittest
+import numpy
+import agentframework
+
+# Agent table columns, in order
+agent_columns = ("y", "x", "store", "active")
+
+
+def agent_table(agents):
+    """
+    Return the agent state as a table of columns.
+
+    Parameters
+    ----------
+    agents : list[agentframework.Agent] or agentframework.AgentArrays
+        The agents to tabulate.
+
+    Returns
+    -------
+    dict[str, numpy.ndarray]
+        Arrays of y-axis position, x-axis position, store contents and
+        whether each agent can still eat, keyed by column name.
+
+    """
+
+    # Copy columns directly from agents stored as arrays
+    if isinstance(agents, agentframework.AgentArrays):
+        return {
+            "y": numpy.array(agents.y),
+            "x": numpy.array(agents.x),
+            "store": numpy.array(agents.store, dtype=numpy.float64),
+            "active": agents.can_eat(),
+        }
+
+    return {
+        "y": numpy.array([agent.y for agent in agents], dtype=numpy.int64),
+        "x": numpy.array([agent.x for agent in agents], dtype=numpy.int64),
+        "store": numpy.array([agent.store for agent in agents],
+                             dtype=numpy.float64),
+        "active": numpy.array([agent.can_eat() for agent in agents],
+                              dtype=bool),
+    }
+
+
+def write_csv(directory, suffix, plane, table):
+    """
+    Write the environment and agent table as CSV files.
+    """
+    numpy.savetxt(os.path.join(directory, "environment{}.csv".format(suffix)),
+                  plane, fmt="%.17g", delimiter=",")
+    columns = numpy.column_stack([table[name].astype(numpy.float64)
+                                  for name in agent_columns])
+    numpy.savetxt(os.path.join(directory, "agents{}.csv".format(suffix)),
+                  columns, fmt=["%d", "%d", "%.17g", "%d"], delimiter=",",
+                  header=",".join(agent_columns), comments="")
+
+
+def write_npy(directory, suffix, plane, table):
+    """
+    Write the environment and agent table as NumPy array files.
+    """
+    numpy.save(os.path.join(directory, "environment{}.npy".format(suffix)),
+               plane)
+    records = numpy.empty(len(table["y"]), dtype=[
+        (name, table[name].dtype) for name in agent_columns])
+    for name in agent_columns:
+        records[name] = table[name]
+    numpy.save(os.path.join(directory, "agents{}.npy".format(suffix)),
+               records)
+
+
+def write_npz(directory, suffix, plane, table):
+    """
+    Write the environment and agent columns to a compressed NumPy archive.
+    """
+    numpy.savez_compressed(
+        os.path.join(directory, "state{}.npz".format(suffix)),
+        plane=plane, **{"agents_" + name: table[name]
+                        for name in agent_columns})
+
+
+# Writers by format name
+writers = {
+    "csv": write_csv,
+    "npy": write_npy,
+    "npz": write_npz,
+}
+
+
+
+class Exporter():
+    """
+    The Exporter class writes model state to files, either periodically
+    during a run or once the run is complete.
+
+    Public Methods:
+
+        update - records the model state after an iteration, if it is due
+
+        write - records the model state
+
+        flush - waits for any pending writes to complete
+
+        close - waits for pending writes and stops the writer thread
+    """
+
+    def __init__(self, directory, formats=("csv",), interval=0,
+                 background=True, max_pending=2):
+        """
+        Instantiate an Exporter.
+
+        Parameters
+        ----------
+        directory : str
+            Directory to write files to. It is created if it does not exist.
+        formats : tuple[str], optional
+            Formats to write: any of "csv", "npy" and "npz". The default is
+            ("csv",).
+        interval : int, optional
+            Number of iterations between periodic writes. If 0, only the
+            final state is written. The default is 0.
+        background : bool, optional
+            Whether to write files on a background thread. The default
+            is True.
+        max_pending : int, optional
+            Maximum number of copied states waiting for the writer thread.
+            Further writes wait until one has been written. The default
+            is 2.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for file_format in formats:
+            if file_format not in writers:
+                raise ValueError("Unknown export format: {}".format(
+                    file_format))
+
+        self.directory = directory
+        self.formats = tuple(formats)
+        self.interval = interval
+        self.background = background
+        self.max_pending = max_pending
+        os.makedirs(directory, exist_ok=True)
+
+        # The writer thread is started with the first background write
+        self._queue = None
+        self._thread = None
+        self._error = None
+
+
+    def update(self, model, iteration, is_final=False):
+        """
+        Record the model state after an iteration, if it is due.
+
+        Parameters
+        ----------
+        model : Model
+            The model to record.
+        iteration : int
+            Number of iterations completed.
+        is_final : bool, optional
+            Whether the run is complete. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if is_final or (self.interval > 0 and iteration % self.interval == 0):
+            self.write(model, iteration)
+
+
+    def write(self, model, iteration):
+        """
+        Record the model state.
+
+        The state is copied immediately, so the model can continue while the
+        files are written.
+
+        Parameters
+        ----------
+        model : Model
+            The model to record.
+        iteration : int
+            Number of iterations completed, used to name the files.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Copy the state within the environment limits
+        environment = model.environment
+        plane = numpy.array(environment.limited_plane, dtype=numpy.float64)
+        job = ("_{:06d}".format(iteration), plane, agent_table(model.agents))
+
+        if not self.background:
+            self._write(*job)
+            return
+
+        # Hand the state to the writer thread
+        self._raise_error()
+        if self._thread is None:
+            self._queue = queue.Queue(self.max_pending)
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put(job)
+
+
+    def flush(self):
+        """
+        Wait for any pending writes to complete.
+
+        Raises
+        ------
+        Exception
+            Any error raised while writing in the background.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self._queue is not None:
+            self._queue.join()
+        self._raise_error()
+
+
+    def close(self):
+        """
+        Wait for pending writes and stop the writer thread.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._queue = None
+        self._raise_error()
+
+
+    def _write(self, suffix, plane, table):
+        """
+        Write the given state in each format.
+        """
+        for file_format in self.formats:
+            writers[file_format](self.directory, suffix, plane, table)
+
+
+    def _run(self):
+        """
+        Write queued state until stopped.
+        """
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._error is None:
+                    self._write(*job)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+
+    def _raise_error(self):
+        """
+        Raise any error from the writer thread.
+        """
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+
+class ExporterTestCase(unittest.TestCase):
+    """
+    The ExporterTestCase class provides a collection of unit tests for the
+    Exporter class.
+    """
+
+    class FakeModel():
+        """
+        A minimal model holding an environment and agents.
+        """
+
+        def __init__(self, agents):
+            self.environment = agents.environment
+            self.agents = agents
+
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        environment = agentframework.Environment(
+            [[1.5, 2, 3], [4, 5, 6], [7, 8, 9]], 2, 2)
+        self.model = self.FakeModel(agentframework.AgentArrays(
+            environment, [0, 1], [1, 0], [20, 2.5], 20, 10))
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def path(self, filename):
+        """
+        Return a path in the temporary test directory.
+        """
+        return os.path.join(self.directory.name, filename)
+
+
+    def test_formats(self):
+        """
+        Test that each format holds the environment and agent state.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for background in (False, True):
+            exporter = Exporter(self.directory.name, ("csv", "npy", "npz"),
+                                background=background)
+            exporter.write(self.model, 3)
+            exporter.close()
+
+            # Verify the environment is written within its limits
+            plane = numpy.array([[1.5, 2], [4, 5]])
+            self.assertTrue(numpy.array_equal(numpy.loadtxt(
+                self.path("environment_000003.csv"), delimiter=","), plane))
+            self.assertTrue(numpy.array_equal(numpy.load(
+                self.path("environment_000003.npy")), plane))
+
+            # Verify the agent tables
+            agents = numpy.loadtxt(self.path("agents_000003.csv"),
+                                   delimiter=",", skiprows=1)
+            self.assertEqual(agents.tolist(), [[0, 1, 20, 0], [1, 0, 2.5, 1]])
+            records = numpy.load(self.path("agents_000003.npy"))
+            self.assertEqual(records["store"].tolist(), [20, 2.5])
+            with numpy.load(self.path("state_000003.npz")) as state:
+                self.assertTrue(numpy.array_equal(state["plane"], plane))
+                self.assertEqual(state["agents_active"].tolist(),
+                                 [False, True])
+
+
+    def test_update(self):
+        """
+        Test that state is written periodically and at the end of a run.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        exporter = Exporter(self.directory.name, ("npy",), 2)
+        for iteration in range(1, 6):
+            exporter.update(self.model, iteration, iteration == 5)
+        exporter.close()
+
+        self.assertEqual(sorted(os.listdir(self.directory.name)), [
+            "agents_000002.npy", "agents_000004.npy", "agents_000005.npy",
+            "environment_000002.npy", "environment_000004.npy",
+            "environment_000005.npy"])
+
+
+    def test_back_pressure(self):
+        """
+        Test that writes wait once the pending states are at their limit.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Hold up the writer thread until released
+        exporter = Exporter(self.directory.name, max_pending=1)
+        released = threading.Event()
+        exporter._write = lambda *job: released.wait()
+        exporter.write(self.model, 1)
+        exporter.write(self.model, 2)
+
+        # Verify a further write waits for the writer thread
+        writer = threading.Thread(target=exporter.write, args=(self.model, 3))
+        writer.start()
+        writer.join(0.2)
+        self.assertTrue(writer.is_alive())
+        released.set()
+        writer.join()
+        exporter.close()
+        self.assertIsNone(exporter._thread)
+
+
+    def test_background_error(self):
+        """
+        Test that errors from the writer thread are raised.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        exporter = Exporter(self.directory.name)
+        self.directory.cleanup()
+        exporter.write(self.model, 1)
+        with self.assertRaises(OSError):
+            exporter.close()
+
+
+    def test_unknown_format(self):
+        """
+        Test that unknown formats are rejected.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        with self.assertRaises(ValueError):
+            Exporter(self.directory.name, ("parquet",))
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
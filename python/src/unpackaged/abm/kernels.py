@@ -0,0 +1,312 @@
+"""
+Compiled Kernels
+================
+
+Runs agent turns as compiled loops over the agent and environment arrays,
+for model iterations that cannot be expressed as array operations.
+
+Each agent in turn order moves, eats and shares with its neighbours before
+the next agent takes its turn, as on the per-agent path of a behaviour
+pipeline. Kernels are compiled with Numba when it is installed, and
+otherwise run as plain Python, giving the same results more slowly.
+
+Random steps are drawn before a kernel runs and passed to it, so compiled
+and Python kernels give the same results from the same seed. Neighbours
+are shared with in agent order.
+"""
+
+import unittest
+import numpy
+import agentframework
+
+try:
+    import numba
+except ImportError:
+    # Kernels run as plain Python without Numba
+    numba = None
+
+
+def jit(function):
+    """
+    Return the given function compiled with Numba, if it is installed.
+
+    Parameters
+    ----------
+    function : function
+        The function to compile, using only Numba supported features.
+
+    Returns
+    -------
+    function
+        The compiled function, or the given function if Numba is not
+        installed.
+
+    """
+
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+def _iterate_agents(ys, xs, stores, store_sizes, bite_sizes, plane, order,
+                    steps, neighbourhood_size, y_length, x_length, toroidal):
+    """
+    Run each agent in turn order through moving, eating and sharing.
+    """
+    num_of_agents = len(ys)
+    radius = neighbourhood_size
+    size = max(int(radius), 1)
+    rows = (y_length - 1) // size + 1
+    columns = (x_length - 1) // size + 1
+
+    # Bucket agents into neighbourhood-sized cells, as linked lists
+    heads = numpy.full(rows * columns, -1, dtype=numpy.int64)
+    nexts = numpy.full(num_of_agents, -1, dtype=numpy.int64)
+    previous = numpy.full(num_of_agents, -1, dtype=numpy.int64)
+    cells = numpy.empty(num_of_agents, dtype=numpy.int64)
+    for i in range(num_of_agents):
+        cell = ys[i] // size * columns + xs[i] // size
+        cells[i] = cell
+        nexts[i] = heads[cell]
+        if heads[cell] >= 0:
+            previous[heads[cell]] = i
+        heads[cell] = i
+
+    is_row = numpy.zeros(rows, dtype=numpy.bool_)
+    is_column = numpy.zeros(columns, dtype=numpy.bool_)
+    candidates = numpy.empty(num_of_agents, dtype=numpy.int64)
+
+    active = 0
+    eaten = 0.0
+    share_events = 0
+    for turn in range(len(order)):
+        i = order[turn]
+
+        # Only move agents with store capacity
+        store_size = store_sizes[i]
+        bite_size = bite_sizes[i]
+        if store_size > 0 and stores[i] + bite_size > store_size:
+            continue
+        active += 1
+
+        # Move the agent and update its cell
+        y = (ys[i] + steps[1, turn]) % y_length
+        x = (xs[i] + steps[0, turn]) % x_length
+        ys[i] = y
+        xs[i] = x
+        cell = y // size * columns + x // size
+        if cell != cells[i]:
+            if previous[i] >= 0:
+                nexts[previous[i]] = nexts[i]
+            else:
+                heads[cells[i]] = nexts[i]
+            if nexts[i] >= 0:
+                previous[nexts[i]] = previous[i]
+            cells[i] = cell
+            previous[i] = -1
+            nexts[i] = heads[cell]
+            if heads[cell] >= 0:
+                previous[heads[cell]] = i
+            heads[cell] = i
+
+        # Eat a portion of the environment
+        if plane[y, x] > bite_size:
+            plane[y, x] -= bite_size
+            stores[i] += bite_size
+            eaten += bite_size
+
+        # Mark the cells covering the neighbourhood bounding box, along
+        # each axis
+        for axis in range(2):
+            position, length, marks = (y, y_length, is_row) if axis == 0 \
+                else (x, x_length, is_column)
+            low = position - radius
+            high = position + radius
+            if not toroidal or high - low + 1 >= length:
+                low = max(low, 0)
+                high = min(high, length - 1)
+            elif low < 0:
+                marks[(low + length) // size:] = True
+                low = 0
+            elif high >= length:
+                marks[:(high - length) // size + 1] = True
+                high = length - 1
+            marks[low // size:high // size + 1] = True
+
+        # Find the neighbours in the marked cells
+        count = 0
+        for row in range(rows):
+            if not is_row[row]:
+                continue
+            for column in range(columns):
+                if not is_column[column]:
+                    continue
+                j = heads[row * columns + column]
+                while j >= 0:
+                    if j != i:
+                        dy = abs(ys[j] - y)
+                        dx = abs(xs[j] - x)
+                        if toroidal:
+                            dy = min(dy % y_length, y_length - dy % y_length)
+                            dx = min(dx % x_length, x_length - dx % x_length)
+                        if dy * dy + dx * dx <= radius * radius:
+                            candidates[count] = j
+                            count += 1
+                    j = nexts[j]
+        is_row[:] = False
+        is_column[:] = False
+
+        # Share with each neighbour in turn, in agent order
+        neighbours = numpy.sort(candidates[:count])
+        for j in neighbours:
+            average = (stores[i] + stores[j]) / 2
+            stores[i] = average
+            stores[j] = average
+        share_events += count
+
+    return active, eaten, share_events
+
+
+# Compiled kernel, or the Python kernel if Numba is not installed
+_iterate_agents_compiled = jit(_iterate_agents)
+
+
+def iterate_agents(agents, order, steps, neighbourhood_size, toroidal=False,
+                   compiled=True):
+    """
+    Run each agent in turn order through moving, eating and sharing with
+    its neighbours.
+
+    Parameters
+    ----------
+    agents : agentframework.AgentArrays
+        All agents in the model, updated in place along with their
+        environment plane, which must be a NumPy array.
+    order : numpy.ndarray
+        Indices of the agents taking a turn, in turn order. Agents without
+        store capacity at the start of their turn are skipped.
+    steps : numpy.ndarray
+        The x-axis and y-axis step of each agent in turn order, with shape
+        (2, len(order)).
+    neighbourhood_size : int
+        Size of the neighbourhood.
+    toroidal : bool, optional
+        Measure distances across the environment edges. The default is
+        False.
+    compiled : bool, optional
+        Run the compiled kernel, if Numba is installed. The default is
+        True.
+
+    Returns
+    -------
+    tuple[int, float, int]
+        Number of agents that were able to eat at the start of their turn,
+        the resource eaten and the number of share events.
+
+    """
+
+    environment = agents.environment
+    num_of_agents = len(agents)
+    store_sizes = numpy.broadcast_to(
+        numpy.asarray(agents.store_size, dtype=numpy.float64), num_of_agents)
+    bite_sizes = numpy.broadcast_to(
+        numpy.asarray(agents.bite_size, dtype=numpy.float64), num_of_agents)
+    kernel = _iterate_agents_compiled if compiled else _iterate_agents
+    active, eaten, share_events = kernel(
+        agents.y, agents.x, agents.store, store_sizes, bite_sizes,
+        environment.plane, numpy.asarray(order, dtype=numpy.int64),
+        numpy.asarray(steps, dtype=numpy.int64), neighbourhood_size,
+        environment.y_length, environment.x_length, toroidal)
+    return int(active), float(eaten), int(share_events)
+
+
+
+class KernelsTestCase(unittest.TestCase):
+    """
+    The KernelsTestCase class provides a collection of unit tests for the
+    compiled kernels.
+    """
+
+    def create_agents(self, num_of_agents=150, length=30):
+        """
+        Return randomly placed agents, a turn order and random steps.
+        """
+        rng = numpy.random.default_rng(0)
+        environment = agentframework.Environment(
+            rng.integers(0, 30, (length, length)).astype(float))
+        agents = agentframework.AgentArrays(
+            environment, rng.integers(0, length, num_of_agents),
+            rng.integers(0, length, num_of_agents),
+            rng.integers(0, 100, num_of_agents), 120, 10)
+        order = rng.permutation(num_of_agents)
+        steps = rng.integers(-1, 2, (2, num_of_agents))
+        return agents, order, steps
+
+
+    def test_iterate_agents(self):
+        """
+        Test that the Python kernel matches each agent moving, eating and
+        sharing in turn.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for toroidal in (False, True):
+            agents, order, steps = self.create_agents()
+            expected, _, _ = self.create_agents()
+            active, eaten, share_events = iterate_agents(
+                agents, order, steps, 4, toroidal, compiled=False)
+
+            # Run the same turns agent by agent
+            expected_active = 0
+            expected_share_events = 0
+            for turn, i in enumerate(order):
+                agent = expected[i]
+                if not agent.can_eat():
+                    continue
+                expected_active += 1
+                agent.x = (agent.x + steps[0, turn]) % 30
+                agent.y = (agent.y + steps[1, turn]) % 30
+                agent.eat()
+                expected_share_events += agent.share_with_neighbours(
+                    4, toroidal)
+
+            self.assertEqual(active, expected_active)
+            self.assertEqual(share_events, expected_share_events)
+            self.assertTrue(numpy.array_equal(agents.y, expected.y))
+            self.assertTrue(numpy.array_equal(agents.store, expected.store))
+            self.assertTrue(numpy.array_equal(
+                agents.environment.plane, expected.environment.plane))
+            self.assertGreater(eaten, 0)
+
+
+    @unittest.skipIf(numba is None, "Numba is not installed")
+    def test_compiled(self):
+        """
+        Test that the compiled kernel matches the Python kernel.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        results = []
+        for compiled in (False, True):
+            agents, order, steps = self.create_agents()
+            results.append((iterate_agents(agents, order, steps, 4, True,
+                                           compiled),
+                            agents.y, agents.x, agents.store,
+                            agents.environment.plane))
+        python, compiled = results
+        self.assertEqual(python[0], compiled[0])
+        for values, other in zip(python[1:], compiled[1:]):
+            self.assertTrue(numpy.array_equal(values, other))
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,769 @@
+"""
+Environment Loaders
+===================
+
+Loads environment planes from raster files.
+
+Supported formats:
+
+    csv - comma separated values, one row per line (.csv, .txt)
+
+    npy - a NumPy array file (.npy)
+
+    npz - a NumPy archive, using the array named "plane" or else the first
+          array (.npz)
+
+    grid - a plain binary grid with a small header, see `save_grid` (.grid)
+
+The format is detected from the file extension, or from the file header if
+the extension is not recognised. Other formats can be added with
+`register_format`.
+
+Loaders only read the window of the raster that is requested. Rows past the
+window are never read and, for the binary formats, only the bytes within the
+window are read, so a small window of a very large raster loads in constant
+memory. `RasterFile` provides on-demand access to windows and tiles of a
+raster.
+"""
+
+import io
+import os
+import struct
+import tempfile
+import time
+import unittest
+import zipfile
+import numpy
+
+# Binary grid header: magic, rows, columns, dtype string
+grid_magic = b"ABMGRID1"
+grid_header = struct.Struct("<8sQQ8s")
+
+# Size of the chunks read when scanning text files
+chunk_size = 1 << 20
+
+# Registered loader and shape functions, extensions and header signatures
+# by format name
+formats = {}
+extensions = {}
+signatures = {}
+
+
+
+class EnvironmentLoadError(Exception):
+    """
+    Raised when an environment cannot be loaded from a file.
+    """
+
+
+
+def register_format(name, loader, shape, file_extensions=(),
+                    signature=None):
+    """
+    Register a loader for an environment file format.
+
+    Parameters
+    ----------
+    name : str
+        Name of the format.
+    loader : callable
+        Function taking a binary file object and a window tuple of
+        (y, x, rows, columns), where rows and columns may be None to read
+        to the end, and returning the 2-D plane within the window.
+    shape : callable
+        Function taking a binary file object and returning the number of
+        rows and columns in the raster.
+    file_extensions : tuple[str], optional
+        File extensions, including the dot, used to detect the format.
+    signature : bytes, optional
+        Bytes at the start of a file used to detect the format.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    formats[name] = (loader, shape)
+    for extension in file_extensions:
+        extensions[extension.lower()] = name
+    if signature is not None:
+        signatures[signature] = name
+
+
+def detect_format(filepath):
+    """
+    Return the format of the given environment file.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the environment file.
+
+    Returns
+    -------
+    str
+        The detected format name. Files that are not recognised are assumed
+        to be CSV.
+
+    """
+
+    # Detect the format from the file extension
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension in extensions:
+        return extensions[extension]
+
+    # Detect the format from the file header
+    with open(filepath, "rb") as f:
+        header = f.read(max((len(signature) for signature in signatures),
+                            default=0))
+    for signature, name in signatures.items():
+        if header.startswith(signature):
+            return name
+    return "csv"
+
+
+def load_environment(filepath, file_format=None, x_lim=None, y_lim=None,
+                     y_offset=0, x_offset=0):
+    """
+    Load an environment plane from the given file.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to the environment file.
+    file_format : str, optional
+        Format of the file. If None, the format is detected.
+    x_lim : int, optional
+        Maximum number of columns to read. If None, all columns are read.
+    y_lim : int, optional
+        Maximum number of rows to read. If None, all rows are read.
+    y_offset : int, optional
+        First row to read. The default is 0.
+    x_offset : int, optional
+        First column to read. The default is 0.
+
+    Raises
+    ------
+    EnvironmentLoadError
+        If the file cannot be read or is not a 2-D plane.
+
+    Returns
+    -------
+    plane : numpy.ndarray
+        2-D array of resource values.
+    report : dict
+        The format, bytes read and seconds taken to load the file.
+
+    """
+
+    start = time.perf_counter()
+    try:
+        if file_format is None:
+            file_format = detect_format(filepath)
+        if file_format not in formats:
+            raise ValueError("unknown format '{}'".format(file_format))
+
+        # Load the window, keeping track of how much was read
+        loader = formats[file_format][0]
+        with open(filepath, "rb") as f:
+            f = _CountingFile(f)
+            plane = numpy.asarray(
+                loader(f, (y_offset, x_offset, y_lim, x_lim)),
+                dtype=numpy.float64)
+        if plane.ndim != 2:
+            raise ValueError("expected 2-D data, found {}-D".format(
+                plane.ndim))
+    except (OSError, ValueError, KeyError, EOFError,
+            zipfile.BadZipFile) as e:
+        raise EnvironmentLoadError(
+            "Unable to read environment from file: {} ({})".format(
+                filepath, e)) from e
+
+    report = {
+        "format": file_format,
+        "bytes_read": f.bytes_read,
+        "seconds": time.perf_counter() - start,
+    }
+    return plane, report
+
+
+def load_csv(f, window):
+    """
+    Return the window of the plane in a CSV file, ignoring any trailing
+    commas.
+
+    Parameters
+    ----------
+    f : file
+        Binary file object.
+    window : tuple
+        Window of (y, x, rows, columns) to read.
+
+    Returns
+    -------
+    numpy.ndarray
+        The loaded plane.
+
+    """
+
+    y, x, rows, columns = window
+
+    # Count the columns in the first row, excluding empty trailing fields
+    first_row = f.readline()
+    num_of_columns = len(first_row.rstrip(b"\r\n").rstrip(b",").split(b","))
+    f.seek(0)
+
+    # Parse the rows in the window in bulk, stopping after the last one
+    x_end = num_of_columns if columns is None \
+        else min(num_of_columns, x + columns)
+    return numpy.loadtxt(f, delimiter=",", usecols=range(x, x_end),
+                         skiprows=y, max_rows=rows, ndmin=2)
+
+
+def csv_shape(f):
+    """
+    Return the number of rows and columns in a CSV file.
+    """
+
+    # Count the columns in the first row
+    first_row = f.readline()
+    num_of_columns = len(first_row.rstrip(b"\r\n").rstrip(b",").split(b","))
+    if not first_row:
+        return 0, 0
+
+    # Count the rows in chunks
+    f.seek(0)
+    num_of_rows = 0
+    last = b""
+    for chunk in iter(lambda: f.read(chunk_size), b""):
+        num_of_rows += chunk.count(b"\n")
+        last = chunk
+    if not last.endswith(b"\n"):
+        num_of_rows += 1
+    return num_of_rows, num_of_columns
+
+
+def load_npy(f, window):
+    """
+    Return the window of the plane in a NumPy array file.
+    """
+    shape, fortran_order, dtype = _read_npy_header(f)
+    return _read_window(f, f.tell(), shape, dtype, fortran_order, window)
+
+
+def npy_shape(f):
+    """
+    Return the number of rows and columns in a NumPy array file.
+    """
+    return _read_npy_header(f)[0]
+
+
+def load_npz(f, window):
+    """
+    Return the window of the plane in a NumPy archive, using the array named
+    "plane" or else the first array.
+    """
+    with zipfile.ZipFile(f) as archive, \
+            archive.open(_npz_member(archive)) as member:
+        return load_npy(member, window)
+
+
+def npz_shape(f):
+    """
+    Return the number of rows and columns in a NumPy archive.
+    """
+    with zipfile.ZipFile(f) as archive, \
+            archive.open(_npz_member(archive)) as member:
+        return npy_shape(member)
+
+
+def load_grid(f, window):
+    """
+    Return the window of the plane in a plain binary grid file.
+    """
+    shape, dtype = _read_grid_header(f)
+    return _read_window(f, grid_header.size, shape, dtype, False, window)
+
+
+def grid_shape(f):
+    """
+    Return the number of rows and columns in a plain binary grid file.
+    """
+    return _read_grid_header(f)[0]
+
+
+def save_grid(filepath, plane):
+    """
+    Save a plane as a plain binary grid file.
+
+    The file holds a header of the magic bytes "ABMGRID1", the number of
+    rows and columns as little-endian 64-bit integers and the NumPy dtype
+    string padded to 8 bytes, followed by the values in row order.
+
+    Parameters
+    ----------
+    filepath : str
+        Path to write the grid to.
+    plane : array_like
+        2-D plane to save.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    plane = numpy.ascontiguousarray(plane)
+    rows, columns = plane.shape
+    with open(filepath, "wb") as f:
+        f.write(grid_header.pack(grid_magic, rows, columns,
+                                 plane.dtype.str.encode("ascii")))
+        plane.tofile(f)
+
+
+def _read_npy_header(f):
+    """
+    Return the shape, Fortran order flag and dtype from a NumPy array file
+    header.
+    """
+    version = numpy.lib.format.read_magic(f)
+    if version == (1, 0):
+        header = numpy.lib.format.read_array_header_1_0(f)
+    else:
+        header = numpy.lib.format.read_array_header_2_0(f)
+    if len(header[0]) != 2:
+        raise ValueError("expected 2-D data, found {}-D".format(
+            len(header[0])))
+    return header
+
+
+def _npz_member(archive):
+    """
+    Return the name of the archive member holding the plane.
+    """
+    names = archive.namelist()
+    if not names:
+        raise ValueError("archive is empty")
+    return "plane.npy" if "plane.npy" in names else names[0]
+
+
+def _read_grid_header(f):
+    """
+    Return the shape and dtype from a binary grid file header.
+    """
+    header = f.read(grid_header.size)
+    if len(header) < grid_header.size:
+        raise ValueError("not a binary grid file")
+    magic, rows, columns, dtype = grid_header.unpack(header)
+    if magic != grid_magic:
+        raise ValueError("not a binary grid file")
+    return (rows, columns), numpy.dtype(dtype.rstrip(b"\0").decode("ascii"))
+
+
+def _read_window(f, offset, shape, dtype, fortran_order, window):
+    """
+    Return a window of a 2-D array stored in a binary file.
+
+    Only the bytes within the window are read. Whole rows are read in a
+    single call, otherwise each row of the window is read separately.
+
+    Parameters
+    ----------
+    f : file
+        Binary file object.
+    offset : int
+        Position of the first array value in the file.
+    shape : tuple[int, int]
+        Number of rows and columns in the array.
+    dtype : numpy.dtype
+        Type of the array values.
+    fortran_order : bool
+        Whether the values are stored in column order.
+    window : tuple
+        Window of (y, x, rows, columns) to read.
+
+    Returns
+    -------
+    numpy.ndarray
+        The values within the window.
+
+    """
+
+    y, x, rows, columns = window
+
+    # Values stored in column order are read as a transposed window
+    if fortran_order:
+        return _read_window(f, offset, shape[::-1], dtype, False,
+                            (x, y, columns, rows)).T
+
+    # Clip the window to the array
+    num_of_rows, num_of_columns = shape
+    y_end = num_of_rows if rows is None else min(num_of_rows, y + rows)
+    x_end = num_of_columns if columns is None \
+        else min(num_of_columns, x + columns)
+    y = min(y, y_end)
+    x = min(x, x_end)
+    row_bytes = (x_end - x) * dtype.itemsize
+
+    # Read whole rows in a single call, straight into a writeable plane
+    plane = numpy.empty((y_end - y, x_end - x), dtype)
+    if x == 0 and x_end == num_of_columns:
+        f.seek(offset + y * num_of_columns * dtype.itemsize)
+        buffer = memoryview(plane.reshape(-1).view(numpy.uint8))
+        count = 0
+        while count < len(buffer):
+            size = f.readinto(buffer[count:])
+            if not size:
+                raise ValueError("file is truncated")
+            count += size
+        return plane
+
+    # Otherwise read the part of each row within the window
+    for i, row in enumerate(range(y, y_end)):
+        f.seek(offset + (row * num_of_columns + x) * dtype.itemsize)
+        data = f.read(row_bytes)
+        if len(data) < row_bytes:
+            raise ValueError("file is truncated")
+        plane[i] = numpy.frombuffer(data, dtype)
+    return plane
+
+
+
+class _CountingFile(io.RawIOBase):
+    """
+    The _CountingFile class wraps a binary file object and counts the bytes
+    read through it.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self._f.readline(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer):
+        count = self._f.readinto(buffer)
+        self.bytes_read += count or 0
+        return count
+
+
+
+class RasterFile():
+    """
+    The RasterFile class provides on-demand access to windows of a raster
+    file, loading only the values that are requested.
+
+    Public Methods:
+
+        read_window - loads a window of the raster
+
+        tiles - yields windows covering the raster, loading each in turn
+    """
+
+    def __init__(self, filepath, file_format=None):
+        """
+        Instantiate a RasterFile.
+
+        Parameters
+        ----------
+        filepath : str
+            Path to the raster file.
+        file_format : str, optional
+            Format of the file. If None, the format is detected.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.filepath = filepath
+        self.file_format = file_format if file_format is not None \
+            else detect_format(filepath)
+        self._shape = None
+
+
+    @property
+    def shape(self):
+        """
+        Get the number of rows and columns in the raster.
+        """
+        if self._shape is None:
+            with open(self.filepath, "rb") as f:
+                self._shape = tuple(formats[self.file_format][1](f))
+        return self._shape
+
+
+    def read_window(self, y, x, rows, columns):
+        """
+        Load a window of the raster.
+
+        Parameters
+        ----------
+        y : int
+            First row of the window.
+        x : int
+            First column of the window.
+        rows : int
+            Number of rows in the window.
+        columns : int
+            Number of columns in the window.
+
+        Returns
+        -------
+        numpy.ndarray
+            Values within the window, clipped to the raster.
+
+        """
+
+        plane, _ = load_environment(self.filepath, self.file_format,
+                                    columns, rows, y, x)
+        return plane
+
+
+    def tiles(self, rows, columns):
+        """
+        Yield windows covering the raster, loading each one as it is needed.
+
+        Parameters
+        ----------
+        rows : int
+            Number of rows in each tile.
+        columns : int
+            Number of columns in each tile.
+
+        Yields
+        ------
+        y : int
+            First row of the tile.
+        x : int
+            First column of the tile.
+        tile : numpy.ndarray
+            Values within the tile.
+
+        """
+
+        num_of_rows, num_of_columns = self.shape
+        for y in range(0, num_of_rows, rows):
+            for x in range(0, num_of_columns, columns):
+                yield y, x, self.read_window(y, x, rows, columns)
+
+
+# Register the built-in formats
+register_format("csv", load_csv, csv_shape, (".csv", ".txt"))
+register_format("npy", load_npy, npy_shape, (".npy",), b"\x93NUMPY")
+register_format("npz", load_npz, npz_shape, (".npz",), b"PK\x03\x04")
+register_format("grid", load_grid, grid_shape, (".grid",), grid_magic)
+
+
+
+class LoadersTestCase(unittest.TestCase):
+    """
+    The LoadersTestCase class provides a collection of unit tests for the
+    environment loaders.
+    """
+
+    plane = numpy.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+    def path(self, filename):
+        """
+        Return a path in the temporary test directory.
+        """
+        return os.path.join(self.directory.name, filename)
+
+
+    def test_formats(self):
+        """
+        Test that each format loads the same plane.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Write the plane in each format
+        with open(self.path("plane.csv"), "w") as f:
+            f.write("1,2,3,\n4,5,6,\n")
+        numpy.save(self.path("plane.npy"), self.plane)
+        numpy.savez(self.path("plane.npz"), other=numpy.zeros(1),
+                    plane=self.plane)
+        save_grid(self.path("plane.grid"), self.plane)
+
+        # Verify each format is detected and loaded, so agents can eat
+        for name in ("csv", "npy", "npz", "grid"):
+            plane, report = load_environment(self.path("plane." + name))
+            self.assertTrue(numpy.array_equal(plane, self.plane))
+            self.assertTrue(plane.flags.writeable)
+            self.assertEqual(report["format"], name)
+            self.assertGreater(report["bytes_read"], 0)
+
+
+    def test_detect_from_header(self):
+        """
+        Test that formats are detected from the header when the extension
+        is not recognised.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        save_grid(self.path("plane.dat"), self.plane)
+        with open(self.path("plane.dat"), "rb") as f, \
+                open(self.path("plane.bin"), "wb") as g:
+            g.write(f.read())
+        numpy.save(self.path("array.npy"), self.plane)
+        os.rename(self.path("array.npy"), self.path("array.raster"))
+
+        self.assertEqual(detect_format(self.path("plane.bin")), "grid")
+        self.assertEqual(detect_format(self.path("array.raster")), "npy")
+
+
+    def test_default_environment(self):
+        """
+        Test that the default environment file loads as CSV.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        filepath = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                "in.txt")
+        plane, report = load_environment(filepath)
+        self.assertEqual(plane.shape, (300, 300))
+        self.assertEqual(plane[0][0], 220)
+        self.assertGreaterEqual(report["bytes_read"],
+                                os.path.getsize(filepath))
+
+
+    def test_limits(self):
+        """
+        Test that only the rows and columns within the limits are read.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        plane = numpy.arange(200 * 300, dtype=numpy.float64).reshape(200, 300)
+        numpy.savetxt(self.path("plane.csv"), plane, fmt="%d", delimiter=",")
+        numpy.save(self.path("plane.npy"), plane)
+        numpy.save(self.path("fortran.npy"), numpy.asfortranarray(plane))
+        numpy.savez_compressed(self.path("plane.npz"), plane=plane)
+        save_grid(self.path("plane.grid"), plane)
+
+        for name in ("plane.csv", "plane.npy", "fortran.npy", "plane.npz",
+                     "plane.grid"):
+            # Verify the limits and offsets are applied
+            window, report = load_environment(self.path(name), None, 10, 5,
+                                              20, 30)
+            self.assertTrue(numpy.array_equal(window, plane[20:25, 30:40]),
+                            name)
+
+            # Verify windows are clipped to the raster
+            window, _ = load_environment(self.path(name), None, 100, 100,
+                                         150, 250)
+            self.assertEqual(window.shape, (50, 50), name)
+
+        # Verify only the window is read from binary grids
+        _, report = load_environment(self.path("plane.grid"), None, 10, 5)
+        self.assertEqual(report["bytes_read"], grid_header.size + 5 * 10 * 8)
+
+        # Verify rows past the limit are not read from CSV files
+        _, report = load_environment(self.path("plane.csv"), None, 10, 5)
+        self.assertLess(report["bytes_read"],
+                        os.path.getsize(self.path("plane.csv")) / 10)
+
+
+    def test_raster_file(self):
+        """
+        Test that raster tiles are loaded on demand.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        plane = numpy.arange(7 * 5, dtype=numpy.float64).reshape(7, 5)
+        numpy.savetxt(self.path("plane.csv"), plane, fmt="%d", delimiter=",")
+        save_grid(self.path("plane.grid"), plane)
+
+        for name in ("plane.csv", "plane.grid"):
+            raster = RasterFile(self.path(name))
+            self.assertEqual(raster.shape, (7, 5))
+
+            # Verify the tiles cover the raster
+            tiles = list(raster.tiles(3, 2))
+            self.assertEqual(len(tiles), 9)
+            for y, x, tile in tiles:
+                self.assertTrue(numpy.array_equal(tile,
+                                                  plane[y:y + 3, x:x + 2]))
+
+
+    def test_errors(self):
+        """
+        Test that failures are reported with the file path and cause.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Missing file
+        with self.assertRaises(EnvironmentLoadError) as context:
+            load_environment(self.path("missing.csv"))
+        self.assertIn("missing.csv", str(context.exception))
+
+        # Invalid values
+        with open(self.path("bad.csv"), "w") as f:
+            f.write("1,2\n3,x\n")
+        with self.assertRaises(EnvironmentLoadError):
+            load_environment(self.path("bad.csv"))
+
+        # Truncated grid
+        save_grid(self.path("plane.grid"), self.plane)
+        with open(self.path("plane.grid"), "r+b") as f:
+            f.truncate(grid_header.size + 8)
+        with self.assertRaises(EnvironmentLoadError):
+            load_environment(self.path("plane.grid"))
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,422 @@
+"""
+Memory Accounting
+=================
+
+Measures the memory held by the parts of a model, checks it against a
+budget and traces allocations between iterations to help find leaks.
+
+Sizes are measured by following the references held by each part, so an
+object is only counted once, in the first part found to hold it. NumPy
+arrays count their data once, including data held in shared memory.
+Functions, classes and modules are not followed.
+
+Allocations are traced with `tracemalloc`, which slows the interpreter
+while it is tracing, so it is only started when a SnapshotTracker is
+created.
+"""
+
+import collections
+import sys
+import threading
+import tracemalloc
+import types
+import unittest
+import warnings
+import numpy
+import agentframework
+
+# Actions taken when a memory budget is exceeded
+budget_actions = ("warn", "refuse")
+
+# Estimated bytes taken by each agent stored as arrays and as an object,
+# used to check a budget before the agents are created. The object size was
+# measured on 64-bit CPython and rounded up.
+array_agent_bytes = 3 * 8
+object_agent_bytes = 256
+
+# Bytes taken by each environment cell, which are loaded as 64-bit floats
+cell_bytes = 8
+
+# Types whose references are not followed when measuring sizes
+_skipped_types = (type, types.ModuleType, types.FunctionType,
+                  types.BuiltinFunctionType, types.MethodType,
+                  types.CodeType, types.FrameType, threading.Thread)
+
+
+class MemoryBudgetError(MemoryError):
+    """
+    Raised when a model would exceed its memory budget.
+    """
+
+
+
+class MemoryBudgetWarning(UserWarning):
+    """
+    Warns that a model would exceed its memory budget.
+    """
+
+
+
+def deep_size(obj, seen=None):
+    """
+    Return the bytes taken by an object and the objects it references.
+
+    Parameters
+    ----------
+    obj : object
+        The object to measure.
+    seen : set, optional
+        Identities of objects that have already been counted, which is
+        updated with the objects counted. If None, a new set is used. The
+        default is None.
+
+    Returns
+    -------
+    int
+        Size in bytes.
+
+    """
+
+    if seen is None:
+        seen = set()
+
+    # Follow references depth first, without recursing
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if obj is None or id(obj) in seen or isinstance(obj, _skipped_types):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        # Count array data through the array that owns it, or once for
+        # arrays over other buffers
+        if isinstance(obj, numpy.ndarray):
+            base = obj.base
+            if isinstance(base, numpy.ndarray):
+                stack.append(base)
+            elif base is not None and id(base) not in seen:
+                seen.add(id(base))
+                try:
+                    size += memoryview(base).nbytes
+                except TypeError:
+                    size += obj.nbytes
+            continue
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset,
+                              collections.deque)):
+            stack.extend(obj)
+        if hasattr(obj, "__dict__") and isinstance(obj.__dict__, dict):
+            stack.append(obj.__dict__)
+        for name in getattr(type(obj), "__slots__", ()):
+            stack.append(getattr(obj, name, None))
+    return size
+
+
+def measure(parts):
+    """
+    Return the bytes taken by each of several parts.
+
+    Parameters
+    ----------
+    parts : dict
+        Objects to measure, keyed by name. Objects referenced by several
+        parts are counted in the first.
+
+    Returns
+    -------
+    dict
+        Size of each part in bytes, keyed by name, and the sum of all parts
+        keyed by "total".
+
+    """
+
+    seen = set()
+    sizes = {name: deep_size(obj, seen) for name, obj in parts.items()}
+    sizes["total"] = sum(sizes.values())
+    return sizes
+
+
+def estimate(num_of_agents, num_of_cells, agent_arrays=False):
+    """
+    Return the estimated bytes taken by a set of agents and an environment.
+
+    Parameters
+    ----------
+    num_of_agents : int
+        Number of agents.
+    num_of_cells : int
+        Number of environment cells.
+    agent_arrays : bool, optional
+        Whether agents are stored as arrays. The default is False.
+
+    Returns
+    -------
+    int
+        Estimated size in bytes.
+
+    """
+
+    agent_bytes = array_agent_bytes if agent_arrays else object_agent_bytes
+    return num_of_agents * agent_bytes + num_of_cells * cell_bytes
+
+
+def check_budget(size, budget, action="warn", description="The model"):
+    """
+    Warn or raise an error if a size is over a memory budget.
+
+    Parameters
+    ----------
+    size : int
+        Size in bytes.
+    budget : int
+        Memory budget in bytes. If None, there is no budget.
+    action : str, optional
+        One of `budget_actions`. The default is "warn".
+    description : str, optional
+        Description of what takes the memory, used in messages. The
+        default is "The model".
+
+    Raises
+    ------
+    MemoryBudgetError
+        If the size is over budget and the action is "refuse".
+
+    Returns
+    -------
+    None.
+
+    """
+
+    if budget is None or size <= budget:
+        return
+    message = "{} needs {}, over the memory budget of {}".format(
+        description, format_bytes(size), format_bytes(budget))
+    if action == "refuse":
+        raise MemoryBudgetError(message)
+    warnings.warn(message, MemoryBudgetWarning, stacklevel=3)
+
+
+def format_bytes(size):
+    """
+    Return a size in bytes as text, in the largest unit it fills.
+
+    Parameters
+    ----------
+    size : int
+        Size in bytes.
+
+    Returns
+    -------
+    str
+        The size, such as "1.5 MB".
+
+    """
+
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return "{:.0f} {}".format(size, unit) if unit == "B" else \
+        "{:.1f} {}".format(size, unit)
+
+
+
+class SnapshotTracker():
+    """
+    The SnapshotTracker class takes `tracemalloc` snapshots between model
+    iterations and compares each with the last, showing where memory has
+    been allocated since.
+
+    Public Methods:
+
+        update - takes a snapshot, if due, comparing it with the last
+
+        format - returns the latest differences as text
+
+        stop - stops tracing allocations
+    """
+
+    def __init__(self, interval=1, limit=10, frames=1):
+        """
+        Instantiate a SnapshotTracker, starting to trace allocations if they
+        are not already traced.
+
+        Parameters
+        ----------
+        interval : int, optional
+            Number of iterations between snapshots. The default is 1.
+        limit : int, optional
+            Number of source lines kept in each comparison, from the largest
+            change. The default is 10.
+        frames : int, optional
+            Number of stack frames traced for each allocation. The default
+            is 1.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.interval = interval
+        self.limit = limit
+        self.snapshot = None
+        self.differences = []
+
+        # Only stop tracing on stop if it was started here
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start(frames)
+
+
+    def update(self, iteration):
+        """
+        Take a snapshot if one is due, comparing it with the last.
+
+        Parameters
+        ----------
+        iteration : int
+            Number of iterations completed.
+
+        Returns
+        -------
+        list[tracemalloc.StatisticDiff]
+            Largest differences by source line since the last snapshot, or
+            an empty list if no snapshot was compared.
+
+        """
+
+        if iteration % self.interval != 0 or not tracemalloc.is_tracing():
+            return []
+
+        # Leave out the allocations made by tracemalloc itself
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),))
+        differences = []
+        if self.snapshot is not None:
+            differences = snapshot.compare_to(self.snapshot,
+                                              "lineno")[:self.limit]
+            self.differences = differences
+        self.snapshot = snapshot
+        return differences
+
+
+    def format(self):
+        """
+        Return the latest differences as text, one source line per line.
+
+        Returns
+        -------
+        str
+            The differences, or a note if none have been compared.
+
+        """
+
+        if not self.differences:
+            return "No allocations compared yet"
+        return "\n".join(str(difference) for difference in self.differences)
+
+
+    def stop(self):
+        """
+        Stop tracing allocations, if tracing was started by this tracker.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self._started and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._started = False
+        self.snapshot = None
+
+
+
+class MemoryTestCase(unittest.TestCase):
+    """
+    The MemoryTestCase class provides a collection of unit tests for memory
+    accounting.
+    """
+
+    def test_measure(self):
+        """
+        Test that shared objects are counted once and array data is counted
+        through views.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        environment = agentframework.Environment(numpy.zeros((100, 100)))
+        agents = agentframework.AgentArrays(environment, numpy.zeros(500),
+                                            numpy.zeros(500))
+        sizes = measure({"environment": environment, "agents": agents})
+        self.assertGreater(sizes["environment"], 100 * 100 * 8)
+        self.assertLess(sizes["agents"], 100 * 100 * 8)
+        self.assertGreaterEqual(sizes["agents"], 500 * array_agent_bytes)
+        self.assertEqual(sizes["total"],
+                         sizes["environment"] + sizes["agents"])
+
+        # Verify a view counts the data of its base once
+        plane = numpy.zeros(1000)
+        views = (plane[:10], plane[10:])
+        self.assertEqual(deep_size(views), sys.getsizeof(views) +
+                         sys.getsizeof(views[0]) * 2 + sys.getsizeof(plane))
+        self.assertEqual(format_bytes(1536), "1.5 KB")
+
+
+    def test_check_budget(self):
+        """
+        Test that sizes over budget warn or raise an error.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        check_budget(100, None)
+        check_budget(100, 100)
+        with self.assertWarns(MemoryBudgetWarning):
+            check_budget(101, 100)
+        with self.assertRaises(MemoryBudgetError):
+            check_budget(101, 100, "refuse")
+        self.assertEqual(estimate(10, 100, True), 10 * 24 + 800)
+
+
+    def test_snapshot_tracker(self):
+        """
+        Test that allocations between snapshots are reported.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        tracker = SnapshotTracker(interval=2)
+        try:
+            leaked = []
+            for iteration in range(1, 5):
+                leaked.append(bytearray(100000))
+                tracker.update(iteration)
+            self.assertTrue(any(difference.size_diff >= 100000
+                                for difference in tracker.differences))
+            self.assertIn("memory.py", tracker.format())
+        finally:
+            tracker.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
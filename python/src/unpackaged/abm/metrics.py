@@ -0,0 +1,682 @@
+"""
+Iteration Metrics
+=================
+
+Streams a metrics record for each model iteration to any subscribed
+consumers.
+
+Each record is a dict holding:
+
+    iteration - number of iterations completed
+
+    active_agents - number of agents that were able to eat at the start of
+                    their turn
+
+    total_store - total store contents of all agents
+
+    remaining_resource - total environment resource within its limits
+
+    share_events - number of times a pair of agents shared their stores
+
+    duration - time taken to run the iteration, in seconds
+
+Totals are kept up to date from the amount eaten and regrown in each
+iteration, so the environment and agents are only scanned when the first
+record is built.
+Records are only built while there are subscribers.
+
+Rolling performance statistics for the GUI are kept by PerformanceStats.
+"""
+
+import collections
+import csv
+import sys
+import tempfile
+import unittest
+import numpy
+import agentframework
+
+try:
+    import resource
+except ImportError:
+    # Memory use is not reported where the resource module is unavailable
+    resource = None
+
+# Metrics record fields, in order
+metric_fields = ("iteration", "active_agents", "total_store",
+                 "remaining_resource", "share_events", "duration")
+
+
+def scan_totals(environment, agents):
+    """
+    Return the total agent store and remaining environment resource.
+
+    Parameters
+    ----------
+    environment : agentframework.Environment
+        The environment to total within its limits.
+    agents : list[agentframework.Agent] or agentframework.AgentArrays
+        The agents to total.
+
+    Returns
+    -------
+    tuple[float, float]
+        Total store contents and remaining resource.
+
+    """
+
+    if isinstance(agents, agentframework.AgentArrays):
+        total_store = float(numpy.sum(agents.store))
+    else:
+        total_store = float(sum(agent.store for agent in agents))
+    remaining_resource = float(numpy.sum(environment.limited_plane))
+    return total_store, remaining_resource
+
+
+def peak_memory():
+    """
+    Return the peak memory use of the current process.
+
+    Returns
+    -------
+    int
+        Peak resident memory in bytes, or None if it is not available on
+        this platform.
+
+    """
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Peak memory is given in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+
+class MetricsStream():
+    """
+    The MetricsStream class sends iteration metrics records to subscribed
+    callbacks.
+
+    A MetricsStream is false when it has no subscribers, so callers can skip
+    measuring an iteration when nobody is listening.
+
+    Public Methods:
+
+        subscribe - adds a callback to receive each record
+
+        unsubscribe - removes a subscribed callback
+
+        reset - forgets the running totals, after the model is initialized
+
+        update - adds the counts from an iteration to the running totals
+
+        publish - sends a record of the latest iteration to subscribers
+    """
+
+    def __init__(self):
+        """
+        Instantiate a MetricsStream.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self._subscribers = []
+        self._totals = None
+        self._share_events = 0
+
+
+    def __bool__(self):
+        return bool(self._subscribers)
+
+
+    def subscribe(self, callback):
+        """
+        Add a callback to receive each metrics record.
+
+        Parameters
+        ----------
+        callback : callable
+            Function called with each record.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self._subscribers.append(callback)
+
+
+    def unsubscribe(self, callback):
+        """
+        Remove a subscribed callback.
+
+        Parameters
+        ----------
+        callback : callable
+            The callback to remove.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self._subscribers.remove(callback)
+
+
+    def reset(self):
+        """
+        Forget the running totals, so they are scanned again when needed.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self._totals = None
+
+
+    def update(self, eaten, share_events, regrown=0):
+        """
+        Add the counts from an iteration to the running totals.
+
+        This is cheap, so it can be called whether or not there are
+        subscribers.
+
+        Parameters
+        ----------
+        eaten : float
+            Resource moved from the environment into agent stores.
+        share_events : int
+            Number of times a pair of agents shared their stores.
+        regrown : float, optional
+            Resource regrown in the environment. The default is 0.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self._totals is not None:
+            self._totals[0] += eaten
+            self._totals[1] += regrown - eaten
+        self._share_events = share_events
+
+
+    def publish(self, environment, agents, iteration, active_agents,
+                duration):
+        """
+        Send a record of the latest iteration to each subscriber.
+
+        Parameters
+        ----------
+        environment : agentframework.Environment
+            The model environment, scanned if there are no running totals.
+        agents : list[agentframework.Agent] or agentframework.AgentArrays
+            The model agents, scanned if there are no running totals.
+        iteration : int
+            Number of iterations completed.
+        active_agents : int
+            Number of agents that were able to eat in the iteration.
+        duration : float
+            Time taken to run the iteration, in seconds.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self._totals is None:
+            self._totals = list(scan_totals(environment, agents))
+
+        record = {
+            "iteration": iteration,
+            "active_agents": active_agents,
+            "total_store": self._totals[0],
+            "remaining_resource": self._totals[1],
+            "share_events": self._share_events,
+            "duration": duration,
+        }
+        for callback in list(self._subscribers):
+            callback(record)
+
+
+
+class FileSink():
+    """
+    The FileSink class writes metrics records to a CSV file, one row per
+    iteration.
+
+    Public Methods:
+
+        close - closes the file
+    """
+
+    def __init__(self, filepath):
+        """
+        Instantiate a FileSink.
+
+        Parameters
+        ----------
+        filepath : str
+            Path of the CSV file to write.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self._file = open(filepath, "w", newline="")
+        self._writer = csv.DictWriter(self._file, metric_fields)
+        self._writer.writeheader()
+
+
+    def __call__(self, record):
+        self._writer.writerow(record)
+
+
+    def close(self):
+        """
+        Close the file.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self._file.close()
+
+
+
+class SweepAggregator():
+    """
+    The SweepAggregator class summarises the metrics of several model runs,
+    such as a parameter sweep.
+
+    Public Methods:
+
+        subscriber - returns a callback that records metrics for a run
+
+        summary - returns a summary of each run
+    """
+
+    def __init__(self):
+        """
+        Instantiate a SweepAggregator.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.runs = {}
+
+
+    def subscriber(self, run):
+        """
+        Return a callback that records metrics for the given run.
+
+        Parameters
+        ----------
+        run : object
+            Label of the run, such as its parameter values.
+
+        Returns
+        -------
+        callable
+            Callback to subscribe to the run's metrics stream.
+
+        """
+
+        summary = self.runs.setdefault(run, {
+            "iterations": 0, "active_agents": 0, "total_store": 0.0,
+            "remaining_resource": 0.0, "share_events": 0, "duration": 0.0})
+
+        def record(record):
+            summary["iterations"] = record["iteration"]
+            summary["active_agents"] = record["active_agents"]
+            summary["total_store"] = record["total_store"]
+            summary["remaining_resource"] = record["remaining_resource"]
+            summary["share_events"] += record["share_events"]
+            summary["duration"] += record["duration"]
+
+        return record
+
+
+    def summary(self):
+        """
+        Return a summary of each run.
+
+        Returns
+        -------
+        dict
+            For each run: the number of iterations, the latest active agent
+            count, total store and remaining resource, and the total share
+            events and duration.
+
+        """
+
+        return {run: dict(summary) for run, summary in self.runs.items()}
+
+
+
+class MetricsChart():
+    """
+    The MetricsChart class plots the active agent count and remaining
+    resource against the iteration number on a set of matplotlib axes.
+
+    A new line is started when the iteration number goes back, such as when
+    the model is run again.
+    """
+
+    def __init__(self, axes, draw=None):
+        """
+        Instantiate a MetricsChart.
+
+        Parameters
+        ----------
+        axes : matplotlib.axes.Axes
+            Axes to plot the active agent count on. The remaining resource
+            is plotted on a twin axis.
+        draw : callable, optional
+            Function called to redraw the chart after each record, such as
+            a canvas `draw_idle` method. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.axes = axes
+        self.draw = draw
+        self._data = {field: [] for field in metric_fields}
+        self._agents_line, = axes.plot([], [], color="black")
+        self._resource_axes = axes.twinx()
+        self._resource_line, = self._resource_axes.plot([], [], color="green")
+        axes.set_xlabel("Iteration")
+        axes.set_ylabel("Active agents")
+        self._resource_axes.set_ylabel("Remaining resource")
+
+
+    def __call__(self, record):
+        data = self._data
+        if data["iteration"] and record["iteration"] <= data["iteration"][-1]:
+            for values in data.values():
+                values.clear()
+        for field in metric_fields:
+            data[field].append(record[field])
+
+        # Update the lines and rescale the axes
+        self._agents_line.set_data(data["iteration"], data["active_agents"])
+        self._resource_line.set_data(data["iteration"],
+                                     data["remaining_resource"])
+        for axes in (self.axes, self._resource_axes):
+            axes.relim()
+            axes.autoscale_view()
+        if self.draw is not None:
+            self.draw()
+
+
+
+class PerformanceStats():
+    """
+    The PerformanceStats class keeps rolling averages of the time taken to
+    step the model and display it, and of the frame rate.
+
+    Public Methods:
+
+        record - adds the timings of a frame
+
+        reset - forgets all timings, such as when an animation is paused
+
+        summary - returns the rolling averages
+    """
+
+    def __init__(self, window=30):
+        """
+        Instantiate a PerformanceStats.
+
+        Parameters
+        ----------
+        window : int, optional
+            Number of frames to average over. The default is 30.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.step_times = collections.deque(maxlen=window)
+        self.display_times = collections.deque(maxlen=window)
+        self.frame_intervals = collections.deque(maxlen=window)
+        self._last_frame = None
+
+
+    def __str__(self):
+        summary = self.summary()
+        text = "Step: {:.1f} ms | Display: {:.1f} ms | {:.1f} fps".format(
+            summary["step_time"] * 1000, summary["display_time"] * 1000,
+            summary["frame_rate"])
+        if summary["peak_memory"] is not None:
+            text += " | Peak memory: {:.0f} MB".format(
+                summary["peak_memory"] / 2 ** 20)
+        return text
+
+
+    def record(self, frame_start, step_time, display_time):
+        """
+        Add the timings of a frame.
+
+        Parameters
+        ----------
+        frame_start : float
+            Time the frame started, from `time.perf_counter`.
+        step_time : float
+            Time taken to step the model, in seconds.
+        display_time : float
+            Time taken to display the model, in seconds.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.step_times.append(step_time)
+        self.display_times.append(display_time)
+        if self._last_frame is not None:
+            self.frame_intervals.append(frame_start - self._last_frame)
+        self._last_frame = frame_start
+
+
+    def reset(self):
+        """
+        Forget all timings.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.step_times.clear()
+        self.display_times.clear()
+        self.frame_intervals.clear()
+        self._last_frame = None
+
+
+    def summary(self):
+        """
+        Return the rolling averages.
+
+        Returns
+        -------
+        dict
+            Average step time and display time in seconds, frame rate in
+            frames per second, and peak memory use in bytes.
+
+        """
+
+        def average(values):
+            return sum(values) / len(values) if values else 0.0
+
+        interval = average(self.frame_intervals)
+        return {
+            "step_time": average(self.step_times),
+            "display_time": average(self.display_times),
+            "frame_rate": 1 / interval if interval > 0 else 0.0,
+            "peak_memory": peak_memory(),
+        }
+
+
+
+class MetricsStreamTestCase(unittest.TestCase):
+    """
+    The MetricsStreamTestCase class provides a collection of unit tests for
+    the MetricsStream class and its consumers.
+    """
+
+    def create_agents(self):
+        """
+        Return two agents in a small environment.
+        """
+        environment = agentframework.Environment(
+            [[50.0] * 4 for _ in range(4)], 3, 3)
+        return agentframework.AgentArrays(environment, [0, 2], [0, 2],
+                                          [5, 15], 100, 10)
+
+
+    def test_running_totals(self):
+        """
+        Test that running totals match a scan of the model state.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        agents = self.create_agents()
+        stream = MetricsStream()
+        records = []
+        self.assertFalse(stream)
+        stream.subscribe(records.append)
+        self.assertTrue(stream)
+
+        # Publish a first record, then eat and share
+        stream.publish(agents.environment, agents, 1, 2, 0.5)
+        agents[0].eat()
+        agents[1].eat()
+        agents[0].share_with_neighbours(5)
+        stream.update(20, 1)
+        stream.publish(agents.environment, agents, 2, 2, 0.25)
+
+        self.assertEqual(records[0]["total_store"], 20)
+        self.assertEqual(records[0]["remaining_resource"], 450)
+        self.assertEqual(
+            (records[1]["total_store"], records[1]["remaining_resource"]),
+            scan_totals(agents.environment, agents))
+        self.assertEqual(records[1]["share_events"], 1)
+
+        # Verify unsubscribed callbacks receive no further records
+        stream.unsubscribe(records.append)
+        self.assertFalse(stream)
+        stream.publish(agents.environment, agents, 3, 0, 0)
+        self.assertEqual(len(records), 2)
+
+
+    def test_consumers(self):
+        """
+        Test that the file sink and sweep aggregator record each iteration.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        agents = self.create_agents()
+        aggregator = SweepAggregator()
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = directory + "/metrics.csv"
+            sink = FileSink(filepath)
+            for run in ("a", "b"):
+                stream = MetricsStream()
+                stream.subscribe(sink)
+                stream.subscribe(aggregator.subscriber(run))
+                for iteration in (1, 2):
+                    stream.update(0, 3)
+                    stream.publish(agents.environment, agents, iteration,
+                                   2, 0.5)
+            sink.close()
+
+            with open(filepath, newline="") as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1]["share_events"], "3")
+        self.assertEqual(aggregator.summary()["b"]["share_events"], 6)
+        self.assertEqual(aggregator.summary()["b"]["duration"], 1)
+
+
+    def test_chart(self):
+        """
+        Test that the chart plots each run.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        import matplotlib.figure
+        chart = MetricsChart(matplotlib.figure.Figure().add_subplot())
+        agents = self.create_agents()
+        stream = MetricsStream()
+        stream.subscribe(chart)
+        for iteration in (1, 2, 1):
+            stream.publish(agents.environment, agents, iteration, 2, 0)
+        self.assertEqual(list(chart._agents_line.get_xdata()), [1])
+
+
+    def test_performance_stats(self):
+        """
+        Test that performance statistics are averaged over the window.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        stats = PerformanceStats(window=2)
+        for frame in range(4):
+            stats.record(frame * 0.1, frame * 0.01, 0.02)
+        summary = stats.summary()
+        self.assertAlmostEqual(summary["step_time"], 0.025)
+        self.assertAlmostEqual(summary["display_time"], 0.02)
+        self.assertAlmostEqual(summary["frame_rate"], 10)
+        self.assertIn("fps", str(stats))
+
+        # Verify a reset forgets the previous frame
+        stats.reset()
+        stats.record(10, 0, 0)
+        self.assertEqual(stats.summary()["frame_rate"], 0)
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
@@ -5,24 +5,42 @@ Agent-Based Model Simulation
 A basic ABM that simulates agents traversing an environment
 and eating a portion of it. Agents can share what they have
 eaten with other agents if they are nearby.
+
+The GUI, plotting, HTTP and HTML parsing modules are only imported when
+they are first needed, so the Model can be used without loading them.
 """
 
-import tkinter
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot
-import matplotlib.animation
-import csv
 import random
-import requests
-import bs4
 import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+import numpy
 import agentframework
+import behaviours
+import config
+import export
+import loaders
+import memory
+import metrics
+import neighbourhood
+import parallel
+import regrowth
+import rendering
+import sharedstate
 
 # Define default parameter values
 default_num_of_agents = 50
 default_num_of_iterations = 5000
 default_neighbourhood_size = 5
+default_toroidal_neighbourhood = False
+default_neighbour_strategy = "auto"
+default_execution_mode = "sequential"
+default_num_of_workers = os.cpu_count() or 1
+default_shared_memory = False
 default_agent_store_size = 5000
 default_environment_filepath = os.path.dirname(os.path.realpath(__file__)) + \
     os.sep + 'in.txt'
@@ -30,9 +48,81 @@ default_start_positions_url = \
     'http://www.geog.leeds.ac.uk/courses/computing/practicals/python/agent-framework/part9/data.html'
 default_environment_limit = 100
 default_agent_bite_size = 100
+default_regrowth_rate = 0
+default_memory_budget = None
+default_memory_budget_action = "warn"
 default_animation_interval = 50
-agent_color_active = "black"
-agent_color_inactive = "grey"
+default_performance_update_interval = 0.5
+
+# Delay before applying entered parameters, in milliseconds, so updates
+# requested in quick succession are applied once
+default_parameter_update_delay = 300
+
+# Parameters that can be changed without initializing the model again, and
+# those that can be changed while the model state is shared with workers
+in_place_parameters = ("num_of_iterations", "neighbourhood_size",
+                       "toroidal_neighbourhood", "neighbour_strategy",
+                       "agent_store_size", "agent_bite_size",
+                       "regrowth_rate", "memory_budget",
+                       "memory_budget_action")
+shared_in_place_parameters = ("num_of_iterations", "memory_budget",
+                              "memory_budget_action")
+
+# Actions taken to apply parameter updates, from the cheapest
+update_actions = ("none", "update", "resize", "initialize")
+
+# Model parameters, used to validate configuration files and entered values
+parameter_schema = config.Schema({
+    "num_of_agents": config.Parameter(
+        int, default_num_of_agents, "Number of agents", minimum=0),
+    "num_of_iterations": config.Parameter(
+        int, default_num_of_iterations, "Number of iterations", minimum=0),
+    "neighbourhood_size": config.Parameter(
+        int, default_neighbourhood_size, "Neighbourhood size", minimum=0),
+    "agent_store_size": config.Parameter(
+        int, default_agent_store_size, "Agent store size", minimum=0),
+    "start_positions_url": config.Parameter(
+        str, default_start_positions_url, "Start positions URL",
+        nullable=True),
+    "environment_filepath": config.Parameter(
+        str, default_environment_filepath, "Environment file path"),
+    "environment_x_lim": config.Parameter(
+        int, default_environment_limit, "Environment x-axis limit",
+        minimum=1, nullable=True),
+    "environment_y_lim": config.Parameter(
+        int, default_environment_limit, "Environment y-axis limit",
+        minimum=1, nullable=True),
+    "agent_bite_size": config.Parameter(
+        int, default_agent_bite_size, "Agent bite size", minimum=0),
+    "toroidal_neighbourhood": config.Parameter(
+        bool, default_toroidal_neighbourhood, "Toroidal neighbourhood"),
+    "neighbour_strategy": config.Parameter(
+        str, default_neighbour_strategy, "Neighbour strategy",
+        choices=("auto",) + tuple(neighbourhood.index_classes)),
+    "execution_mode": config.Parameter(
+        str, default_execution_mode, "Execution mode",
+        choices=("sequential", "parallel")),
+    "num_of_workers": config.Parameter(
+        int, default_num_of_workers, "Number of workers", minimum=1),
+    "shared_memory": config.Parameter(
+        bool, default_shared_memory, "Shared memory"),
+    "regrowth_rate": config.Parameter(
+        float, float(default_regrowth_rate), "Regrowth rate", minimum=0),
+    "seed": config.Parameter(int, None, "Random seed", minimum=0,
+                             nullable=True),
+    "memory_budget": config.Parameter(
+        int, default_memory_budget, "Memory budget", minimum=0,
+        nullable=True),
+    "memory_budget_action": config.Parameter(
+        str, default_memory_budget_action, "Memory budget action",
+        choices=memory.budget_actions),
+})
+
+# Maximum time taken to import this module, in seconds
+import_time_budget = 0.5
+
+# Modules that are only imported when needed
+lazy_modules = ("tkinter", "matplotlib", "requests", "bs4")
 
 
 def log(message):
@@ -53,6 +143,26 @@ def log(message):
     print(message)
 
 
+def load_gui_modules():
+    """
+    Import the GUI and plotting modules used by the Controller and View.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    global tkinter, matplotlib
+    import tkinter
+    import tkinter.messagebox
+    import matplotlib
+    matplotlib.use('TkAgg')
+    import matplotlib.pyplot
+    import matplotlib.animation
+    import matplotlib.backends.backend_tkagg
+
+
 class Controller():
     """
     The Controller class coordinates communication between the given Model
@@ -72,6 +182,19 @@ class Controller():
         reset - reset the model with its current parameters
         
         load_parameters - load the model parameters from the view
+
+        schedule_parameter_update - load the model parameters from the view
+                                    after a short delay
+
+        subscribe_metrics - send model metrics records to a callback
+
+        unsubscribe_metrics - stop sending model metrics records to a callback
+
+        trace_memory - start or stop tracing model memory allocations
+
+        memory_report - return the model memory use as text
+
+        close - release resources held by the model
     """
     
     def __init__(self, model, view_class):
@@ -91,12 +214,22 @@ class Controller():
 
         """
 
+        # Import the GUI modules
+        load_gui_modules()
+
         # Initialize model properties
         self.model = model              # Store a reference to the model
         self.view = view_class(self)    # Initialize the View
         self.animation = None           # Used to track the animation
         self.iteration_count = 0        # Used to track the iteration count
         self.has_been_reset = False     # Track when a reset has occurred
+        self.performance = metrics.PerformanceStats() # Frame timings
+        self._performance_shown_at = 0  # Time the timings were last shown
+        self._pending_update = None     # Scheduled parameter update
+        self._pending_frame = None      # Frame timings awaiting its draw
+
+        # Time each frame until its figure has been drawn
+        self.view.canvas.mpl_connect("draw_event", self._on_draw)
         
         log("Initialized controller with current model:")
         log(self.model)
@@ -110,55 +243,34 @@ class Controller():
     def update_parameters(self):
         """
         Update the model parameters from values specified in the GUI.
+
+        Only the parameters that have changed are applied, in place where
+        possible, so any running animation continues unless the model is
+        initialized again.
         
         Will raise an exception when a parameter cannot be updated correctly.
 
         Returns
         -------
-        None.
+        str
+            The action taken to apply the changes, one of `update_actions`.
 
         """
         
         log("Updating model parameters.")
         
-        # Stop any running animation
-        self.stop_animation()
-        
-        # Validate and get number of agents
-        num_of_agents = None
-        num_of_agents_text = self.view.num_of_agents_entry.get()
-        if len(num_of_agents_text) > 0:
-            try:
-                num_of_agents = int(num_of_agents_text)
-            except:
-                raise Exception("Number of agents must be an integer")
-
-        # Validate and get number of iterations
-        num_of_iterations = None
-        num_of_iterations_text = self.view.num_of_iterations_entry.get()
-        if len(num_of_iterations_text) > 0:
-            try:
-                num_of_iterations = int(num_of_iterations_text)
-            except:
-                raise Exception("Number of iterations must be an integer")
-
-        # Validate and get neighbourhood size
-        neighbourhood_size = None
-        neighbourhood_size_text = self.view.neighbourhood_size_entry.get()
-        if len(neighbourhood_size_text) > 0:
-            try:
-                neighbourhood_size = int(neighbourhood_size_text)
-            except:
-                raise Exception("Neighbourhood size must be an integer")
-
-        # Validate and get agent store size
-        agent_store_size = None
-        agent_store_size_text = self.view.agent_store_size_entry.get()
-        if len(agent_store_size_text) > 0:
-            try:
-                agent_store_size = int(agent_store_size_text)
-            except:
-                raise Exception("Agent store size must be an integer")
+        # Validate and get each numeric parameter that has been entered
+        values = {}
+        for name, entry_field in (
+                ("num_of_agents", self.view.num_of_agents_entry),
+                ("num_of_iterations", self.view.num_of_iterations_entry),
+                ("neighbourhood_size", self.view.neighbourhood_size_entry),
+                ("agent_store_size", self.view.agent_store_size_entry),
+                ("agent_bite_size", self.view.agent_bite_size_entry),
+                ("regrowth_rate", self.view.regrowth_rate_entry)):
+            text = entry_field.get()
+            if len(text) > 0:
+                values[name] = parameter_schema.parse(name, text)
 
         # Get start positions URL
         start_positions_url = self.view.start_positions_url_entry.get()
@@ -171,30 +283,29 @@ class Controller():
         x_lim = None
         y_lim = None
         if len(environment_limit_text) > 0:
-            try:
-                x_lim, y_lim = environment_limit_text.split(",")
-                x_lim = int(x_lim)
-                y_lim = int(y_lim)
-            except:
-                raise Exception("Environment limit must be of the form X,Y, where X and Y are integers")
-
-        # Validate and get agent bite size
-        agent_bite_size = None
-        agent_bite_size_text = self.view.agent_bite_size_entry.get()
-        if len(agent_bite_size_text) > 0:
-            try:
-                agent_bite_size = int(agent_bite_size_text)
-            except:
-                raise Exception("Agent store size must be an integer")
-
-        # Update model parameters
-        self.model.set_parameters(num_of_agents, num_of_iterations,
-                                  neighbourhood_size, agent_store_size,
-                                  start_positions_url, environment_filepath, 
-                                  x_lim, y_lim, agent_bite_size)
+            limits = environment_limit_text.split(",")
+            if len(limits) != 2:
+                raise config.ConfigError("Environment limit must be of the form X,Y, where X and Y are integers")
+            x_lim = parameter_schema.parse("environment_x_lim",
+                                           limits[0].strip())
+            y_lim = parameter_schema.parse("environment_y_lim",
+                                           limits[1].strip())
+
+        # Apply the changed model parameters, stopping any running
+        # animation if the model could not be updated
+        values.update(start_positions_url=start_positions_url,
+                      environment_filepath=environment_filepath,
+                      environment_x_lim=x_lim, environment_y_lim=y_lim)
+        try:
+            action = self.model.update_parameters(values)
+        except Exception:
+            self.stop_animation()
+            raise
+        log("Model parameters updated: {}".format(action))
         
         # Update view parameters
         self._update_parameters_view()
+        return action
         
 
     def _iterate(self):
@@ -207,16 +318,64 @@ class Controller():
 
         """
         
+        # Stop once the number of iterations has been run, which may have
+        # been changed during the run
+        if self.model.iteration_count >= self.model.num_of_iterations:
+            self.stop_animation()
+            log("Model simulation complete.")
+            return
+
         # Iterate model
+        frame_start = time.perf_counter()
         is_done = self.model.iterate()
         self.iteration_count += 1
+        step_end = time.perf_counter()
         
-        if is_done:
+        if is_done or \
+                self.model.iteration_count >= self.model.num_of_iterations:
             self.stop_animation()
             log("Model simulation complete.")
 
-        # Update the view
+        # Update the view, recording the frame timings once the figure has
+        # been drawn by the animation
         self._update_view()
+        self._pending_frame = (frame_start, step_end)
+
+
+    def _on_draw(self, event):
+        """
+        Record the timings of the latest frame once its figure has been
+        drawn, showing them periodically if enabled.
+
+        The display time runs from the end of the model step to the end of
+        the draw, so it includes rendering the figure as well as updating
+        its artists.
+
+        Parameters
+        ----------
+        event : matplotlib.backend_bases.DrawEvent
+            The draw event.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self._pending_frame is None:
+            return
+        frame_start, step_end = self._pending_frame
+        self._pending_frame = None
+        display_end = time.perf_counter()
+
+        self.performance.record(frame_start, step_end - frame_start,
+                                display_end - step_end)
+        if self.view.performance_enabled() and display_end - \
+                self._performance_shown_at >= \
+                default_performance_update_interval:
+            self.view.show_performance(self.performance,
+                                       self.model.active_agents)
+            self._performance_shown_at = display_end
 
 
     def _update_view(self):
@@ -258,6 +417,8 @@ class Controller():
                                    self.model.environment_filepath)
         self._set_entry_field_value(self.view.agent_bite_size_entry,
                                    self.model.agent_bite_size)
+        self._set_entry_field_value(self.view.regrowth_rate_entry,
+                                   self.model.regrowth_rate)
         
         # Update the environment limit field
         environment_limit_text = ""
@@ -306,13 +467,15 @@ class Controller():
         if not self.has_been_reset:
             self.reset()
 
-        # Start animation
+        # Start animation, with frames until the model number of iterations
+        # has been run, as checked on each frame
         self.animation = matplotlib.animation.FuncAnimation(
             self.view.fig,
             (lambda frame_number: self._iterate()),
             interval=default_animation_interval,
             repeat=False,
-            frames=self.model.num_of_iterations)
+            frames=None,
+            cache_frame_data=False)
         
         # Track
         self.has_been_reset = False
@@ -336,6 +499,7 @@ class Controller():
         # Stop animation if one exists
         if self.animation is not None:
             self.animation.event_source.stop()
+            self.performance.reset()
             log("Stopped after {} iterations".format(self.iteration_count))
 
 
@@ -376,9 +540,10 @@ class Controller():
         self.animation = None
         self.iteration_count = 0
    
-        # Attempt model initialization
+        # Attempt to restore the initial model state, initializing it if the
+        # parameters have changed
         try:
-            self.model.initialize()
+            self.model.reset()
         except Exception as e:
             # Abort initialization on error
             self.view.show_error(e)
@@ -399,23 +564,146 @@ class Controller():
         """
         Load the parameters specified in the View.
 
+        The model is only reset if it was initialized again to apply the
+        parameters.
+
         Returns
         -------
         None.
 
         """
         
+        self._pending_update = None
         try:
             # Update the model
-            self.update_parameters()
+            action = self.update_parameters()
             
-            # Reset current model
-            self.reset();
+            # Reset the model from its new initial state, if initialized
+            # again, otherwise show the updated model
+            if action == "initialize":
+                self.reset()
+            elif action != "none":
+                self._update_view()
+                self.view.canvas.draw()
             
         except Exception as e:
             self.view.show_error(e)
 
 
+    def schedule_parameter_update(self):
+        """
+        Load the parameters specified in the View after a short delay.
+
+        Requests made before the delay has passed replace the pending one,
+        so the parameters are loaded once.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self._pending_update is not None:
+            self.view.root.after_cancel(self._pending_update)
+        self._pending_update = self.view.root.after(
+            default_parameter_update_delay, self.load_parameters)
+
+
+    def subscribe_metrics(self, callback):
+        """
+        Send the metrics record of each model iteration to a callback.
+
+        Parameters
+        ----------
+        callback : callable
+            Function called with each metrics record.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.model.metrics.subscribe(callback)
+
+
+    def unsubscribe_metrics(self, callback):
+        """
+        Stop sending model metrics records to a callback.
+
+        Parameters
+        ----------
+        callback : callable
+            A callback given to `subscribe_metrics`.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.model.metrics.unsubscribe(callback)
+
+
+    def trace_memory(self, enabled):
+        """
+        Start or stop comparing memory allocations between iterations.
+
+        Parameters
+        ----------
+        enabled : bool
+            Whether to trace allocations.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.model.memory_tracker is not None:
+            self.model.memory_tracker.stop()
+        self.model.memory_tracker = memory.SnapshotTracker() if enabled \
+            else None
+
+
+    def memory_report(self):
+        """
+        Return the memory held by each part of the model as text, followed by
+        the allocations since the last snapshot, if tracing.
+
+        Returns
+        -------
+        str
+            The memory report.
+
+        """
+
+        lines = ["{}: {}".format(name.replace("_", " ").capitalize(),
+                                 memory.format_bytes(size))
+                 for name, size in self.model.memory_usage().items()]
+        if self.model.memory_tracker is not None:
+            lines += ["", "Allocations since the last snapshot:",
+                      self.model.memory_tracker.format()]
+        return "\n".join(lines)
+
+
+    def close(self):
+        """
+        Release resources held by the model.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.stop_animation()
+        if self._pending_update is not None:
+            self.view.root.after_cancel(self._pending_update)
+            self._pending_update = None
+        self.model.close()
+
+
 
 
 class View():
@@ -425,8 +713,10 @@ class View():
     
     Public Methods:
         
-        display -        renders the given model
-        show_error -     displays an error popup
+        display -             renders the given model
+        show_error -          displays an error popup
+        performance_enabled - returns whether performance is shown
+        show_performance -    shows frame timings in the status bar
         
     """
 
@@ -446,15 +736,24 @@ class View():
         """
 
         log("Instantiating a View.")
+
+        # Import the GUI modules
+        load_gui_modules()
         
         # Set the controller back-reference
         self.controller = controller
 
+        # Draw models above these sizes at a lower level of detail
+        self.detail_agent_limit = rendering.detail_agent_limit
+        self.detail_cell_limit = rendering.detail_cell_limit
+
         # Prepare the visualization figure
         matplotlib.pyplot.ioff()
         self.fig = matplotlib.pyplot.figure(figsize=(7, 7))
-        ax = self.fig.add_axes([0, 0, 1, 1])
-        ax.set_autoscale_on(False)
+        self.axes = self.fig.add_subplot()
+
+        # Drawing of the model, updated in place for each frame
+        self.drawing = None
 
         # Create GUI window
         root = tkinter.Tk()
@@ -469,6 +768,16 @@ class View():
         model_menu.add_command(label="Run model", command=self._on_run_model)
         model_menu.add_command(label="Pause animation", command=self._on_stop)
         model_menu.add_command(label="Continue animation", command=self._on_start)
+        model_menu.add_command(label="Show metrics", command=self._on_show_metrics)
+        self.performance_variable = tkinter.BooleanVar(root, False)
+        model_menu.add_checkbutton(label="Show performance",
+                                   variable=self.performance_variable,
+                                   command=self._on_toggle_performance)
+        model_menu.add_command(label="Show memory", command=self._on_show_memory)
+        self.trace_memory_variable = tkinter.BooleanVar(root, False)
+        model_menu.add_checkbutton(label="Trace memory",
+                                   variable=self.trace_memory_variable,
+                                   command=self._on_toggle_trace_memory)
         model_menu.add_command(label="Exit", command=self._on_exit)
         
         
@@ -509,6 +818,10 @@ class View():
             parameters_frame, "Agent Bite Size:",
             "",
             3, 2, 3, 3)
+
+        self.regrowth_rate_entry = self._insert_labelled_entry(
+            parameters_frame, "Regrowth Rate:", "",
+            4, 0, 4, 1)
         
         # Add a button to update parameters
         load_button = tkinter.Button(parameters_frame, text="Update Model",
@@ -528,11 +841,17 @@ class View():
         canvas._tkcanvas.pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
         self.canvas = canvas
 
+        # Add a status bar for performance, shown when enabled
+        self.performance_label = tkinter.Label(root, anchor=tkinter.W)
+
 
     def display(self, model):
         """
         Display the current state of the given model
 
+        Models with more agents or environment cells than the view detail
+        limits are drawn as a density map at the resolution of the figure.
+
         Parameters
         ----------
         model : Model
@@ -544,18 +863,47 @@ class View():
 
         """
                 
-        # Reset the current view data
-        self.fig.clear()
-        matplotlib.pyplot.ylim(0, model.environment.y_length)
-        matplotlib.pyplot.xlim(0, model.environment.x_length)
-        
-        # Render the environment
-        matplotlib.pyplot.imshow(model.environment.plane)
-        
-        # Render each agent
-        for agent in model.agents:
-            color = agent_color_active if agent.can_eat() else agent_color_inactive
-            matplotlib.pyplot.scatter(agent.x, agent.y, color=color)
+        # Render the environment and agents, reusing the artists of the
+        # last frame where possible
+        width, height = self.fig.get_size_inches() * self.fig.dpi
+        self.drawing = rendering.draw_model(
+            self.axes, model, (height, width), self.detail_agent_limit,
+            self.detail_cell_limit, self.drawing)
+
+
+    def performance_enabled(self):
+        """
+        Return whether performance is shown in the status bar.
+
+        Returns
+        -------
+        bool
+            True if performance is shown, otherwise False.
+
+        """
+
+        return self.performance_variable.get()
+
+
+    def show_performance(self, performance, active_agents):
+        """
+        Show frame timings in the status bar.
+
+        Parameters
+        ----------
+        performance : metrics.PerformanceStats
+            Rolling frame timings to show.
+        active_agents : int
+            Number of agents active in the latest iteration.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.performance_label.config(text="{} | Active agents: {}".format(
+            performance, active_agents))
 
 
     def show_error(self, message):
@@ -590,6 +938,9 @@ class View():
         
         log("Shutting down program.")
         
+        # Release model resources
+        self.controller.close()
+
         # Close all open figures
         matplotlib.pyplot.close('all')
         
@@ -637,6 +988,79 @@ class View():
         self.controller.start_animation()
 
 
+    def _on_show_metrics(self):
+        """
+        Open a window charting the model metrics as it runs
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Create the chart in a new window
+        window = tkinter.Toplevel(self.root)
+        window.wm_title("Model Metrics")
+        fig = matplotlib.figure.Figure(figsize=(5, 3), tight_layout=True)
+        canvas = matplotlib.backends.backend_tkagg.FigureCanvasTkAgg(
+            fig, master=window)
+        canvas.get_tk_widget().pack(fill=tkinter.BOTH, expand=1)
+        chart = metrics.MetricsChart(fig.add_subplot(), canvas.draw_idle)
+        self.controller.subscribe_metrics(chart)
+
+        # Stop charting when the window is closed
+        def on_close():
+            self.controller.unsubscribe_metrics(chart)
+            window.destroy()
+
+        window.protocol("WM_DELETE_WINDOW", on_close)
+
+
+    def _on_toggle_performance(self):
+        """
+        Show or hide the performance status bar
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.performance_enabled():
+            self.performance_label.config(text="Waiting for the next frame")
+            self.performance_label.pack(side=tkinter.BOTTOM, fill=tkinter.X,
+                                        before=self.canvas.get_tk_widget())
+        else:
+            self.performance_label.pack_forget()
+
+
+    def _on_show_memory(self):
+        """
+        Show the memory held by the model
+
+        Returns
+        -------
+        None.
+
+        """
+
+        tkinter.messagebox.showinfo("Model Memory",
+                                    self.controller.memory_report())
+
+
+    def _on_toggle_trace_memory(self):
+        """
+        Start or stop tracing memory allocations between iterations
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.controller.trace_memory(self.trace_memory_variable.get())
+
+
     def _on_load_parameters(self):
         """
         Trigger a load parameters event
@@ -647,7 +1071,7 @@ class View():
 
         """
         
-        self.controller.load_parameters()
+        self.controller.schedule_parameter_update()
 
 
     def _on_exit(self):
@@ -702,6 +1126,9 @@ class View():
         
         # Set the default value
         entry.insert(0, str(default_value))
+
+        # Update the model when Return is pressed
+        entry.bind("<Return>", lambda event: self._on_load_parameters())
         
         return entry
         
@@ -716,16 +1143,50 @@ class Model():
         
         initialize -        initializes the model properties using the 
                             configured model parameters
+
+        reset -             restores the model to its initial state, or
+                            initializes it if the parameters have changed
         
-        iterate -           runs a single iteration of the model
+        close -             releases any worker processes and shared memory
+
+        shared_descriptor - returns a descriptor for attaching to the shared
+                            model state from another process
+
+        memory_usage -      returns the bytes held by each part of the model
+        
+        iterate -           runs a single iteration of the model, recording
+                            its state with the exporter, if set
+
+        run -               runs the model, yielding the metrics record of
+                            each iteration
         
+        neighbours -        returns the neighbours of an agent
+
         set_parameters -    sets the model parameters  
+
+        parameters -        returns the current model parameters
+
+        configure -         sets the model parameters from a configuration
+
+        update_parameters - sets the model parameters, applying the changes
+                            to the current model state
+
+        manifest -          returns a manifest for reproducing the last run
     """
     
-    def __init__(self):
+    def __init__(self, initialize=True):
         """
         Instantiate a Model.
 
+        Parameters
+        ----------
+        initialize : bool, optional
+            Whether to initialize the model with the default parameters.
+            If False, `initialize` must be called before the model is used,
+            so parameters can be set first without loading the default
+            environment or fetching the default start positions. The
+            default is True.
+
         Returns
         -------
         None.
@@ -737,6 +1198,32 @@ class Model():
         # Initialize model properties
         self.agents = []
         self.environment = []
+        self.executor = None
+        self.shared_state = None
+        self.exporter = None
+        self.iteration_count = 0
+        self.active_agents = 0
+        self.metrics = metrics.MetricsStream()
+        self.seed = None
+        self.run_seed = None
+        self.behaviours = behaviours.Pipeline()
+        self.regrowth = None
+        self.memory_budget = default_memory_budget
+        self.memory_budget_action = default_memory_budget_action
+
+        # Allocation tracker updated after each iteration, if tracing
+        self.memory_tracker = None
+
+        # Copy of the initial model state, restored on reset
+        self._pristine = None
+
+        # Start positions fetched from the start positions URL
+        self.start_positions_url = None
+        self.start_positions = None
+
+        # Species of the agents and the number of each, if there are several
+        # types of agent. If None, all agents share the agent parameters.
+        self.species = None
 
         # Set default parameters
         self.set_parameters(default_num_of_agents,
@@ -747,10 +1234,17 @@ class Model():
                             default_environment_filepath,
                             default_environment_limit,
                             default_environment_limit,
-                            default_agent_bite_size)
+                            default_agent_bite_size,
+                            default_toroidal_neighbourhood,
+                            default_neighbour_strategy,
+                            default_execution_mode,
+                            default_num_of_workers,
+                            default_shared_memory,
+                            default_regrowth_rate)
 
         # Initialize model properties
-        self.initialize()
+        if initialize:
+            self.initialize()
 
 
     def __str__(self):
@@ -761,21 +1255,35 @@ Model
 Number of agents: {}
 Number of iterations: {}
 Neighbourhood size: {}
+Toroidal neighbourhood: {}
+Neighbour strategy: {}
+Execution mode: {}
+Number of workers: {}
+Shared memory: {}
 Agent Store size: {}
 Environment filepath: {}
 Environment limit: {},{}
 Start Positions URL: {}
 Agent Bite Size: {}
+Regrowth rate: {}
+Memory budget: {} ({})
 ===============================
                 '''.format(
                     self.num_of_agents,
                     self.num_of_iterations,
                     self.neighbourhood_size,
+                    self.toroidal_neighbourhood,
+                    self.neighbour_strategy,
+                    self.execution_mode,
+                    self.num_of_workers,
+                    self.shared_memory,
                     self.agent_store_size,
                     self.environment_filepath,
                     self.x_lim, self.y_lim,
                     self.start_positions_url,
-                    self.agent_bite_size
+                    self.agent_bite_size,
+                    self.regrowth_rate,
+                    self.memory_budget, self.memory_budget_action
                 )
 
 
@@ -789,12 +1297,259 @@ Agent Bite Size: {}
 
         """
         
+        # Release any previous executor, shared state and initial state
+        self.close()
+        self._pristine = None
+        self.iteration_count = 0
+        self.metrics.reset()
+
+        # Seed the random number generators, recording the seed used
+        if self.seed is not None:
+            self.run_seed = self.seed
+        else:
+            self.run_seed = random.randrange(2 ** 32)
+        random.seed(self.run_seed)
+
+        # Check the estimated memory use before loading anything, if
+        # budgeted. The environment size is only known here if it is limited.
+        if self.memory_budget is not None:
+            num_of_cells = self.x_lim * self.y_lim \
+                if self.x_lim is not None and self.y_lim is not None else 0
+            memory.check_budget(
+                memory.estimate(self._count_agents(), num_of_cells,
+                                self._uses_agent_arrays()),
+                self.memory_budget, self.memory_budget_action,
+                "The model environment and agents")
+
         # Create a new model environment
         self._create_environment(self.environment_filepath)
         
         # Create a new set of agents
         self._create_agents()
 
+        # Move the model state into shared memory, if required
+        if self.shared_memory or self.execution_mode == "parallel":
+            self.shared_state = sharedstate.SharedState(self.environment,
+                                                        self.agents)
+            self.environment = self.shared_state.environment
+
+        # Run iterations in worker processes for parallel execution
+        if self.execution_mode == "parallel":
+            self.executor = parallel.TiledExecutor(
+                self.environment, self.agents, self.neighbourhood_size,
+                self.toroidal_neighbourhood, self.num_of_workers,
+                shared_state=self.shared_state)
+
+        # Regrow the environment up to its initial values, if enabled
+        self.regrowth = None
+        if self.regrowth_rate > 0:
+            self.regrowth = regrowth.Regrowth(self.environment,
+                                              self.regrowth_rate)
+
+        # Keep a copy of the initial state, to reset to
+        self._take_snapshot()
+
+        # Check the measured memory use, including the copy, releasing the
+        # model state if it is refused
+        self._check_memory_usage()
+
+
+    def _check_memory_usage(self):
+        """
+        Check the measured memory use against the budget, if set, releasing
+        the model state if it is refused.
+        """
+        if self.memory_budget is None:
+            return
+        try:
+            memory.check_budget(self.memory_usage()["total"],
+                                self.memory_budget, self.memory_budget_action)
+        except memory.MemoryBudgetError:
+            self.close()
+            self._pristine = None
+            self.agents = []
+            self.environment = []
+            self.regrowth = None
+            raise
+
+
+    def reset(self):
+        """
+        Restore the model to the state of its last initialization.
+
+        The environment and agents are copied back in place from a snapshot
+        taken when the model was initialized, without reloading the
+        environment or creating new agents. If a seed is set, the random
+        number generators are returned to their state at the end of
+        initialization, so the last run is repeated. Otherwise they carry
+        on, so the run differs from the same start. If the parameters,
+        species, behaviours or environment file have changed since, or the
+        model state has been replaced, the model is initialized instead.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        pristine = self._pristine
+        if pristine is None or pristine["key"] != self._pristine_key() or \
+                pristine["environment"] is not self.environment or \
+                pristine["agents"] is not self.agents:
+            self.initialize()
+            return
+
+        # Complete any pending exporter writes from the last run
+        if self.exporter is not None:
+            self.exporter.flush()
+        self.iteration_count = 0
+        self.active_agents = 0
+        self.metrics.reset()
+
+        # Copy the initial environment back in place, keeping any views of
+        # it in shared memory
+        numpy.copyto(self.environment.plane, pristine["plane"])
+
+        # Copy the initial agent state back in place, restoring the order
+        # of agents shuffled by the per-agent path
+        ys, xs, stores = pristine["state"]
+        if isinstance(self.agents, agentframework.AgentArrays):
+            numpy.copyto(self.agents.y, ys)
+            numpy.copyto(self.agents.x, xs)
+            numpy.copyto(self.agents.store, stores)
+        else:
+            self.agents[:] = pristine["order"]
+            for agent, y, x, store in zip(self.agents, ys, xs, stores):
+                agent.y = y
+                agent.x = x
+                agent.store = store
+
+        # Regrow up to the initial values again
+        if self.regrowth is not None:
+            self.regrowth = regrowth.Regrowth(self.environment,
+                                              self.regrowth_rate)
+
+        # Repeat the last run only if it was seeded
+        if self.seed is not None:
+            random.setstate(pristine["random_state"])
+
+
+    def _pristine_key(self):
+        """
+        Return the values the initial model state depends on.
+        """
+        try:
+            status = os.stat(self.environment_filepath)
+            signature = (status.st_size, status.st_mtime_ns)
+        except (OSError, TypeError, ValueError):
+            signature = None
+        species = None if self.species is None else tuple(
+            (kind.name, kind.store_size, kind.bite_size, kind.move_range,
+             count) for kind, count in self.species)
+        return (self.parameters(), species, self._uses_agent_arrays(),
+                signature)
+
+
+    def _take_snapshot(self):
+        """
+        Copy the initial environment and agent state, for resetting.
+        """
+        if isinstance(self.agents, agentframework.AgentArrays):
+            order = None
+            state = (self.agents.y.copy(), self.agents.x.copy(),
+                     self.agents.store.copy())
+        else:
+            order = list(self.agents)
+            state = ([agent.y for agent in order],
+                     [agent.x for agent in order],
+                     [agent.store for agent in order])
+        self._pristine = {
+            "key": self._pristine_key(),
+            "environment": self.environment,
+            "agents": self.agents,
+            "plane": numpy.array(self.environment.plane),
+            "order": order,
+            "state": state,
+            "random_state": random.getstate(),
+        }
+
+
+    def close(self):
+        """
+        Release any worker processes and shared memory used by the model.
+
+        Any pending exporter writes are completed first, and the exporter
+        writer thread is stopped. It is started again by the next write.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.exporter is not None:
+            self.exporter.close()
+
+        if self.executor is not None:
+            self.executor.close()
+            self.executor = None
+
+        # Keep using the state from local memory once released
+        if self.shared_state is not None:
+            self.shared_state.close()
+            self.environment = self.shared_state.environment
+            self.shared_state = None
+
+
+    def shared_descriptor(self):
+        """
+        Return a descriptor for attaching to the shared model state.
+
+        The descriptor is small and cheap to send to another process, which
+        can pass it to `sharedstate.SharedState` to use the model environment
+        and agents without copying them. The shared state is released when
+        the model is closed or initialized again.
+
+        Returns
+        -------
+        dict
+            The shared state descriptor, or None if the model state is not
+            in shared memory.
+
+        """
+
+        if self.shared_state is None:
+            return None
+        return self.shared_state.descriptor()
+
+
+    def memory_usage(self):
+        """
+        Return the bytes held by each part of the model.
+
+        Returns
+        -------
+        dict
+            Sizes in bytes of the environment, including regrowth state, the
+            agents, the fetched start positions, recorders such as the
+            exporter and metrics subscribers, caches held by the behaviours
+            and the parallel executor and the initial state kept for
+            resetting, and allocation tracing, along with their total.
+
+        """
+
+        sizes = memory.measure({
+            "environment": (self.environment, self.regrowth),
+            "agents": (self.agents, self.shared_state),
+            "start_positions": self.start_positions,
+            "recorders": (self.exporter, self.metrics),
+            "caches": (self.behaviours, self.executor, self._pristine),
+        })
+        sizes["tracing"] = tracemalloc.get_tracemalloc_memory() \
+            if tracemalloc.is_tracing() else 0
+        sizes["total"] += sizes["tracing"]
+        return sizes
+
 
     def iterate(self):
         """
@@ -803,40 +1558,136 @@ Agent Bite Size: {}
         This will cause each agent to move one step, attempt to eat a portion
         of their environment and share with any neighbouring agents.
 
+        Agents behave according to the stages of `behaviours`, except in
+        parallel execution mode, where the built-in behaviours are always
+        used. Set `behaviours` before the model is initialized, as agents
+        are stored as arrays when every stage has a batched implementation.
+
+        If an exporter is set, it is given the model state after the
+        iteration, and the final state once the simulation is complete or
+        the configured number of iterations is reached. If any callbacks are
+        subscribed to `metrics`, they are sent a record of the iteration.
+
         Returns
         -------
         is_done : TYPE
             Returns True if the simulation is complete, otherwise returns False.
         """
-        
-        # Initialize the done flag
-        is_done = True
-        
-        # Simulate an interaction step for each agent in the model
-        agents = self.agents
-        
-        # Shuffle agents to remove artifacts from ordered lists
-        random.shuffle(agents)
 
-        # Iterate through each agent
-        for i in range(len(agents)):
-            agent = agents[i]
-            
-            # Only move agent if it has store capacity
-            if agent.can_eat():
-                is_done = False
-                agent.move()
-                if agent.resources_available():
-                    agent.eat()
-                agent.share_with_neighbours(self.neighbourhood_size)
+        # Only time the iteration if metrics are being recorded
+        measure = bool(self.metrics)
+        if measure:
+            start = time.perf_counter()
+
+        active, eaten, share_events = self._step()
+        self.active_agents = active
+        is_done = active == 0
+        self.iteration_count += 1
+
+        # Regrow the cells eaten from
+        regrown = 0
+        if self.regrowth is not None:
+            regrown = self.regrowth.apply(self.agents)
+
+        # Update the metrics totals and publish a record, if subscribed
+        self.metrics.update(eaten, share_events, regrown)
+        if measure:
+            self.metrics.publish(self.environment, self.agents,
+                                 self.iteration_count, active,
+                                 time.perf_counter() - start)
+
+        # Record the model state, if exporting
+        if self.exporter is not None:
+            self.exporter.update(
+                self, self.iteration_count,
+                is_done or self.iteration_count == self.num_of_iterations)
+
+        # Compare allocations with the last snapshot, if tracing
+        if self.memory_tracker is not None:
+            self.memory_tracker.update(self.iteration_count)
 
         return is_done
+
+
+    def run(self, num_of_iterations=None):
+        """
+        Run the model, yielding the metrics record of each iteration.
+
+        Parameters
+        ----------
+        num_of_iterations : int, optional
+            Maximum number of iterations to run. If None, the model number
+            of iterations is used. The default is None.
+
+        Yields
+        ------
+        dict
+            Metrics record of each iteration, until the simulation is
+            complete or the number of iterations is reached.
+
+        """
+
+        if num_of_iterations is None:
+            num_of_iterations = self.num_of_iterations
+
+        records = []
+        self.metrics.subscribe(records.append)
+        try:
+            for _ in range(num_of_iterations):
+                is_done = self.iterate()
+                yield records.pop()
+                if is_done:
+                    break
+        finally:
+            self.metrics.unsubscribe(records.append)
+
+
+    def _step(self):
+        """
+        Run the agent interactions for a single iteration, returning the
+        number of active agents, the resource eaten and the number of share
+        events.
+        """
+        
+        # Run the iteration in worker processes, if configured
+        if self.executor is not None:
+            self.executor.iterate()
+            counts = self.executor.counts
+            return counts["active"], counts["eaten"], counts["share_events"]
+
+        # Run each agent through the behaviour pipeline
+        return self.behaviours.run(self)
+
+
+    def neighbours(self, agent):
+        """
+        Return the agents within the model neighbourhood of the given agent.
+
+        Parameters
+        ----------
+        agent : agentframework.Agent
+            The agent whose neighbours should be found.
+
+        Returns
+        -------
+        list[agentframework.Agent]
+            Neighbouring agents, excluding the given agent.
+
+        """
+
+        return agent.neighbours(self.neighbourhood_size,
+                                self.toroidal_neighbourhood)
+
     
     def set_parameters(self, num_of_agents=None, num_of_iterations=None,
                        neighbourhood_size=None, agent_store_size=None,
                        start_positions_url=None, environment_filepath=None,
                        environment_x_lim=None, environment_y_lim=None,
-                       agent_bite_size=None):
+                       agent_bite_size=None, toroidal_neighbourhood=None,
+                       neighbour_strategy=None, execution_mode=None,
+                       num_of_workers=None, shared_memory=None,
+                       regrowth_rate=None, seed=None, memory_budget=None,
+                       memory_budget_action=None):
         """
         Set new model parameters
 
@@ -861,6 +1712,32 @@ Agent Bite Size: {}
             Y-axis limit for the environment.
         agent_bite_size : int
             Amount of resources consumed in a single agent bite.
+        toroidal_neighbourhood : bool
+            Whether neighbourhoods wrap around the environment edges.
+        neighbour_strategy : str
+            Neighbour search strategy: "auto", "brute", "grid" or "sweep".
+        execution_mode : str
+            Iteration mode: "sequential", or "parallel" to run iterations
+            across worker processes. Applied on initialization.
+        num_of_workers : int
+            Number of worker processes used in parallel execution mode.
+        shared_memory : bool
+            Whether to hold the environment and agents in shared memory.
+            This is always the case in parallel execution mode. Applied on
+            initialization.
+        regrowth_rate : float
+            Amount each environment cell regrows per iteration, up to its
+            initial value. If 0, the environment does not regrow. Applied
+            on initialization.
+        seed : int
+            Random seed used on initialization. If never set, a new seed is
+            chosen for each initialization.
+        memory_budget : int
+            Maximum bytes the model may hold on initialization. If never
+            set, memory use is not checked.
+        memory_budget_action : str
+            Action taken when the memory budget is exceeded: "warn", or
+            "refuse" to raise a `memory.MemoryBudgetError`.
             
         Returns
         -------
@@ -884,13 +1761,11 @@ Agent Bite Size: {}
         if agent_store_size is not None:
             self.agent_store_size = agent_store_size
 
-        # Update start positions, if provided
+        # Update start positions URL, fetching the positions when the
+        # agents are next created if it has changed
+        if start_positions_url != self.start_positions_url:
+            self.start_positions = None
         self.start_positions_url = start_positions_url
-        if self.start_positions_url is not None and len(self.start_positions_url) > 0:
-            log("Fetching start positions from URL: {}".format(self.start_positions_url))
-            self.start_positions = self._fetch_start_positions(self.start_positions_url)
-        else:
-            self.start_positions = ([], [])
 
         # Update environment filepath
         self.environment_filepath = environment_filepath
@@ -902,6 +1777,254 @@ Agent Bite Size: {}
         # Update agent store size, if provided
         if agent_bite_size is not None:
             self.agent_bite_size = agent_bite_size
+
+        # Update neighbourhood wrap-around mode, if provided
+        if toroidal_neighbourhood is not None:
+            self.toroidal_neighbourhood = toroidal_neighbourhood
+
+        # Update neighbour search strategy, if provided
+        if neighbour_strategy is not None:
+            if neighbour_strategy != "auto" and \
+                    neighbour_strategy not in neighbourhood.index_classes:
+                raise Exception("Unknown neighbour strategy: {}".format(
+                    neighbour_strategy))
+            self.neighbour_strategy = neighbour_strategy
+
+        # Update execution mode, if provided
+        if execution_mode is not None:
+            if execution_mode not in ("sequential", "parallel"):
+                raise Exception("Unknown execution mode: {}".format(
+                    execution_mode))
+            self.execution_mode = execution_mode
+
+        # Update number of workers, if provided
+        if num_of_workers is not None:
+            self.num_of_workers = num_of_workers
+
+        # Update shared memory use, if provided
+        if shared_memory is not None:
+            self.shared_memory = shared_memory
+
+        # Update regrowth rate, if provided
+        if regrowth_rate is not None:
+            self.regrowth_rate = regrowth_rate
+
+        # Update random seed, if provided
+        if seed is not None:
+            self.seed = seed
+
+        # Update memory budget and the action taken when exceeded, if
+        # provided
+        if memory_budget is not None:
+            self.memory_budget = memory_budget
+        if memory_budget_action is not None:
+            if memory_budget_action not in memory.budget_actions:
+                raise Exception("Unknown memory budget action: {}".format(
+                    memory_budget_action))
+            self.memory_budget_action = memory_budget_action
+
+
+    def parameters(self):
+        """
+        Return the current model parameters.
+
+        Returns
+        -------
+        dict
+            Parameter values, keyed by the `set_parameters` argument names.
+
+        """
+
+        return {
+            "num_of_agents": self.num_of_agents,
+            "num_of_iterations": self.num_of_iterations,
+            "neighbourhood_size": self.neighbourhood_size,
+            "agent_store_size": self.agent_store_size,
+            "start_positions_url": self.start_positions_url,
+            "environment_filepath": self.environment_filepath,
+            "environment_x_lim": self.x_lim,
+            "environment_y_lim": self.y_lim,
+            "agent_bite_size": self.agent_bite_size,
+            "toroidal_neighbourhood": self.toroidal_neighbourhood,
+            "neighbour_strategy": self.neighbour_strategy,
+            "execution_mode": self.execution_mode,
+            "num_of_workers": self.num_of_workers,
+            "shared_memory": self.shared_memory,
+            "regrowth_rate": self.regrowth_rate,
+            "seed": self.seed,
+            "memory_budget": self.memory_budget,
+            "memory_budget_action": self.memory_budget_action,
+        }
+
+
+    def configure(self, values, validated=False):
+        """
+        Set the model parameters from a configuration.
+
+        Parameters
+        ----------
+        values : dict
+            Parameter values, such as a run from `config.load_configs`.
+            Parameters that are not given keep their current values.
+        validated : bool, optional
+            Whether the values have already been validated against
+            `parameter_schema`. The default is False.
+
+        Raises
+        ------
+        config.ConfigError
+            If any value is not valid.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if validated:
+            values = dict(self.parameters(), **values)
+        else:
+            values = parameter_schema.validate(values, self.parameters())
+        self.set_parameters(**values)
+
+
+    def update_parameters(self, values, validated=False):
+        """
+        Set the model parameters, applying the changes to the current model
+        state in the cheapest way possible.
+
+        Changes to the number of iterations, neighbourhood, agent store and
+        bite sizes and a non-zero regrowth rate are applied in place. A
+        changed number of agents adds agents at their start positions or
+        removes agents, keeping the others as they are. Other changes, such
+        as to the environment file or limits, initialize the model again,
+        as do all but the number of iterations and memory budget while the
+        model state is shared. Changes applied in place are kept when the
+        model is reset.
+
+        If the number of iterations is reduced to those already run, the
+        final state is recorded by the exporter, if set. Memory use is
+        checked again when the budget changes or agents are added.
+
+        Parameters
+        ----------
+        values : dict
+            Parameter values, keyed by the `set_parameters` argument names.
+            Parameters that are not given keep their current values.
+        validated : bool, optional
+            Whether the values have already been validated against
+            `parameter_schema`. The default is False.
+
+        Raises
+        ------
+        config.ConfigError
+            If any value is not valid.
+        memory.MemoryBudgetError
+            If the memory use is over budget and the budget action is
+            "refuse". The model state is released.
+
+        Returns
+        -------
+        str
+            The action taken, one of `update_actions`.
+
+        """
+
+        current = self.parameters()
+        if validated:
+            values = dict(current, **values)
+        else:
+            values = parameter_schema.validate(values, current)
+        changed = {name for name, value in values.items()
+                   if value != current[name]}
+        action = self._update_action(changed, current, values)
+        self.set_parameters(**values)
+        if action == "initialize":
+            self.initialize()
+        if action in ("none", "initialize"):
+            return action
+        log("Updating model parameters in place: {}".format(
+            ", ".join(sorted(changed))))
+
+        # Update the agent parameters, unless set by species
+        if self.species is None:
+            agents = (self.agents,) if isinstance(
+                self.agents, agentframework.AgentArrays) else self.agents
+            for agent in agents:
+                agent.store_size = self.agent_store_size
+                agent.bite_size = self.agent_bite_size
+            if action == "resize":
+                self._resize_agents(self.num_of_agents)
+
+        # Update the regrowth rate of each cell
+        if self.regrowth is not None:
+            self.regrowth.rate = numpy.broadcast_to(
+                numpy.asarray(self.regrowth_rate, dtype=numpy.float64),
+                self.regrowth.capacity.shape)
+
+        # Keep the changes when reset
+        self._pristine["key"] = self._pristine_key()
+        self._pristine["agents"] = self.agents
+
+        # Record the final state if the run is now complete, if exporting
+        if "num_of_iterations" in changed and self.exporter is not None and \
+                0 < self.num_of_iterations <= self.iteration_count:
+            self.exporter.update(self, self.iteration_count, True)
+
+        # Check the memory use against a changed budget, or after adding
+        # agents
+        if action == "resize" or "memory_budget" in changed or \
+                "memory_budget_action" in changed:
+            self._check_memory_usage()
+        return action
+
+
+    def _update_action(self, changed, current, values):
+        """
+        Return the cheapest action that applies the changed parameters, one
+        of `update_actions`.
+        """
+        if not changed:
+            return "none"
+
+        # Initialize the model if it has no valid initial state
+        if self._pristine is None or \
+                self._pristine["key"] != self._pristine_key():
+            return "initialize"
+
+        # Only regrow in place if regrowth was and remains enabled
+        if "regrowth_rate" in changed and \
+                (current["regrowth_rate"] == 0 or values["regrowth_rate"] == 0):
+            return "initialize"
+
+        # Resize the agents, unless set by species or shared
+        shared = self.executor is not None or self.shared_state is not None
+        resize = "num_of_agents" in changed and self.species is None
+        if resize and shared:
+            return "initialize"
+        in_place = shared_in_place_parameters if shared \
+            else in_place_parameters
+        if not (changed - {"num_of_agents"}).issubset(in_place):
+            return "initialize"
+        return "resize" if resize else "update"
+
+
+    def manifest(self):
+        """
+        Return a manifest for reproducing the last model initialization.
+
+        Returns
+        -------
+        dict
+            Model parameters, the random seed used and a hash of the
+            environment file.
+
+        """
+
+        return config.create_manifest(
+            self.parameters(), self.run_seed,
+            [path for path in (self.environment_filepath,
+                               self.start_positions_url) if path])
         
 
     def _fetch_start_positions(self, url):
@@ -922,6 +2045,9 @@ Agent Bite Size: {}
 
         """
 
+        import requests
+        import bs4
+
         # Fetch text content from the given URL
         r = requests.get(url)
         content = r.text
@@ -931,7 +2057,9 @@ Agent Bite Size: {}
         soup = bs4.BeautifulSoup(content, 'html.parser')
         td_xs = soup.find_all(attrs={"class" : "x"})
         td_ys = soup.find_all(attrs={"class" : "y"})
-        return (td_xs, td_ys)
+
+        # Keep only the text, so the parsed document can be freed
+        return ([td.text for td in td_xs], [td.text for td in td_ys])
 
 
     def _create_agents(self):
@@ -944,19 +2072,32 @@ Agent Bite Size: {}
 
         """
         
-        # Reset the current agents list
-        self.agents = []
-                
+        # Fetch the start positions, if not already fetched
+        if self.start_positions is None:
+            if self.start_positions_url is not None and len(self.start_positions_url) > 0:
+                log("Fetching start positions from URL: {}".format(self.start_positions_url))
+                self.start_positions = self._fetch_start_positions(self.start_positions_url)
+            else:
+                self.start_positions = ([], [])
+
         # Get the initial start positions
         start_xs, start_ys = self.start_positions
+
+        # Store agents as arrays, if required
+        if self._uses_agent_arrays():
+            self.agents = self._create_agent_arrays(start_ys, start_xs)
+            return
+
+        # Reset the current agents list
+        self.agents = []
         
         # Create all agents
         for i in range(self.num_of_agents):
             
             # Get the initial start position
-            y = int(start_ys[i].text if len(start_ys) > i 
+            y = int(start_ys[i] if len(start_ys) > i 
                     else random.randint(0, self.environment.y_length - 1))
-            x = int(start_xs[i].text if len(start_xs) > i 
+            x = int(start_xs[i] if len(start_xs) > i 
                     else random.randint(0, self.environment.x_length - 1))
             
             # Add new Agent to the model
@@ -965,6 +2106,132 @@ Agent Bite Size: {}
                                      self.agent_store_size, self.agent_bite_size))
 
 
+    def _resize_agents(self, num_of_agents):
+        """
+        Add or remove agents to reach the given number, keeping the initial
+        state of the agents that remain and adding new agents to it.
+        """
+        start_xs, start_ys = self.start_positions
+        count = len(self.agents)
+        ys, xs, stores = self._pristine["state"]
+
+        if isinstance(self.agents, agentframework.AgentArrays):
+
+            # Place new agents at their fetched or random start positions
+            new = max(num_of_agents - count, 0)
+            rng = numpy.random.default_rng(random.getrandbits(32))
+            new_ys = rng.integers(0, self.environment.y_length, new)
+            new_xs = rng.integers(0, self.environment.x_length, new)
+            num_of_ys = max(min(len(start_ys), num_of_agents) - count, 0)
+            num_of_xs = max(min(len(start_xs), num_of_agents) - count, 0)
+            new_ys[:num_of_ys] = [int(y) for y in
+                                  start_ys[count:count + num_of_ys]]
+            new_xs[:num_of_xs] = [int(x) for x in
+                                  start_xs[count:count + num_of_xs]]
+
+            # Keep the first agents, then the new agents
+            agents = self.agents
+            self.agents = agentframework.AgentArrays(
+                self.environment,
+                numpy.concatenate((agents.y[:num_of_agents], new_ys)),
+                numpy.concatenate((agents.x[:num_of_agents], new_xs)),
+                numpy.concatenate((agents.store[:num_of_agents],
+                                   numpy.zeros(new))),
+                self.agent_store_size, self.agent_bite_size)
+            self._pristine["state"] = (
+                numpy.concatenate((ys[:num_of_agents], new_ys)),
+                numpy.concatenate((xs[:num_of_agents], new_xs)),
+                numpy.concatenate((stores[:num_of_agents], numpy.zeros(new))))
+            return
+
+        # Remove agents from the end of the current order, and from the
+        # initial state
+        order = self._pristine["order"]
+        if num_of_agents < count:
+            removed = set(map(id, self.agents[num_of_agents:]))
+            del self.agents[num_of_agents:]
+            kept = [i for i, agent in enumerate(order)
+                    if id(agent) not in removed]
+            order[:] = [order[i] for i in kept]
+            self._pristine["state"] = tuple([values[i] for i in kept]
+                                            for values in (ys, xs, stores))
+            return
+
+        # Add agents at their fetched or random start positions
+        for i in range(count, num_of_agents):
+            y = int(start_ys[i] if len(start_ys) > i
+                    else random.randint(0, self.environment.y_length - 1))
+            x = int(start_xs[i] if len(start_xs) > i
+                    else random.randint(0, self.environment.x_length - 1))
+            agent = agentframework.Agent(self.environment, self.agents, y, x,
+                                         self.agent_store_size,
+                                         self.agent_bite_size)
+            self.agents.append(agent)
+            order.append(agent)
+            ys.append(y)
+            xs.append(x)
+            stores.append(agent.store)
+
+
+    def _count_agents(self):
+        """
+        Return the number of agents created on initialization.
+        """
+        if self.species is not None:
+            return sum(count for _, count in self.species)
+        return self.num_of_agents
+
+
+    def _uses_agent_arrays(self):
+        """
+        Return True if agents are stored as arrays, for shared memory,
+        batched behaviours or several species.
+        """
+        return self.shared_memory or self.execution_mode == "parallel" or \
+            self.behaviours.batched or self.species is not None
+
+
+    def _create_agent_arrays(self, start_ys, start_xs):
+        """
+        Return a new set of agents stored as arrays.
+
+        Parameters
+        ----------
+        start_ys : list
+            Fetched y-axis start positions.
+        start_xs : list
+            Fetched x-axis start positions.
+
+        Returns
+        -------
+        agentframework.AgentArrays
+            The new agents, in a block for each species.
+
+        """
+
+        # Use a single species from the agent parameters, unless set
+        species = self.species
+        if species is None:
+            species = [(agentframework.Species(
+                store_size=self.agent_store_size,
+                bite_size=self.agent_bite_size), self.num_of_agents)]
+        num_of_agents = sum(count for _, count in species)
+
+        # Generate random start positions for all agents
+        rng = numpy.random.default_rng(random.getrandbits(32))
+        ys = rng.integers(0, self.environment.y_length, num_of_agents)
+        xs = rng.integers(0, self.environment.x_length, num_of_agents)
+
+        # Use fetched start positions where available
+        num_of_ys = min(len(start_ys), num_of_agents)
+        num_of_xs = min(len(start_xs), num_of_agents)
+        ys[:num_of_ys] = [int(y) for y in start_ys[:num_of_ys]]
+        xs[:num_of_xs] = [int(x) for x in start_xs[:num_of_xs]]
+
+        return agentframework.AgentArrays(self.environment, ys, xs,
+                                          species=species)
+
+
     def _create_environment(self, filepath):
         """
         Set the model environment using data from the provided file path.
@@ -972,7 +2239,13 @@ Agent Bite Size: {}
         Parameters
         ----------
         filename : str
-            File path to the environment data in CSV format.
+            File path to the environment data, in any format supported by
+            the `loaders` module.
+
+        Raises
+        ------
+        loaders.EnvironmentLoadError
+            If the environment cannot be read from the file.
 
         Returns
         -------
@@ -980,29 +2253,12 @@ Agent Bite Size: {}
 
         """
         
-        # Initialize the environment plane
-        environment_plane = []
-
-        
-        # Open the given file
-        try:
-            with open(filepath, newline='') as f:
-                
-                # Create a CSV reader
-                reader = csv.reader(f, quoting=csv.QUOTE_NONNUMERIC)
-                
-                # Read in each row and column to obtain the 2-D environment data
-                for row in reader:
-                    row_list = []
-                    for value in row:
-                        row_list.append(value)
-                    environment_plane.append(row_list)
-        except:
-            # Display error message on enviroment read failure
-            raise Exception("Unable to read environment from file: {}".format(filepath))
-            
-            # Abort creation of new environment
-            return
+        # Load the environment plane, reading only within the limits
+        environment_plane, report = loaders.load_environment(
+            filepath, x_lim=self.x_lim, y_lim=self.y_lim)
+        self.environment_load_report = report
+        log("Loaded {} environment: {} bytes in {:.3f}s".format(
+            report["format"], report["bytes_read"], report["seconds"]))
 
         # Create new environment with the given plane
         log("Creating new environment.")
@@ -1011,6 +2267,324 @@ Agent Bite Size: {}
 
 
 
+class ModelTestCase(unittest.TestCase):
+    """
+    The ModelTestCase class provides a collection of unit tests for the
+    model module.
+    """
+
+    def test_import_time(self):
+        """
+        Test that importing the module is within budget and does not load
+        the GUI, plotting, HTTP or HTML parsing modules.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Import the module in a new process, reporting import times
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import model"],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            capture_output=True, text=True, check=True)
+
+        # Each line gives self and cumulative microseconds and a module name
+        imports = {}
+        for line in result.stderr.splitlines()[1:]:
+            _, cumulative, name = line.split("|")
+            imports[name.strip()] = int(cumulative) / 1e6
+
+        for name in lazy_modules:
+            self.assertNotIn(name, imports)
+        self.assertLess(imports["model"], import_time_budget)
+
+
+    def test_uninitialized(self):
+        """
+        Test that a model can be configured before it is initialized.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        model = Model(initialize=False)
+        self.assertEqual(model.agents, [])
+
+        model.set_parameters(3, start_positions_url="",
+                             environment_filepath=default_environment_filepath,
+                             environment_x_lim=default_environment_limit,
+                             environment_y_lim=default_environment_limit)
+        model.initialize()
+        self.assertEqual(len(model.agents), 3)
+        self.assertNotIn("requests", sys.modules)
+
+
+    def test_configure(self):
+        """
+        Test that a run can be reproduced from its manifest.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        model = Model(initialize=False)
+        model.configure({"num_of_agents": 5, "start_positions_url": ""})
+        model.initialize()
+        for _ in range(3):
+            model.iterate()
+        manifest = model.manifest()
+        positions = [(agent.y, agent.x) for agent in model.agents]
+        self.assertIn(default_environment_filepath, manifest["inputs"])
+
+        # Verify the same parameters and seed give the same run
+        other = Model(initialize=False)
+        other.configure(dict(manifest["parameters"], seed=manifest["seed"]))
+        other.initialize()
+        for _ in range(3):
+            other.iterate()
+        self.assertEqual([(agent.y, agent.x) for agent in other.agents],
+                         positions)
+
+        with self.assertRaises(config.ConfigError):
+            model.configure({"execution_mode": "distributed"})
+
+
+    def test_reset(self):
+        """
+        Test that a reset restores the initial state, repeating the last
+        run only if seeded, and initializes the model again once the
+        parameters or species change.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for batched, seed in ((False, 3), (True, 3), (False, None),
+                              (True, None)):
+            model = Model(initialize=False)
+            model.configure({"num_of_agents": 20, "start_positions_url": "",
+                             "regrowth_rate": 1, "seed": seed})
+            if batched:
+                model.behaviours = behaviours.Pipeline(
+                    interaction=behaviours.NoInteraction())
+            model.initialize()
+            plane = numpy.array(model.environment.plane)
+            positions = [(agent.y, agent.x) for agent in model.agents]
+            environment = model.environment
+            runs = []
+            for _ in range(2):
+                for _ in range(5):
+                    model.iterate()
+                runs.append([(agent.y, agent.x, agent.store)
+                             for agent in model.agents])
+                model.reset()
+                self.assertEqual(model.iteration_count, 0)
+                self.assertTrue(numpy.array_equal(model.environment.plane,
+                                                  plane))
+                self.assertEqual(sorted((agent.y, agent.x)
+                                        for agent in model.agents),
+                                 sorted(positions))
+            self.assertIs(model.environment, environment)
+            if seed is None:
+                self.assertNotEqual(runs[0], runs[1])
+            else:
+                self.assertEqual(runs[0], runs[1])
+
+            # Verify a parameter change reloads the environment
+            model.configure({"num_of_agents": 10})
+            model.reset()
+            self.assertIsNot(model.environment, environment)
+            self.assertEqual(len(model.agents), 10)
+
+        # Verify a species changed in place initializes the model again
+        grazers = agentframework.Species("grazers", 0, 10)
+        model.species = [(grazers, 10)]
+        model.initialize()
+        environment = model.environment
+        model.reset()
+        self.assertIs(model.environment, environment)
+        grazers.bite_size = 20
+        model.reset()
+        self.assertIsNot(model.environment, environment)
+
+
+    def test_update_parameters(self):
+        """
+        Test that parameter changes are applied in place where possible.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        for batched in (False, True):
+            model = Model(initialize=False)
+            model.configure({"num_of_agents": 20, "start_positions_url": "",
+                             "regrowth_rate": 1})
+            if batched:
+                model.behaviours = behaviours.Pipeline(
+                    interaction=behaviours.NoInteraction())
+            model.initialize()
+            environment = model.environment
+            for _ in range(3):
+                model.iterate()
+
+            self.assertEqual(model.update_parameters({"seed": None}), "none")
+            self.assertEqual(model.update_parameters(
+                {"num_of_iterations": 10, "agent_bite_size": 5,
+                 "regrowth_rate": 2}), "update")
+            self.assertEqual(model.iteration_count, 3)
+            self.assertEqual(model.regrowth.rate[0, 0], 2)
+            self.assertEqual(model.agents[0].bite_size, 5)
+
+            # Verify agents are added and removed, keeping the others
+            positions = [(agent.y, agent.x) for agent in model.agents][:15]
+            self.assertEqual(model.update_parameters({"num_of_agents": 25}),
+                             "resize")
+            self.assertEqual(len(model.agents), 25)
+            self.assertEqual(model.update_parameters({"num_of_agents": 15}),
+                             "resize")
+            self.assertEqual([(agent.y, agent.x) for agent in model.agents],
+                             positions)
+            model.reset()
+            self.assertEqual(len(model.agents), 15)
+            self.assertIs(model.environment, environment)
+
+            # Verify environment changes initialize the model again
+            self.assertEqual(model.update_parameters(
+                {"environment_x_lim": 50}), "initialize")
+            self.assertEqual(model.environment.x_length, 50)
+            self.assertEqual(model.iteration_count, 0)
+
+        # Verify reducing the iterations to those run records the final
+        # state
+        with tempfile.TemporaryDirectory() as directory:
+            model.exporter = export.Exporter(directory, background=False)
+            for _ in range(3):
+                model.iterate()
+            self.assertEqual(os.listdir(directory), [])
+            model.update_parameters({"num_of_iterations": 2})
+            self.assertIn("environment_000003.csv", os.listdir(directory))
+            model.exporter = None
+
+        # Verify a changed memory budget is enforced
+        with self.assertWarns(memory.MemoryBudgetWarning):
+            self.assertEqual(model.update_parameters(
+                {"memory_budget": 1000}), "update")
+        with self.assertRaises(memory.MemoryBudgetError):
+            model.update_parameters({"memory_budget_action": "refuse"})
+        self.assertEqual(model.agents, [])
+
+
+    def test_species(self):
+        """
+        Test that agents of each species feed with their own bite size.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        model = Model(initialize=False)
+        model.configure({"start_positions_url": "", "seed": 2})
+        model.species = [(agentframework.Species("grazers", 0, 10), 20),
+                         (agentframework.Species("browsers", 0, 30, 3), 10)]
+        model.behaviours = behaviours.Pipeline(
+            interaction=behaviours.NoInteraction())
+        model.initialize()
+        for _ in range(5):
+            model.iterate()
+
+        grazers, browsers = model.agents.blocks()
+        self.assertEqual((len(grazers), len(browsers)), (20, 10))
+        self.assertEqual(grazers.store.sum() % 10, 0)
+        self.assertEqual(browsers.store.sum() % 30, 0)
+        self.assertGreater(browsers.store.sum(), 0)
+
+
+    def test_memory_budget(self):
+        """
+        Test that memory use is reported and checked against the budget.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        model = Model(initialize=False)
+        model.configure({"num_of_agents": 20, "start_positions_url": ""})
+        model.initialize()
+        usage = model.memory_usage()
+        self.assertGreater(usage["environment"], 100 * 100 * 8)
+        self.assertGreater(usage["agents"], 0)
+        self.assertEqual(usage["total"], sum(
+            size for name, size in usage.items() if name != "total"))
+
+        # Verify an estimate over budget is refused before loading anything
+        model.configure({"memory_budget": 1000,
+                         "memory_budget_action": "refuse"})
+        report = model.environment_load_report
+        with self.assertRaises(memory.MemoryBudgetError):
+            model.initialize()
+        self.assertIs(model.environment_load_report, report)
+
+        # Verify a measured size over budget warns, keeping the model
+        model.configure({"memory_budget": 100 * 100 * 8 + 20 * 256,
+                         "memory_budget_action": "warn"})
+        with self.assertWarns(memory.MemoryBudgetWarning):
+            model.initialize()
+        self.assertEqual(len(model.agents), 20)
+
+        # Verify the copy kept for resetting counts towards the budget
+        total = model.memory_usage()["total"]
+        pristine, model._pristine = model._pristine, None
+        without_copy = model.memory_usage()["total"]
+        model._pristine = pristine
+        model.configure({"memory_budget": (total + without_copy) // 2,
+                         "memory_budget_action": "refuse"})
+        with self.assertRaises(memory.MemoryBudgetError):
+            model.initialize()
+        self.assertIsNone(model._pristine)
+
+        with self.assertRaises(config.ConfigError):
+            model.configure({"memory_budget_action": "ignore"})
+
+
+    def test_memory_tracker(self):
+        """
+        Test that allocations are compared between iterations.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        model = Model(initialize=False)
+        model.configure({"num_of_agents": 5, "start_positions_url": ""})
+        model.initialize()
+        model.memory_tracker = memory.SnapshotTracker()
+        try:
+            for _ in range(3):
+                model.iterate()
+            self.assertIsNotNone(model.memory_tracker.snapshot)
+            self.assertGreater(model.memory_usage()["tracing"], 0)
+        finally:
+            model.memory_tracker.stop()
+
+
+
 def main():
     log("Starting the Agent-Based Model program...")
     
@@ -0,0 +1,1066 @@
+"""
+Neighbourhood Indexes
+=====================
+
+Spatial indexes used to find the neighbours of an agent without checking
+every other agent in the model.
+
+Three strategies are provided:
+
+    brute - checks every agent, best for small numbers of agents
+
+    grid - buckets agents into square cells the size of the neighbourhood,
+           best when the neighbourhood is small relative to the environment
+
+    sweep - keeps agents sorted on the x-axis and only checks the slice
+            within range, best when the neighbourhood covers a large part
+            of the environment
+
+Once the neighbourhood covers most of the environment, every agent is a
+candidate and brute force is fastest again.
+
+Each index is built once per iteration and is updated incrementally as
+agents move. Neighbours are always returned in the order of the agents list
+that the index was built from, so sharing produces the same result
+regardless of the strategy used.
+
+For agents stored as arrays, `neighbour_graph` finds the neighbours of all
+agents at once, as a sparse adjacency in compressed sparse row (CSR) form.
+A NeighbourGraph keeps that adjacency across iterations, only rebuilding it
+once agents have moved far enough to have new neighbours.
+"""
+
+import bisect
+import random
+import unittest
+import numpy
+import agentframework
+
+# Strategy selection thresholds (see benchmark.py)
+brute_force_agent_limit = 32
+grid_coverage_limit = 0.1
+sweep_coverage_limit = 0.8
+
+# Default distance added to the neighbourhood size for the candidate
+# neighbours of a NeighbourGraph, and the fraction of agents above which
+# all candidates are rebuilt at once (see benchmark.py). Agents on a random
+# walk move about a cell each iteration, so a skin only adds candidates to
+# check without saving updates.
+default_skin = 0
+graph_rebuild_fraction = 0.25
+
+
+def select_strategy(num_of_agents, neighbourhood_size, x_length, y_length):
+    """
+    Return the name of the most suitable neighbourhood index strategy.
+
+    Parameters
+    ----------
+    num_of_agents : int
+        Number of agents in the model.
+    neighbourhood_size : int
+        Size of the neighbourhood.
+    x_length : int
+        Environment x-axis length.
+    y_length : int
+        Environment y-axis length.
+
+    Returns
+    -------
+    str
+        One of "brute", "grid" or "sweep".
+
+    """
+
+    # Indexing costs more than it saves for small numbers of agents
+    if num_of_agents <= brute_force_agent_limit:
+        return "brute"
+
+    # Compare the neighbourhood bounding box with the environment area
+    area = max(x_length * y_length, 1)
+    coverage = (2 * neighbourhood_size + 1) ** 2 / area
+    if coverage <= grid_coverage_limit:
+        return "grid"
+    if coverage <= sweep_coverage_limit:
+        return "sweep"
+    return "brute"
+
+
+def create_index(strategy, agents, environment, neighbourhood_size,
+                 toroidal=False):
+    """
+    Return a new neighbourhood index for the given strategy.
+
+    Parameters
+    ----------
+    strategy : str
+        One of "auto", "brute", "grid" or "sweep".
+    agents : list[agentframework.Agent]
+        Agents to index.
+    environment : agentframework.Environment
+        Environment the agents are in.
+    neighbourhood_size : int
+        Size of the neighbourhood.
+    toroidal : bool, optional
+        Measure distances across the environment edges. The default is False.
+
+    Returns
+    -------
+    NeighbourIndex
+        A neighbourhood index populated with the given agents.
+
+    """
+
+    # Resolve the automatic strategy
+    if strategy == "auto":
+        strategy = select_strategy(len(agents), neighbourhood_size,
+                                   environment.x_length, environment.y_length)
+
+    if strategy not in index_classes:
+        raise ValueError("Unknown neighbourhood strategy: {}".format(strategy))
+    return index_classes[strategy](agents, environment, neighbourhood_size,
+                                   toroidal)
+
+
+def wrapped_ranges(low, high, length, toroidal):
+    """
+    Return the position ranges covering `low` to `high` on an axis.
+
+    On a toroidal axis the interval is split where it wraps around, so at
+    most two ranges are returned.
+
+    Parameters
+    ----------
+    low : int
+        Lowest position in the interval.
+    high : int
+        Highest position in the interval.
+    length : int
+        Length of the axis.
+    toroidal : bool
+        Whether the axis wraps around.
+
+    Returns
+    -------
+    list[tuple[int, int]]
+        Inclusive (low, high) position ranges.
+
+    """
+
+    if not toroidal:
+        return [(low, high)]
+
+    # The interval covers the whole axis
+    if high - low + 1 >= length:
+        return [(0, length - 1)]
+
+    # Split the interval where it wraps around
+    low %= length
+    high %= length
+    if low <= high:
+        return [(low, high)]
+    return [(low, length - 1), (0, high)]
+
+
+def _cell_offsets(num_of_cells, toroidal):
+    """
+    Return the distinct offsets to the cells next to a cell on an axis.
+    """
+    if toroidal and num_of_cells < 3:
+        return list(range(num_of_cells))
+    return [-1, 0, 1]
+
+
+def neighbour_pairs(ys, xs, neighbourhood_size, y_length, x_length,
+                    toroidal=False, queries=None):
+    """
+    Return the pairs of agents within the neighbourhood of each other.
+
+    Agents are bucketed into cells at least a neighbourhood wide, and only
+    agents in the surrounding cells are compared, all in array operations.
+
+    Parameters
+    ----------
+    ys : numpy.ndarray
+        Agent y-axis positions.
+    xs : numpy.ndarray
+        Agent x-axis positions.
+    neighbourhood_size : int
+        Size of the neighbourhood.
+    y_length : int
+        Environment y-axis length.
+    x_length : int
+        Environment x-axis length.
+    toroidal : bool, optional
+        Measure distances across the environment edges. The default is
+        False.
+    queries : numpy.ndarray, optional
+        Indices of the agents to find the neighbours of. If None, the
+        neighbours of every agent are found. The default is None.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        The index of the queried agent and of its neighbour in each pair,
+        in no particular order. Agents are not paired with themselves.
+
+    """
+
+    ys = numpy.asarray(ys, dtype=numpy.int64)
+    xs = numpy.asarray(xs, dtype=numpy.int64)
+    if queries is None:
+        queries = numpy.arange(len(ys))
+
+    # Split each axis evenly into cells at least a neighbourhood wide
+    size = max(int(neighbourhood_size), 1)
+    rows = max(y_length // size, 1)
+    columns = max(x_length // size, 1)
+    if toroidal:
+        cell_ys = ys % y_length * rows // y_length
+        cell_xs = xs % x_length * columns // x_length
+    else:
+        cell_ys = numpy.clip(ys * rows // y_length, 0, rows - 1)
+        cell_xs = numpy.clip(xs * columns // x_length, 0, columns - 1)
+
+    # Sort the agents by cell
+    cells = cell_ys * columns + cell_xs
+    by_cell = numpy.argsort(cells, kind="stable")
+    counts = numpy.bincount(cells, minlength=rows * columns)
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)))
+
+    # Pair each queried agent with every agent in the surrounding cells
+    query_ys = cell_ys[queries]
+    query_xs = cell_xs[queries]
+    pair_rows = []
+    pair_columns = []
+    for dy in _cell_offsets(rows, toroidal):
+        for dx in _cell_offsets(columns, toroidal):
+            near_ys = query_ys + dy
+            near_xs = query_xs + dx
+            if toroidal:
+                agents = queries
+                near = near_ys % rows * columns + near_xs % columns
+            else:
+                inside = (near_ys >= 0) & (near_ys < rows) & \
+                    (near_xs >= 0) & (near_xs < columns)
+                agents = queries[inside]
+                near = near_ys[inside] * columns + near_xs[inside]
+            num_of_pairs = counts[near]
+            total = num_of_pairs.sum()
+            firsts = numpy.repeat(starts[near] - numpy.cumsum(num_of_pairs)
+                                  + num_of_pairs, num_of_pairs)
+            pair_rows.append(numpy.repeat(agents, num_of_pairs))
+            pair_columns.append(by_cell[firsts + numpy.arange(total)])
+    pair_rows = numpy.concatenate(pair_rows)
+    pair_columns = numpy.concatenate(pair_columns)
+
+    # Keep the pairs of distinct agents within the neighbourhood
+    dy = numpy.abs(ys[pair_rows] - ys[pair_columns])
+    dx = numpy.abs(xs[pair_rows] - xs[pair_columns])
+    if toroidal:
+        dy %= y_length
+        dy = numpy.minimum(dy, y_length - dy)
+        dx %= x_length
+        dx = numpy.minimum(dx, x_length - dx)
+    keep = (pair_rows != pair_columns) & \
+        (dy * dy + dx * dx <= neighbourhood_size * neighbourhood_size)
+    return pair_rows[keep], pair_columns[keep]
+
+
+def neighbour_graph(ys, xs, neighbourhood_size, y_length, x_length,
+                    toroidal=False):
+    """
+    Return the neighbours of every agent as a sparse adjacency.
+
+    Parameters
+    ----------
+    ys : numpy.ndarray
+        Agent y-axis positions.
+    xs : numpy.ndarray
+        Agent x-axis positions.
+    neighbourhood_size : int
+        Size of the neighbourhood.
+    y_length : int
+        Environment y-axis length.
+    x_length : int
+        Environment x-axis length.
+    toroidal : bool, optional
+        Measure distances across the environment edges. The default is
+        False.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray]
+        CSR row pointers and column indices. The neighbours of agent `i`
+        are `indices[indptr[i]:indptr[i + 1]]`, in agent order, excluding
+        the agent itself. The adjacency is symmetric.
+
+    """
+
+    num_of_agents = len(ys)
+    rows, columns = neighbour_pairs(ys, xs, neighbourhood_size, y_length,
+                                    x_length, toroidal)
+    return _csr(rows * num_of_agents + columns, num_of_agents)
+
+
+def _csr(keys, num_of_agents):
+    """
+    Return the CSR adjacency of pairs given as keys of the form
+    `row * num_of_agents + column`, in agent order.
+    """
+    keys = numpy.sort(keys)
+    indptr = numpy.searchsorted(keys, numpy.arange(num_of_agents + 1)
+                                * num_of_agents)
+    return indptr, keys % num_of_agents
+
+
+class NeighbourIndex():
+    """
+    The NeighbourIndex class is the base for all neighbourhood indexes. It
+    checks every agent and is used as the brute-force strategy.
+
+    Public Methods:
+
+        neighbours - returns the neighbours of an agent
+
+        move - updates the index after an agent has moved
+    """
+
+    def __init__(self, agents, environment, neighbourhood_size,
+                 toroidal=False):
+        """
+        Instantiate a NeighbourIndex.
+
+        Parameters
+        ----------
+        agents : list[agentframework.Agent]
+            Agents to index.
+        environment : agentframework.Environment
+            Environment the agents are in.
+        neighbourhood_size : int
+            Size of the neighbourhood.
+        toroidal : bool, optional
+            Measure distances across the environment edges. The default
+            is False.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.agents = agents
+        self.environment = environment
+        self.neighbourhood_size = neighbourhood_size
+        self.toroidal = toroidal
+
+        # Track the position of each agent in the agents list
+        self._order = {id(agent): i for i, agent in enumerate(agents)}
+
+
+    def neighbours(self, agent):
+        """
+        Return the agents within the neighbourhood of the given agent.
+
+        Parameters
+        ----------
+        agent : agentframework.Agent
+            The agent whose neighbours should be found.
+
+        Returns
+        -------
+        list[agentframework.Agent]
+            Neighbouring agents in agents list order, excluding the given
+            agent.
+
+        """
+
+        return [other for other in self.agents
+                if other is not agent
+                and agent.is_neighbour(other, self.neighbourhood_size,
+                                       self.toroidal)]
+
+
+    def move(self, agent, y, x):
+        """
+        Update the index after the given agent has moved.
+
+        Parameters
+        ----------
+        agent : agentframework.Agent
+            The agent that has moved.
+        y : int
+            Previous y-axis position.
+        x : int
+            Previous x-axis position.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        pass
+
+
+    def _filter(self, agent, candidates):
+        """
+        Return the candidates within the neighbourhood, in agents list order.
+
+        Parameters
+        ----------
+        agent : agentframework.Agent
+            The agent whose neighbours should be found.
+        candidates : list[int]
+            Agents list positions of agents that may be within the
+            neighbourhood.
+
+        Returns
+        -------
+        list[agentframework.Agent]
+            Neighbouring agents, excluding the given agent.
+
+        """
+
+        # Sorting positions restores the agents list order
+        candidates.sort()
+
+        agents = self.agents
+        return [agents[i] for i in candidates
+                if agents[i] is not agent
+                and agent.is_neighbour(agents[i], self.neighbourhood_size,
+                                       self.toroidal)]
+
+
+
+class GridIndex(NeighbourIndex):
+    """
+    The GridIndex class buckets agents into square cells with sides equal to
+    the neighbourhood size, so only the surrounding cells are checked.
+    """
+
+    def __init__(self, agents, environment, neighbourhood_size,
+                 toroidal=False):
+        """
+        Instantiate a GridIndex.
+
+        Parameters
+        ----------
+        agents : list[agentframework.Agent]
+            Agents to index.
+        environment : agentframework.Environment
+            Environment the agents are in.
+        neighbourhood_size : int
+            Size of the neighbourhood.
+        toroidal : bool, optional
+            Measure distances across the environment edges. The default
+            is False.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        super().__init__(agents, environment, neighbourhood_size, toroidal)
+
+        # Size cells so the neighbourhood spans at most 3x3 cells
+        self.cell_size = max(int(neighbourhood_size), 1)
+
+        # Bucket the list position of each agent into its cell
+        self._cells = {}
+        for i, agent in enumerate(agents):
+            self._cells.setdefault(self._cell(agent.y, agent.x),
+                                   []).append(i)
+
+
+    def neighbours(self, agent):
+        """
+        Return the agents within the neighbourhood of the given agent.
+
+        Parameters
+        ----------
+        agent : agentframework.Agent
+            The agent whose neighbours should be found.
+
+        Returns
+        -------
+        list[agentframework.Agent]
+            Neighbouring agents in agents list order, excluding the given
+            agent.
+
+        """
+
+        size = self.cell_size
+        radius = self.neighbourhood_size
+        y, x = self._position(agent.y, agent.x)
+
+        # Find the cells covering the neighbourhood bounding box, where a
+        # cell may be covered by both parts of a wrapped range
+        rows = dict.fromkeys(row for low, high in wrapped_ranges(
+                                 y - radius, y + radius,
+                                 self.environment.y_length, self.toroidal)
+                             for row in range(low // size, high // size + 1))
+        columns = dict.fromkeys(column for low, high in wrapped_ranges(
+                                    x - radius, x + radius,
+                                    self.environment.x_length, self.toroidal)
+                                for column in range(low // size,
+                                                    high // size + 1))
+
+        # Gather candidates from each occupied cell
+        candidates = []
+        for row in rows:
+            for column in columns:
+                cell = self._cells.get((row, column))
+                if cell:
+                    candidates.extend(cell)
+
+        return self._filter(agent, candidates)
+
+
+    def move(self, agent, y, x):
+        """
+        Update the index after the given agent has moved.
+
+        Parameters
+        ----------
+        agent : agentframework.Agent
+            The agent that has moved.
+        y : int
+            Previous y-axis position.
+        x : int
+            Previous x-axis position.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Only update when the agent has changed cell
+        old_cell = self._cell(y, x)
+        new_cell = self._cell(agent.y, agent.x)
+        if old_cell != new_cell:
+            order = self._order[id(agent)]
+            self._cells[old_cell].remove(order)
+            self._cells.setdefault(new_cell, []).append(order)
+
+
+    def _position(self, y, x):
+        """
+        Return the position used for indexing, wrapped when toroidal.
+        """
+        if self.toroidal:
+            return y % self.environment.y_length, x % self.environment.x_length
+        return y, x
+
+
+    def _cell(self, y, x):
+        """
+        Return the cell key for the given position.
+        """
+        y, x = self._position(y, x)
+        return y // self.cell_size, x // self.cell_size
+
+
+
+class SweepIndex(NeighbourIndex):
+    """
+    The SweepIndex class keeps agents sorted along the x-axis, so only the
+    agents within the neighbourhood x-range are checked.
+    """
+
+    def __init__(self, agents, environment, neighbourhood_size,
+                 toroidal=False):
+        """
+        Instantiate a SweepIndex.
+
+        Parameters
+        ----------
+        agents : list[agentframework.Agent]
+            Agents to index.
+        environment : agentframework.Environment
+            Environment the agents are in.
+        neighbourhood_size : int
+            Size of the neighbourhood.
+        toroidal : bool, optional
+            Measure distances across the environment edges. The default
+            is False.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        super().__init__(agents, environment, neighbourhood_size, toroidal)
+
+        # Sort agents by x-axis position, using list order to break ties
+        self._keys = sorted((self._x(agent.x), i)
+                            for i, agent in enumerate(agents))
+
+        # Keep y-axis positions by list order for cheap rejection
+        self._ys = [agent.y for agent in agents]
+
+
+    def neighbours(self, agent):
+        """
+        Return the agents within the neighbourhood of the given agent.
+
+        Parameters
+        ----------
+        agent : agentframework.Agent
+            The agent whose neighbours should be found.
+
+        Returns
+        -------
+        list[agentframework.Agent]
+            Neighbouring agents in agents list order, excluding the given
+            agent.
+
+        """
+
+        keys = self._keys
+        ys = self._ys
+        radius = self.neighbourhood_size
+        x = self._x(agent.x)
+        y = agent.y
+        y_length = self.environment.y_length
+
+        # Gather candidates from each slice of the x-axis in range, rejecting
+        # those outside the y-axis range before any distance is measured
+        candidates = []
+        for low, high in wrapped_ranges(x - radius, x + radius,
+                                        self.environment.x_length,
+                                        self.toroidal):
+            start = bisect.bisect_left(keys, (low, -1))
+            end = bisect.bisect_right(keys, (high, len(keys)))
+            if self.toroidal:
+                candidates.extend(
+                    i for _, i in keys[start:end]
+                    if agentframework.wrapped_offset(abs(ys[i] - y),
+                                                     y_length) <= radius)
+            else:
+                candidates.extend(i for _, i in keys[start:end]
+                                  if abs(ys[i] - y) <= radius)
+
+        return self._filter(agent, candidates)
+
+
+    def move(self, agent, y, x):
+        """
+        Update the index after the given agent has moved.
+
+        Parameters
+        ----------
+        agent : agentframework.Agent
+            The agent that has moved.
+        y : int
+            Previous y-axis position.
+        x : int
+            Previous x-axis position.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        order = self._order[id(agent)]
+        self._ys[order] = agent.y
+
+        # Only reorder when the agent has moved along the x-axis
+        old_x = self._x(x)
+        new_x = self._x(agent.x)
+        if old_x != new_x:
+            del self._keys[bisect.bisect_left(self._keys, (old_x, order))]
+            bisect.insort(self._keys, (new_x, order))
+
+
+    def _x(self, x):
+        """
+        Return the x-axis position used for indexing, wrapped when toroidal.
+        """
+        return x % self.environment.x_length if self.toroidal else x
+
+
+# Index classes by strategy name
+index_classes = {
+    "brute": NeighbourIndex,
+    "grid": GridIndex,
+    "sweep": SweepIndex,
+}
+
+
+
+class NeighbourGraph():
+    """
+    The NeighbourGraph class keeps the neighbour graph of agents stored as
+    arrays, reusing it across iterations.
+
+    The graph holds the candidate neighbours of each agent within the
+    neighbourhood size plus a skin distance, as in a Verlet list. Each
+    update only checks the distances of the candidate pairs. The candidates
+    of an agent are found again once it has moved more than a quarter of
+    the skin since they were last found. Since then, neither agent in a
+    candidate pair has moved more than half the skin, so no agent outside
+    the candidates can have come within the neighbourhood. If many agents
+    have moved that far, all candidates are rebuilt at once.
+
+    Without a skin, the candidates are the neighbours themselves, and only
+    the neighbours of the agents that have moved are found again.
+
+    With a skin, candidates and movement are measured across the environment
+    edges even when distances are not, as agents wrap around the edges when
+    they move. Pairs further apart across the edges are further apart without
+    them, so no neighbours are missed.
+
+    Public Methods:
+
+        update - returns the neighbours of every agent at their current
+                 positions
+    """
+
+    def __init__(self, neighbourhood_size, y_length, x_length,
+                 toroidal=False, skin=None):
+        """
+        Instantiate a NeighbourGraph.
+
+        Parameters
+        ----------
+        neighbourhood_size : int
+            Size of the neighbourhood.
+        y_length : int
+            Environment y-axis length.
+        x_length : int
+            Environment x-axis length.
+        toroidal : bool, optional
+            Measure distances across the environment edges. The default
+            is False.
+        skin : int, optional
+            Distance added to the neighbourhood size for the candidates.
+            If None, `default_skin` is used. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.neighbourhood_size = neighbourhood_size
+        self.y_length = y_length
+        self.x_length = x_length
+        self.toroidal = toroidal
+        self.skin = default_skin if skin is None else skin
+
+        # Number of times all candidates have been built, and the number
+        # of agents whose candidates have been found again since
+        self.builds = 0
+        self.refreshes = 0
+
+        # Candidates are built with the first update, as sorted pair keys
+        # and the positions each agent had when its candidates were found
+        self._keys = None
+        self._rows = None
+        self._columns = None
+        self._ys = None
+        self._xs = None
+
+
+    def update(self, ys, xs):
+        """
+        Return the neighbours of every agent at the given positions.
+
+        Parameters
+        ----------
+        ys : numpy.ndarray
+            Agent y-axis positions.
+        xs : numpy.ndarray
+            Agent x-axis positions.
+
+        Returns
+        -------
+        tuple[numpy.ndarray, numpy.ndarray]
+            CSR row pointers and column indices, as returned by
+            `neighbour_graph`.
+
+        """
+
+        ys = numpy.asarray(ys)
+        xs = numpy.asarray(xs)
+        if self._keys is None or len(self._ys) != len(ys):
+            self._build(ys, xs)
+        else:
+            # Find the agents that have moved more than a quarter of the
+            # skin since their candidates were found
+            dy = self._offsets(ys - self._ys, self.y_length, True)
+            dx = self._offsets(xs - self._xs, self.x_length, True)
+            moved = numpy.flatnonzero(16 * (dy * dy + dx * dx) >
+                                      self.skin * self.skin)
+            if len(moved) > graph_rebuild_fraction * len(ys):
+                self._build(ys, xs)
+            elif len(moved) > 0:
+                self._refresh(ys, xs, moved)
+
+        # Without a skin the candidates are the neighbours
+        if self.skin == 0:
+            return self._indptr(self._rows, len(ys)), self._columns
+
+        # Keep the candidate pairs within the neighbourhood
+        rows = self._rows
+        columns = self._columns
+        dy = self._offsets(ys[rows] - ys[columns], self.y_length)
+        dx = self._offsets(xs[rows] - xs[columns], self.x_length)
+        keep = dy * dy + dx * dx <= \
+            self.neighbourhood_size * self.neighbourhood_size
+        return self._indptr(rows[keep], len(ys)), columns[keep]
+
+
+    def _build(self, ys, xs):
+        """
+        Find the candidates of every agent.
+        """
+        num_of_agents = len(ys)
+        rows, columns = neighbour_pairs(
+            ys, xs, self.neighbourhood_size + self.skin, self.y_length,
+            self.x_length, self._toroidal_candidates)
+        self._set_keys(numpy.sort(rows * num_of_agents + columns),
+                       num_of_agents)
+        self._ys = numpy.array(ys)
+        self._xs = numpy.array(xs)
+        self.builds += 1
+
+
+    def _refresh(self, ys, xs, moved):
+        """
+        Find the candidates of the given agents again.
+        """
+        num_of_agents = len(ys)
+
+        # Drop the candidate pairs of the agents
+        is_moved = numpy.zeros(num_of_agents, dtype=bool)
+        is_moved[moved] = True
+        kept = self._keys[~(is_moved[self._rows] | is_moved[self._columns])]
+
+        # Add their new candidate pairs in both directions, once each
+        rows, columns = neighbour_pairs(
+            ys, xs, self.neighbourhood_size + self.skin, self.y_length,
+            self.x_length, self._toroidal_candidates, moved)
+        added = numpy.unique(numpy.concatenate(
+            (rows * num_of_agents + columns,
+             columns * num_of_agents + rows)))
+
+        # The kept keys are already sorted, so a stable sort merges them
+        keys = numpy.concatenate((kept, added))
+        keys.sort(kind="stable")
+        self._set_keys(keys, num_of_agents)
+        self._ys[moved] = ys[moved]
+        self._xs[moved] = xs[moved]
+        self.refreshes += len(moved)
+
+
+    @property
+    def _toroidal_candidates(self):
+        """
+        Get whether candidates are found across the environment edges.
+        """
+        return self.toroidal or self.skin > 0
+
+
+    def _indptr(self, rows, num_of_agents):
+        """
+        Return the CSR row pointers of sorted pair rows.
+        """
+        return numpy.concatenate(([0], numpy.cumsum(
+            numpy.bincount(rows, minlength=num_of_agents))))
+
+
+    def _set_keys(self, keys, num_of_agents):
+        """
+        Set the sorted candidate pair keys and the pairs they encode.
+        """
+        self._keys = keys
+        self._rows = keys // num_of_agents
+        self._columns = keys - self._rows * num_of_agents
+
+
+    def _offsets(self, offsets, length, toroidal=None):
+        """
+        Return the absolute offsets along an axis, wrapped when toroidal.
+        """
+        if toroidal is None:
+            toroidal = self.toroidal
+        offsets = numpy.abs(offsets)
+        if toroidal:
+            offsets %= length
+            offsets = numpy.minimum(offsets, length - offsets)
+        return offsets
+
+
+class NeighbourIndexTestCase(unittest.TestCase):
+    """
+    The NeighbourIndexTestCase class provides a collection of unit tests for
+    the neighbourhood indexes.
+    """
+
+    def test_indexes_match_brute_force(self):
+        """
+        Test that every index finds the same neighbours as brute force,
+        including after agents have moved.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        random.seed(0)
+        for toroidal in (False, True):
+            for neighbourhood_size in (0, 3, 20, 80):
+
+                # Setup test case
+                environment = agentframework.Environment(
+                    [[0] * 50 for _ in range(40)])
+                agents = []
+                for _ in range(60):
+                    agents.append(agentframework.Agent(
+                        environment, agents, random.randint(0, 39),
+                        random.randint(0, 49)))
+                indexes = [create_index(strategy, agents, environment,
+                                        neighbourhood_size, toroidal)
+                           for strategy in ("grid", "sweep")]
+
+                for _ in range(3):
+                    # Verify neighbours match brute force
+                    for agent in agents:
+                        expected = agent.neighbours(neighbourhood_size,
+                                                    toroidal)
+                        for index in indexes:
+                            self.assertEqual(index.neighbours(agent),
+                                             expected)
+
+                    # Move agents and update the indexes
+                    for agent in agents:
+                        y, x = agent.y, agent.x
+                        agent.move()
+                        for index in indexes:
+                            index.move(agent, y, x)
+
+
+    def test_neighbour_graph(self):
+        """
+        Test that the neighbour graph matches brute force, including on
+        environments only a few neighbourhoods wide.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        random.seed(0)
+        for toroidal in (False, True):
+            for neighbourhood_size in (0, 3, 15, 80):
+                environment = agentframework.Environment(
+                    [[0] * 50 for _ in range(40)])
+                agents = agentframework.AgentArrays(
+                    environment, [random.randint(0, 39) for _ in range(60)],
+                    [random.randint(0, 49) for _ in range(60)])
+                indptr, indices = neighbour_graph(
+                    agents.y, agents.x, neighbourhood_size, 40, 50, toroidal)
+
+                for i, agent in enumerate(agents):
+                    self.assertEqual(
+                        [agents[j] for j in indices[indptr[i]:indptr[i + 1]]],
+                        agent.neighbours(neighbourhood_size, toroidal))
+
+
+    def test_neighbour_graph_updates(self):
+        """
+        Test that a reused neighbour graph matches a new one as agents move,
+        while only rebuilding its candidates occasionally.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        rng = numpy.random.default_rng(0)
+        for toroidal, skin in ((False, 0), (True, 0), (False, 4), (True, 4)):
+            ys = rng.integers(0, 40, 200)
+            xs = rng.integers(0, 50, 200)
+            graph = NeighbourGraph(3, 40, 50, toroidal, skin)
+            for i in range(12):
+                indptr, indices = graph.update(ys, xs)
+                expected = neighbour_graph(ys, xs, 3, 40, 50, toroidal)
+                self.assertTrue(numpy.array_equal(indptr, expected[0]))
+                self.assertTrue(numpy.array_equal(indices, expected[1]))
+
+                # Move a few agents, then every agent in the last iteration
+                if i == 10:
+                    ys = (ys + 3) % 40
+                else:
+                    moved = rng.integers(0, 200, 20)
+                    ys[moved] = (ys[moved] + rng.integers(-1, 2, 20)) % 40
+                    xs[moved] = (xs[moved] + rng.integers(-1, 2, 20)) % 50
+            self.assertEqual(graph.builds, 2)
+            self.assertGreater(graph.refreshes, 0)
+
+            # Verify a different number of agents is rebuilt
+            indptr, indices = graph.update(ys[:10], xs[:10])
+            self.assertEqual(len(indptr), 11)
+            self.assertEqual(graph.builds, 3)
+
+
+    def test_select_strategy(self):
+        """
+        Test that the strategy is selected using density and neighbourhood
+        size.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.assertEqual(select_strategy(10, 5, 100, 100), "brute")
+        self.assertEqual(select_strategy(1000, 5, 100, 100), "grid")
+        self.assertEqual(select_strategy(1000, 20, 100, 100), "sweep")
+        self.assertEqual(select_strategy(1000, 50, 100, 100), "brute")
+
+
+    def test_unknown_strategy(self):
+        """
+        Test that an unknown strategy is rejected.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        environment = agentframework.Environment([[0]])
+        with self.assertRaises(ValueError):
+            create_index("unknown", [], environment, 5)
+
+
+    def test_wrapped_ranges(self):
+        """
+        Test that toroidal intervals are split where they wrap around.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.assertEqual(wrapped_ranges(-2, 3, 10, False), [(-2, 3)])
+        self.assertEqual(wrapped_ranges(-2, 3, 10, True), [(8, 9), (0, 3)])
+        self.assertEqual(wrapped_ranges(2, 5, 10, True), [(2, 5)])
+        self.assertEqual(wrapped_ranges(-5, 5, 10, True), [(0, 9)])
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
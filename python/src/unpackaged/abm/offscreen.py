@@ -0,0 +1,424 @@
+"""
+Off-Screen Rendering
+====================
+
+Renders a model run to a PNG image sequence or an MP4 video without a GUI,
+using the matplotlib Agg backend.
+
+A run is first recorded as a Trajectory, holding the initial environment,
+the environment cells changed in each iteration and the agent positions.
+Frames are then rendered in parallel worker processes, each drawing a range
+of frames on its own figure and reusing the same artists for every frame.
+Frames are written as fast as they can be drawn, rather than at the
+animation rate of the GUI.
+
+MP4 videos are encoded from the rendered frames with ffmpeg, which must be
+installed.
+"""
+
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+import numpy
+import matplotlib
+import matplotlib.backends.backend_agg
+import matplotlib.figure
+import agentframework
+import rendering
+
+# Name of each rendered frame file
+frame_filename = "frame_{:06d}.png"
+
+# State of the current worker process, set when rendering frames
+_worker = None
+
+
+class Trajectory():
+    """
+    The Trajectory class records the state of a model after each iteration,
+    so that it can be rendered later.
+
+    The environment is stored as the cells that changed in each frame, so
+    each frame only takes space for the agents and the cells they ate.
+
+    Public Methods:
+
+        record - adds the current state of a model as the next frame
+
+        frames - generates the state of each frame in a range
+    """
+
+    def __init__(self):
+        """
+        Instantiate a Trajectory.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.initial_plane = None
+        self.changes = []
+        self.agents = []
+        self._plane = None
+
+
+    def __len__(self):
+        return len(self.agents)
+
+
+    def record(self, model):
+        """
+        Add the current state of the given model as the next frame.
+
+        Parameters
+        ----------
+        model : Model
+            The model to record.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Copy the plane within the environment limits
+        environment = model.environment
+        plane = numpy.array(environment.limited_plane, dtype=numpy.float64)
+
+        # Store the first plane, then the cells changed since the last frame
+        if self._plane is None:
+            self.initial_plane = plane
+            cells = numpy.empty(0, dtype=numpy.int64)
+        else:
+            cells = numpy.flatnonzero(plane != self._plane)
+        self.changes.append((cells, plane.ravel()[cells]))
+        self._plane = plane
+
+        ys, xs, active = rendering.agent_positions(model.agents)
+        self.agents.append((numpy.array(ys, dtype=numpy.int32),
+                            numpy.array(xs, dtype=numpy.int32),
+                            numpy.array(active)))
+
+
+    def frames(self, start=0, stop=None):
+        """
+        Generate the state of each frame in the given range.
+
+        The environment is rebuilt from the initial plane, so it is cheapest
+        to read frames in order.
+
+        Parameters
+        ----------
+        start : int, optional
+            First frame. The default is 0.
+        stop : int, optional
+            Frame after the last. If None, all remaining frames are
+            generated. The default is None.
+
+        Yields
+        ------
+        tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]
+            Environment plane, agent y-axis positions, agent x-axis
+            positions and whether each agent can still eat. The plane is
+            updated in place for each frame.
+
+        """
+
+        if stop is None:
+            stop = len(self)
+        plane = self.initial_plane.copy()
+        flat = plane.ravel()
+        for i in range(stop):
+            cells, values = self.changes[i]
+            flat[cells] = values
+            if i >= start:
+                yield (plane,) + self.agents[i]
+
+
+
+def record_run(model, num_of_iterations=None):
+    """
+    Run the given model, recording its state after each iteration.
+
+    Parameters
+    ----------
+    model : Model
+        The model to run, from its current state.
+    num_of_iterations : int, optional
+        Maximum number of iterations to run. If None, the model number of
+        iterations is used. The default is None.
+
+    Returns
+    -------
+    Trajectory
+        The initial state followed by the state after each iteration, until
+        the simulation is complete or the number of iterations is reached.
+
+    """
+
+    if num_of_iterations is None:
+        num_of_iterations = model.num_of_iterations
+
+    trajectory = Trajectory()
+    trajectory.record(model)
+    for _ in range(num_of_iterations):
+        is_done = model.iterate()
+        trajectory.record(model)
+        if is_done:
+            break
+    return trajectory
+
+
+def _start_worker(trajectory, settings):
+    """
+    Set the trajectory and settings used by `_render_range`.
+    """
+    global _worker
+    _worker = (trajectory, settings)
+
+
+def _render_range(frame_range):
+    """
+    Render a range of frames to PNG files, returning their paths.
+    """
+    trajectory, settings = _worker
+    start, stop = frame_range
+    y_length, x_length = trajectory.initial_plane.shape
+
+    # Draw on an off-screen figure covering the whole canvas
+    figure = matplotlib.figure.Figure(figsize=settings["figsize"],
+                                      dpi=settings["dpi"])
+    canvas = matplotlib.backends.backend_agg.FigureCanvasAgg(figure)
+    axes = figure.add_axes([0, 0, 1, 1])
+    axes.set_axis_off()
+    width, height = canvas.get_width_height()
+    detailed = rendering.is_detailed(
+        len(trajectory.agents[0][0]), y_length * x_length,
+        settings["agent_limit"], settings["cell_limit"])
+    drawing = rendering.ModelDrawing(axes, y_length, x_length,
+                                     (height, width), detailed)
+
+    # Draw each frame with the same artists
+    paths = []
+    for i, state in enumerate(trajectory.frames(start, stop), start):
+        drawing.update(*state)
+        path = os.path.join(settings["directory"], frame_filename.format(i))
+        canvas.print_png(path, pil_kwargs={"compress_level": 1})
+        paths.append(path)
+    return paths
+
+
+def render_frames(trajectory, directory, num_of_workers=None,
+                  figsize=(7, 7), dpi=100, agent_limit=None,
+                  cell_limit=None):
+    """
+    Render each frame of a trajectory to a PNG file.
+
+    Parameters
+    ----------
+    trajectory : Trajectory
+        The recorded run to render.
+    directory : str
+        Directory to write the frames to. It is created if it does not
+        exist.
+    num_of_workers : int, optional
+        Number of worker processes. If None, the number of CPUs is used.
+        If 1, frames are rendered in the current process. The default is
+        None.
+    figsize : tuple[float, float], optional
+        Frame width and height, in inches. The default is (7, 7).
+    dpi : int, optional
+        Frame resolution, in pixels per inch. The default is 100.
+    agent_limit : int, optional
+        Maximum number of agents to draw in full detail. If None,
+        `rendering.detail_agent_limit` is used.
+    cell_limit : int, optional
+        Maximum number of environment cells to draw in full detail. If None,
+        `rendering.detail_cell_limit` is used.
+
+    Returns
+    -------
+    list[str]
+        Path of each frame, in order.
+
+    """
+
+    if num_of_workers is None:
+        num_of_workers = os.cpu_count() or 1
+    os.makedirs(directory, exist_ok=True)
+    settings = {"directory": directory, "figsize": figsize, "dpi": dpi,
+                "agent_limit": agent_limit, "cell_limit": cell_limit}
+
+    # Split the frames into one contiguous range per worker
+    bounds = numpy.linspace(0, len(trajectory), num_of_workers + 1).astype(int)
+    ranges = [(int(start), int(stop)) for start, stop in
+              zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    if num_of_workers == 1:
+        _start_worker(trajectory, settings)
+        try:
+            results = list(map(_render_range, ranges))
+        finally:
+            _start_worker(None, None)
+    else:
+        with multiprocessing.Pool(num_of_workers, _start_worker,
+                                  (trajectory, settings)) as pool:
+            results = pool.map(_render_range, ranges)
+    return [path for paths in results for path in paths]
+
+
+def encode_video(directory, filepath, fps=20):
+    """
+    Encode rendered frames into an MP4 video with ffmpeg.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding frames written by `render_frames`.
+    filepath : str
+        Path of the video file to write.
+    fps : int, optional
+        Frames per second. The default is 20.
+
+    Raises
+    ------
+    RuntimeError
+        If ffmpeg is not installed or fails.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    ffmpeg = shutil.which(matplotlib.rcParams["animation.ffmpeg_path"])
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is required to encode videos")
+
+    result = subprocess.run(
+        [ffmpeg, "-y", "-loglevel", "error", "-framerate", str(fps),
+         "-i", os.path.join(directory, frame_filename.replace(
+             "{:06d}", "%06d")),
+         "-pix_fmt", "yuv420p", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+         filepath], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("ffmpeg failed: {}".format(result.stderr))
+
+
+def render_video(trajectory, filepath, fps=20, **kwargs):
+    """
+    Render a trajectory to an MP4 video.
+
+    Frames are rendered to a temporary directory, then encoded with ffmpeg.
+
+    Parameters
+    ----------
+    trajectory : Trajectory
+        The recorded run to render.
+    filepath : str
+        Path of the video file to write.
+    fps : int, optional
+        Frames per second. The default is 20.
+    **kwargs
+        Options passed to `render_frames`.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        render_frames(trajectory, directory, **kwargs)
+        encode_video(directory, filepath, fps)
+
+
+
+class OffscreenTestCase(unittest.TestCase):
+    """
+    The OffscreenTestCase class provides a collection of unit tests for the
+    Trajectory class and frame rendering.
+    """
+
+    class FakeModel():
+        """
+        A minimal model that moves and feeds its agents when iterated.
+        """
+
+        def __init__(self):
+            self.num_of_iterations = 6
+            self.environment = agentframework.Environment(
+                [[100.0] * 12 for _ in range(10)])
+            self.agents = agentframework.AgentArrays(
+                self.environment, [2, 5, 7], [3, 6, 9], None, 50, 10)
+
+        def iterate(self):
+            for agent in self.agents:
+                agent.move()
+                agent.eat()
+            return not self.agents.can_eat().any()
+
+
+    def test_trajectory(self):
+        """
+        Test that recorded frames match the model state at each iteration.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        agentframework.random.seed(0)
+        model = self.FakeModel()
+        trajectory = Trajectory()
+        planes = []
+        for _ in range(4):
+            trajectory.record(model)
+            planes.append(numpy.array(model.environment.plane))
+            model.iterate()
+
+        for i, (plane, ys, xs, active) in enumerate(trajectory.frames(1), 1):
+            self.assertTrue(numpy.array_equal(plane, planes[i]))
+        self.assertEqual(len(trajectory.changes[3][0]), 3)
+
+
+    def test_render_frames(self):
+        """
+        Test that frames are rendered the same by any number of workers.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        import matplotlib.image
+        agentframework.random.seed(0)
+        trajectory = record_run(self.FakeModel())
+        self.assertEqual(len(trajectory), 6)
+
+        images = []
+        for num_of_workers in (1, 2):
+            with tempfile.TemporaryDirectory() as directory:
+                paths = render_frames(trajectory, directory, num_of_workers,
+                                      figsize=(1, 1), dpi=50)
+                self.assertEqual([os.path.basename(path) for path in paths],
+                                 [frame_filename.format(i)
+                                  for i in range(6)])
+                images.append([matplotlib.image.imread(path)
+                               for path in paths])
+
+        for image, other in zip(*images):
+            self.assertEqual(image.shape, (50, 50, 4))
+            self.assertTrue(numpy.array_equal(image, other))
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,676 @@
+"""
+Parallel Iteration
+==================
+
+Runs model iterations across worker processes by splitting the environment
+into tiles.
+
+Each tile owns the agents located in it at the start of an iteration. Tiles
+are coloured in a 2x2 pattern and the four colours are processed in turn,
+with all tiles of one colour processed in parallel. Tiles are at least
+`2 * (neighbourhood_size + move_range) + 1` cells wide, for the largest
+species move range, so tiles of the same colour can never reach the same
+agents or environment cells, even after their agents have moved. Agent and
+environment state is held in shared memory, so each worker reads the agents
+near its tile edges (the halo) directly, and agents that cross a tile
+boundary are migrated to their new tile at the start of the next iteration.
+
+Agents within a tile are processed in a random order, so a parallel run is
+statistically equivalent to a sequential run rather than identical to it.
+For a given seed and tiling, results are the same for any number of
+workers.
+"""
+
+import multiprocessing
+import os
+import random
+import unittest
+import weakref
+import numpy
+import agentframework
+import neighbourhood
+import sharedstate
+
+# Shared state of the current process, set when attached to an executor
+_state = None
+
+
+def tile_counts(y_length, x_length, neighbourhood_size, num_of_workers,
+                move_range=1):
+    """
+    Return the number of tiles along each axis of the environment.
+
+    Enough tiles are used to give every worker a tile in each colour phase,
+    where possible. Counts are 1 or even, and tiles are never narrower than
+    `min_tile_side`.
+
+    Parameters
+    ----------
+    y_length : int
+        Environment y-axis length.
+    x_length : int
+        Environment x-axis length.
+    neighbourhood_size : int
+        Size of the neighbourhood.
+    num_of_workers : int
+        Number of worker processes.
+    move_range : int, optional
+        Largest number of steps an agent moves along each axis. The default
+        is 1.
+
+    Returns
+    -------
+    tiles_y : int
+        Number of tiles along the y-axis.
+    tiles_x : int
+        Number of tiles along the x-axis.
+
+    """
+
+    min_side = min_tile_side(neighbourhood_size, move_range)
+
+    def next_count(count, length):
+        # Return the next valid tile count, or None if tiles would be too small
+        count = 2 if count == 1 else count + 2
+        return count if length // count >= min_side else None
+
+    tiles_y = tiles_x = 1
+    while tiles_y * tiles_x < 4 * num_of_workers:
+
+        # Split the axis with the longest tiles first
+        next_y = next_count(tiles_y, y_length)
+        next_x = next_count(tiles_x, x_length)
+        if next_y is None and next_x is None:
+            break
+        if next_x is None or (next_y is not None and
+                              y_length / tiles_y >= x_length / tiles_x):
+            tiles_y = next_y
+        else:
+            tiles_x = next_x
+
+    return tiles_y, tiles_x
+
+
+def min_tile_side(neighbourhood_size, move_range=1):
+    """
+    Return the smallest tile side, in cells, for which tiles of the same
+    colour never reach the same agents or environment cells.
+
+    An agent can move `move_range` cells outside its tile and then share
+    with agents up to `neighbourhood_size` cells further away, so tiles of
+    the same colour must be separated by more than twice that distance.
+
+    Parameters
+    ----------
+    neighbourhood_size : int
+        Size of the neighbourhood.
+    move_range : int, optional
+        Largest number of steps an agent moves along each axis. The default
+        is 1.
+
+    Returns
+    -------
+    int
+        Smallest tile side.
+
+    """
+
+    return 2 * (int(neighbourhood_size) + int(move_range)) + 1
+
+
+def process_tile(task):
+    """
+    Run a single iteration for the agents owned by a tile.
+
+    Parameters
+    ----------
+    task : tuple[int, int]
+        Tile number and random seed.
+
+    Returns
+    -------
+    tuple[int, float, int]
+        Number of agents that were able to eat at the start of their turn,
+        the resource eaten and the number of share events.
+
+    """
+
+    tile, seed = task
+    state = _state
+    tiles_y, tiles_x = state["tiles"]
+    order = state["order"]
+    offsets = state["offsets"]
+    plane = state["plane"]
+    y_length, x_length = plane.shape
+    radius = state["neighbourhood_size"]
+    toroidal = state["toroidal"]
+    species = state["species"]
+
+    # Gather the agents owned by the tile, followed by the halo agents in
+    # the surrounding tiles
+    tile_y, tile_x = divmod(tile, tiles_x)
+    surrounding = sorted({((tile_y + dy) % tiles_y) * tiles_x
+                          + (tile_x + dx) % tiles_x
+                          for dy in (-1, 0, 1) for dx in (-1, 0, 1)}
+                         - {tile})
+    owned = order[offsets[tile]:offsets[tile + 1]]
+    indices = numpy.concatenate(
+        [owned] + [order[offsets[t]:offsets[t + 1]] for t in surrounding])
+    num_of_owned = len(owned)
+
+    # Work on local copies of the agent values
+    ys = state["y"][indices].tolist()
+    xs = state["x"][indices].tolist()
+    stores = state["store"][indices].tolist()
+    kinds = (numpy.searchsorted(state["bounds"], indices, side="right")
+             - 1).tolist()
+
+    # Bucket agents into neighbourhood-sized cells
+    size = max(int(radius), 1)
+    cells = {}
+    for i in range(len(indices)):
+        cells.setdefault((ys[i] // size, xs[i] // size), []).append(i)
+
+    # Process owned agents in a random order
+    rng = random.Random(seed)
+    turns = list(range(num_of_owned))
+    rng.shuffle(turns)
+
+    active = 0
+    eaten = 0
+    share_events = 0
+    shared = set()
+    for i in turns:
+
+        # Only move agent if it has store capacity
+        store_size, bite_size, move_range = species[kinds[i]]
+        if store_size > 0 and stores[i] + bite_size > store_size:
+            continue
+        active += 1
+
+        # Move the agent and update its cell
+        old_cell = (ys[i] // size, xs[i] // size)
+        if move_range == 1:
+            y = ys[i] = (ys[i] + _random_step(rng)) % y_length
+            x = xs[i] = (xs[i] + _random_step(rng)) % x_length
+        else:
+            y = ys[i] = (ys[i] + rng.randint(-move_range, move_range)) \
+                % y_length
+            x = xs[i] = (xs[i] + rng.randint(-move_range, move_range)) \
+                % x_length
+        new_cell = (y // size, x // size)
+        if new_cell != old_cell:
+            cells[old_cell].remove(i)
+            cells.setdefault(new_cell, []).append(i)
+
+        # Eat a portion of the environment
+        if plane[y, x] > bite_size:
+            plane[y, x] -= bite_size
+            stores[i] += bite_size
+            eaten += bite_size
+
+        # Find the cells covering the neighbourhood bounding box
+        rows = dict.fromkeys(
+            row for low, high in neighbourhood.wrapped_ranges(
+                y - radius, y + radius, y_length, toroidal)
+            for row in range(low // size, high // size + 1))
+        columns = dict.fromkeys(
+            column for low, high in neighbourhood.wrapped_ranges(
+                x - radius, x + radius, x_length, toroidal)
+            for column in range(low // size, high // size + 1))
+        candidates = []
+        for row in rows:
+            for column in columns:
+                candidates.extend(cells.get((row, column), ()))
+        candidates.sort()
+
+        # Share with each neighbour in turn
+        for j in candidates:
+            if j == i:
+                continue
+            dy = abs(ys[j] - y)
+            dx = abs(xs[j] - x)
+            if toroidal:
+                dy = agentframework.wrapped_offset(dy, y_length)
+                dx = agentframework.wrapped_offset(dx, x_length)
+            if dy <= radius and dx <= radius and \
+                    dx * dx + dy * dy <= radius * radius:
+                average = (stores[i] + stores[j]) / 2
+                stores[i] = average
+                stores[j] = average
+                shared.add(j)
+                share_events += 1
+
+    # Write back owned agents and any halo agents that were shared with
+    state["y"][owned] = ys[:num_of_owned]
+    state["x"][owned] = xs[:num_of_owned]
+    changed = list(range(num_of_owned)) + \
+        sorted(j for j in shared if j >= num_of_owned)
+    state["store"][indices[changed]] = [stores[j] for j in changed]
+
+    return active, eaten, share_events
+
+
+def _random_step(rng):
+    """
+    Return a random step value of -1, 0 or 1, as `Agent.move` does.
+    """
+    step_chance = rng.random()
+    if step_chance < 0.33:
+        return 1
+    elif step_chance < 0.66:
+        return -1
+    return 0
+
+
+def _attach(descriptor):
+    """
+    Attach the current process to the shared state of an executor.
+
+    Parameters
+    ----------
+    descriptor : dict
+        Shared state and tile array descriptors, and model settings.
+
+    Returns
+    -------
+    None.
+
+    """
+
+    global _state
+    state = sharedstate.SharedState(descriptor=descriptor["state"])
+    tile_arrays = sharedstate.SharedArrays(descriptor=descriptor["tiles"])
+    _state = _create_worker_state(state, tile_arrays, descriptor["settings"])
+
+
+def _create_worker_state(state, tile_arrays, settings):
+    """
+    Return the state used by `process_tile`.
+    """
+    return dict(settings,
+                plane=state.environment.plane,
+                y=state.agents.y,
+                x=state.agents.x,
+                store=state.agents.store,
+                order=tile_arrays["order"],
+                offsets=tile_arrays["offsets"],
+                _shared=(state, tile_arrays))
+
+
+def _release(pool):
+    """
+    Stop the given worker pool.
+    """
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+
+
+class TiledExecutor():
+    """
+    The TiledExecutor class runs model iterations in parallel over tiles of
+    the environment, using a pool of worker processes.
+
+    On creation, the agent and environment state is moved into shared
+    memory, unless existing shared state is given. The given agent arrays
+    are updated to use the shared memory, and the environment using the
+    shared plane is provided as `environment`.
+
+    Public Methods:
+
+        iterate - runs a single iteration of the model
+
+        close - stops the workers and releases the shared memory
+    """
+
+    def __init__(self, environment, agents, neighbourhood_size,
+                 toroidal=False, num_of_workers=None, tiles=None,
+                 shared_state=None):
+        """
+        Instantiate a TiledExecutor.
+
+        Parameters
+        ----------
+        environment : agentframework.Environment
+            The environment the agents interact with.
+        agents : agentframework.AgentArrays
+            The agents to iterate.
+        neighbourhood_size : int
+            Size of the neighbourhood within which agents share.
+        toroidal : bool, optional
+            Measure distances across the environment edges. The default
+            is False.
+        num_of_workers : int, optional
+            Number of worker processes. If None, the number of CPUs is used.
+            If 1 or less, tiles are processed in the current process.
+        tiles : tuple[int, int], optional
+            Number of tiles along the y-axis and x-axis. Each count must be
+            1 or even, and tiles must be at least `min_tile_side` cells wide
+            for the largest species move range. If None, the tiling is
+            chosen using `tile_counts`.
+        shared_state : sharedstate.SharedState, optional
+            Existing shared state holding the environment and agents, which
+            remains owned by the caller. If None, the state is shared by the
+            executor and released when it is closed.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if num_of_workers is None:
+            num_of_workers = os.cpu_count() or 1
+        self.num_of_workers = num_of_workers
+        self.agents = agents
+
+        # Move state into shared memory, unless already shared
+        self._owns_state = shared_state is None
+        if shared_state is None:
+            shared_state = sharedstate.SharedState(environment, agents)
+        self.shared_state = shared_state
+        self.environment = shared_state.environment
+        y_length = self.environment.y_length
+        x_length = self.environment.x_length
+
+        # Split the environment into tiles wide enough for the furthest
+        # moving species
+        move_range = max(kind.move_range for kind in agents.species)
+        if tiles is None:
+            tiles = tile_counts(y_length, x_length, neighbourhood_size,
+                                num_of_workers, move_range)
+        elif any(count != 1 and count % 2 for count in tiles):
+            raise ValueError("Tile counts must be 1 or even")
+        elif any(count > 1 and length // count <
+                 min_tile_side(neighbourhood_size, move_range)
+                 for count, length in zip(tiles, (y_length, x_length))):
+            raise ValueError("Tiles must be at least {} cells wide".format(
+                min_tile_side(neighbourhood_size, move_range)))
+        self.tiles = tuple(tiles)
+        num_of_tiles = self.tiles[0] * self.tiles[1]
+
+        # Counts from the latest iteration
+        self.counts = {"active": 0, "eaten": 0, "share_events": 0}
+
+        # Share the agent order and tile offsets with the workers
+        self._tile_arrays = sharedstate.SharedArrays({
+            "order": numpy.zeros(len(agents), dtype=numpy.int64),
+            "offsets": numpy.zeros(num_of_tiles + 1, dtype=numpy.int64),
+        })
+        settings = {
+            "tiles": self.tiles,
+            "neighbourhood_size": neighbourhood_size,
+            "toroidal": toroidal,
+            "species": [(kind.store_size, kind.bite_size, kind.move_range)
+                        for kind in agents.species],
+            "bounds": agents.bounds.tolist(),
+        }
+
+        # Start the workers, or process tiles in the current process
+        self._pool = None
+        if num_of_workers > 1:
+            descriptor = {"state": shared_state.descriptor(),
+                          "tiles": self._tile_arrays.descriptor(),
+                          "settings": settings}
+            self._pool = multiprocessing.Pool(num_of_workers,
+                                              initializer=_attach,
+                                              initargs=(descriptor,))
+        else:
+            global _state
+            _state = _create_worker_state(shared_state, self._tile_arrays,
+                                          settings)
+
+        # Stop the workers if the executor is not closed explicitly
+        self._finalizer = weakref.finalize(self, _release, self._pool)
+
+
+    def iterate(self):
+        """
+        Run a single iteration of the model.
+
+        The number of active agents, resource eaten and share events are
+        stored in `counts`.
+
+        Returns
+        -------
+        is_done : bool
+            Returns True if no agent was able to eat, otherwise returns
+            False.
+
+        """
+
+        tiles_y, tiles_x = self.tiles
+        num_of_tiles = tiles_y * tiles_x
+        y_length = self.environment.y_length
+        x_length = self.environment.x_length
+
+        # Assign each agent to the tile it is currently in
+        tile_y = numpy.minimum(self.agents.y // (y_length // tiles_y),
+                               tiles_y - 1)
+        tile_x = numpy.minimum(self.agents.x // (x_length // tiles_x),
+                               tiles_x - 1)
+        tile_ids = tile_y * tiles_x + tile_x
+        order = numpy.argsort(tile_ids, kind="stable")
+        self._tile_arrays["order"][:] = order
+        self._tile_arrays["offsets"][:] = numpy.searchsorted(
+            tile_ids[order], numpy.arange(num_of_tiles + 1))
+
+        # Process each colour of tiles in turn
+        seed = random.getrandbits(32) * num_of_tiles
+        results = []
+        for colour in range(4):
+            tasks = [(tile, seed + tile) for tile in range(num_of_tiles)
+                     if (tile // tiles_x % 2) * 2 + tile % tiles_x % 2
+                     == colour]
+            if self._pool is not None:
+                results.extend(self._pool.map(process_tile, tasks))
+            else:
+                results.extend(map(process_tile, tasks))
+
+        # Total the counts from each tile
+        active, eaten, share_events = (sum(counts) for counts in
+                                       zip(*results))
+        self.counts = {"active": active, "eaten": eaten,
+                       "share_events": share_events}
+
+        return active == 0
+
+
+    def close(self):
+        """
+        Stop the workers and release the shared memory.
+
+        Shared state given on creation remains open. Otherwise, the agent
+        arrays are copied back into local memory, so they remain usable.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        global _state
+        if _state is not None and _state["order"] is \
+                self._tile_arrays.arrays.get("order"):
+            _state = None
+
+        self._finalizer()
+        self._tile_arrays.close()
+        if self._owns_state:
+            self.shared_state.close()
+            self.environment = self.shared_state.environment
+
+
+
+class TiledExecutorTestCase(unittest.TestCase):
+    """
+    The TiledExecutorTestCase class provides a collection of unit tests for
+    the TiledExecutor class.
+    """
+
+    def create_agents(self, num_of_agents=400, length=60, value=50,
+                      species=None):
+        """
+        Return randomly placed agents in an environment of the given size.
+        """
+        random.seed(1)
+        environment = agentframework.Environment(
+            [[value] * length for _ in range(length)])
+        if species is not None:
+            num_of_agents = sum(count for _, count in species)
+        return agentframework.AgentArrays(
+            environment,
+            [random.randint(0, length - 1) for _ in range(num_of_agents)],
+            [random.randint(0, length - 1) for _ in range(num_of_agents)],
+            store_size=1000, bite_size=10, species=species)
+
+
+    def run_executor(self, num_of_workers, toroidal=False, iterations=5,
+                     species=None):
+        """
+        Return the agent arrays and plane after running an executor.
+        """
+        agents = self.create_agents(species=species)
+        executor = TiledExecutor(agents.environment, agents, 3, toroidal,
+                                 num_of_workers, (4, 2))
+        try:
+            random.seed(2)
+            for _ in range(iterations):
+                executor.iterate()
+            plane = numpy.array(executor.environment.plane)
+        finally:
+            executor.close()
+        return agents, plane
+
+
+    def test_tile_counts(self):
+        """
+        Test that tiles are split evenly and are never too narrow.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.assertEqual(tile_counts(100, 100, 5, 1), (2, 2))
+        self.assertEqual(tile_counts(100, 100, 5, 4), (4, 4))
+        self.assertEqual(tile_counts(100, 300, 5, 2), (2, 4))
+        self.assertEqual(tile_counts(100, 100, 30, 4), (1, 1))
+        self.assertEqual(tile_counts(100, 100, 5, 4, move_range=10), (2, 2))
+        self.assertEqual(min_tile_side(5), 2 * 5 + 3)
+
+
+    def test_conservation(self):
+        """
+        Test that resources are conserved and agents move a single step.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        start = self.create_agents()
+        for toroidal in (False, True):
+            agents, plane = self.run_executor(1, toroidal, 1)
+
+            # Verify eaten resources are held in the agent stores
+            self.assertAlmostEqual(plane.sum() + agents.store.sum(),
+                                   60 * 60 * 50)
+            self.assertGreater(agents.store.sum(), 0)
+
+            # Verify each agent moved at most one step on each axis
+            for before, after in ((start.y, agents.y), (start.x, agents.x)):
+                step = numpy.abs(after - before)
+                self.assertTrue(numpy.all((step <= 1) | (step == 59)))
+
+
+    def test_workers_match(self):
+        """
+        Test that results are the same in worker processes.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        agents, plane = self.run_executor(1)
+        parallel_agents, parallel_plane = self.run_executor(2)
+        self.assertTrue(numpy.array_equal(agents.y, parallel_agents.y))
+        self.assertTrue(numpy.array_equal(agents.x, parallel_agents.x))
+        self.assertTrue(numpy.array_equal(agents.store,
+                                          parallel_agents.store))
+        self.assertTrue(numpy.array_equal(plane, parallel_plane))
+
+
+    def test_move_ranges(self):
+        """
+        Test that species moving several steps give the same results in
+        worker processes as processing tiles one at a time, and that tiles
+        too narrow for their move range are refused.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        species = [(agentframework.Species("walkers", 1000, 10, 1), 200),
+                   (agentframework.Species("runners", 1000, 10, 3), 200)]
+        start = self.create_agents(species=species)
+        for toroidal in (False, True):
+            agents, plane = self.run_executor(1, toroidal, 5, species)
+            parallel_agents, parallel_plane = self.run_executor(
+                2, toroidal, 5, species)
+            self.assertTrue(numpy.array_equal(agents.y, parallel_agents.y))
+            self.assertTrue(numpy.array_equal(agents.x, parallel_agents.x))
+            self.assertTrue(numpy.array_equal(agents.store,
+                                              parallel_agents.store))
+            self.assertTrue(numpy.array_equal(plane, parallel_plane))
+            self.assertAlmostEqual(plane.sum() + agents.store.sum(),
+                                   60 * 60 * 50)
+
+            # Verify runners moved further than a single step
+            step = numpy.abs(agents.y - start.y)[200:]
+            step = numpy.minimum(step, 60 - step)
+            self.assertTrue(numpy.any(step > 5))
+
+        agents = self.create_agents(species=species)
+        with self.assertRaises(ValueError):
+            TiledExecutor(agents.environment, agents, 3, num_of_workers=1,
+                          tiles=(6, 2))
+
+
+    def test_share_across_tiles(self):
+        """
+        Test that agents share with neighbours in other tiles.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        # Setup test case with agents either side of a tile boundary
+        environment = agentframework.Environment(
+            [[0] * 40 for _ in range(40)])
+        agents = agentframework.AgentArrays(environment, [10, 10], [19, 20],
+                                            [10, 0], 1000)
+        executor = TiledExecutor(environment, agents, 5, num_of_workers=1)
+        try:
+            self.assertEqual(executor.tiles, (2, 2))
+            executor.iterate()
+        finally:
+            executor.close()
+
+        # Verify the stores were shared
+        self.assertEqual(agents.store.tolist(), [5, 5])
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
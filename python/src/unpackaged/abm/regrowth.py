@@ -0,0 +1,214 @@
+"""
+Environment Regrowth
+====================
+
+Regrows the environment after agents have eaten from it.
+
+Each cell regrows by its own rate each iteration, up to the capacity it
+held when regrowth started, such as the value loaded from the environment
+file. Only depleted cells are updated. These are tracked between
+iterations, so each update only needs to check the depleted cells and the
+cells under the agents, which are the only cells agents can have eaten from
+during the iteration. Once these make up a large part of the environment,
+a vectorized scan of the whole plane is cheaper and is used instead.
+"""
+
+import unittest
+import numpy
+import agentframework
+
+# Fraction of the cells above which the whole plane is scanned for depleted
+# cells, rather than checking the tracked cells
+scan_fraction = 0.02
+
+
+class Regrowth():
+    """
+    The Regrowth class regrows depleted environment cells up to their
+    original capacity.
+
+    Public Methods:
+
+        apply - regrows the depleted cells by one iteration
+    """
+
+    def __init__(self, environment, rate):
+        """
+        Instantiate a Regrowth.
+
+        The current plane, within the environment limits, is used as the
+        capacity of each cell.
+
+        Parameters
+        ----------
+        environment : agentframework.Environment
+            Environment to regrow. The plane must be a NumPy array.
+        rate : float or numpy.ndarray
+            Amount each cell regrows per iteration, either for all cells or
+            for each cell within the environment limits.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.environment = environment
+        self.capacity = numpy.array(environment.limited_plane,
+                                    dtype=numpy.float64)
+        self.rate = numpy.broadcast_to(
+            numpy.asarray(rate, dtype=numpy.float64), self.capacity.shape)
+
+        # Cells below capacity, as flat indices within the limits and as a
+        # mask of the cells
+        self._depleted = numpy.empty(0, dtype=numpy.int64)
+        self._is_depleted = numpy.zeros(self.capacity.size, dtype=bool)
+
+
+    @property
+    def depleted(self):
+        """
+        Get the flat indices of the cells below capacity after the last
+        update.
+        """
+        return self._depleted
+
+
+    def apply(self, agents=None):
+        """
+        Regrow the depleted cells by one iteration.
+
+        Parameters
+        ----------
+        agents : list[agentframework.Agent] or agentframework.AgentArrays,
+        optional
+            Agents that may have eaten since the last update. Only their
+            cells and the cells already depleted are checked, unless these
+            are more than `scan_fraction` of the cells. If None, the whole
+            plane is checked. The default is None.
+
+        Returns
+        -------
+        float
+            Total amount regrown.
+
+        """
+
+        plane = self.environment.plane
+        y_length, x_length = self.capacity.shape
+        if agents is not None and len(self._depleted) + len(agents) > \
+                scan_fraction * self.capacity.size:
+            agents = None
+
+        # Find the cells that may be depleted
+        if agents is None:
+            candidates = numpy.flatnonzero(
+                plane[:y_length, :x_length] < self.capacity)
+        else:
+            if isinstance(agents, agentframework.AgentArrays):
+                ys, xs = agents.y, agents.x
+            else:
+                ys = numpy.fromiter((agent.y for agent in agents), numpy.int64)
+                xs = numpy.fromiter((agent.x for agent in agents), numpy.int64)
+
+            # Add the agent cells not already tracked, once each
+            cells = ys * x_length + xs
+            cells = numpy.unique(cells[~self._is_depleted[cells]])
+            candidates = numpy.concatenate((self._depleted, cells))
+
+        # Regrow the candidate cells, up to their capacity
+        ys, xs = numpy.divmod(candidates, x_length)
+        values = plane[ys, xs]
+        capacity = self.capacity[ys, xs]
+        regrown = numpy.minimum(values + self.rate[ys, xs], capacity)
+        regrown = numpy.maximum(regrown, values)
+        plane[ys, xs] = regrown
+
+        # Keep the cells that are still depleted
+        is_depleted = regrown < capacity
+        self._is_depleted[self._depleted] = False
+        self._depleted = candidates[is_depleted]
+        self._is_depleted[self._depleted] = True
+        return float(numpy.sum(regrown - values))
+
+
+
+class RegrowthTestCase(unittest.TestCase):
+    """
+    The RegrowthTestCase class provides a collection of unit tests for the
+    Regrowth class.
+    """
+
+    def test_apply(self):
+        """
+        Test that eaten cells regrow up to their capacity.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        environment = agentframework.Environment(
+            numpy.full((40, 50), 50.0), 30, 40)
+        regrowth = Regrowth(environment, 4)
+        agents = agentframework.AgentArrays(environment, [1, 2], [1, 2],
+                                            None, 100, 10)
+        for agent in agents:
+            agent.eat()
+
+        # Verify only the eaten cells regrow, and stay tracked until full
+        self.assertEqual(regrowth.apply(agents), 8)
+        self.assertEqual(environment.plane[1, 1], 44)
+        self.assertEqual(regrowth.depleted.tolist(), [31, 62])
+        agents.x[:] = 0
+        self.assertEqual(regrowth.apply(agents), 8)
+        self.assertEqual(regrowth.apply(agents), 4)
+        self.assertEqual(environment.plane[1, 1], 50)
+        self.assertEqual(regrowth.depleted.tolist(), [])
+
+
+    def test_rate_per_cell(self):
+        """
+        Test that each cell regrows at its own rate when scanning the
+        whole plane.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        environment = agentframework.Environment(numpy.full((2, 2), 10.0))
+        regrowth = Regrowth(environment, [[1, 2], [3, 4]])
+        environment.plane[:] = 0
+        regrowth.apply()
+        self.assertEqual(environment.plane.tolist(), [[1, 2], [3, 4]])
+
+        # Verify cells above capacity are left unchanged
+        environment.plane[0, 0] = 20
+        regrowth.apply()
+        self.assertEqual(environment.plane.tolist(), [[20, 4], [6, 8]])
+
+
+    def test_scan(self):
+        """
+        Test that many depleted cells are found by scanning the plane.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        environment = agentframework.Environment(numpy.full((10, 10), 10.0))
+        regrowth = Regrowth(environment, 1)
+        environment.plane[::2] = 0
+        agents = agentframework.AgentArrays(environment, [1, 3, 5], [1, 1, 1])
+        self.assertEqual(regrowth.apply(agents), 50)
+        self.assertEqual(len(regrowth.depleted), 50)
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
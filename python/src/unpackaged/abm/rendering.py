@@ -0,0 +1,447 @@
+"""
+Model Rendering
+===============
+
+Draws the model environment and agents on a set of matplotlib axes.
+
+Small models are drawn in full detail, with the environment at its own
+resolution and each agent as a point. Above a given number of agents or
+environment cells, the model is drawn at a lower level of detail: the
+environment is averaged down to the size of the drawing in pixels and the
+agents are drawn as a density map of agents per pixel block. The cost of a
+frame is then bounded by the drawing size rather than the model size.
+"""
+
+import unittest
+import numpy
+import agentframework
+
+# Above these counts, models are drawn at a lower level of detail
+detail_agent_limit = 2000
+detail_cell_limit = 250000
+
+# Agent colours in full detail
+agent_color_active = "black"
+agent_color_inactive = "grey"
+
+
+def agent_positions(agents):
+    """
+    Return the positions of the given agents and whether each can eat.
+
+    Parameters
+    ----------
+    agents : list[agentframework.Agent] or agentframework.AgentArrays
+        The agents to locate.
+
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        Arrays of y-axis positions, x-axis positions and whether each agent
+        can still eat.
+
+    """
+
+    if isinstance(agents, agentframework.AgentArrays):
+        return agents.y, agents.x, agents.can_eat()
+    return (numpy.array([agent.y for agent in agents], dtype=numpy.int64),
+            numpy.array([agent.x for agent in agents], dtype=numpy.int64),
+            numpy.array([agent.can_eat() for agent in agents], dtype=bool))
+
+
+def block_starts(length, num_of_blocks):
+    """
+    Return the start of each block when splitting a length into at most the
+    given number of equally sized blocks.
+    """
+    step = -(-length // max(num_of_blocks, 1))
+    return numpy.arange(0, length, step)
+
+
+def downsample(plane, rows, columns):
+    """
+    Return the plane averaged down to at most the given size.
+
+    Parameters
+    ----------
+    plane : numpy.ndarray
+        The plane to downsample.
+    rows : int
+        Maximum number of rows.
+    columns : int
+        Maximum number of columns.
+
+    Returns
+    -------
+    numpy.ndarray
+        Mean of each block of cells. The plane is returned unchanged if it
+        already fits.
+
+    """
+
+    y_length, x_length = plane.shape
+    if y_length <= rows and x_length <= columns:
+        return plane
+
+    # Average blocks of rows, then blocks of columns
+    y_starts = block_starts(y_length, rows)
+    x_starts = block_starts(x_length, columns)
+    sums = numpy.add.reduceat(numpy.add.reduceat(
+        plane, y_starts, axis=0, dtype=numpy.float64), x_starts, axis=1)
+    counts = numpy.outer(numpy.diff(numpy.append(y_starts, y_length)),
+                         numpy.diff(numpy.append(x_starts, x_length)))
+    return sums / counts
+
+
+def agent_density(ys, xs, y_length, x_length, rows, columns):
+    """
+    Return the number of agents in each block of the environment.
+
+    Parameters
+    ----------
+    ys : numpy.ndarray
+        Agent y-axis positions.
+    xs : numpy.ndarray
+        Agent x-axis positions.
+    y_length : int
+        Environment y-axis length.
+    x_length : int
+        Environment x-axis length.
+    rows : int
+        Maximum number of block rows.
+    columns : int
+        Maximum number of block columns.
+
+    Returns
+    -------
+    numpy.ndarray
+        Agent counts, with blocks matching those used by `downsample`.
+
+    """
+
+    y_edges = numpy.append(block_starts(y_length, rows), y_length)
+    x_edges = numpy.append(block_starts(x_length, columns), x_length)
+    density, _, _ = numpy.histogram2d(ys, xs, bins=(y_edges, x_edges))
+    return density
+
+
+def is_detailed(num_of_agents, num_of_cells, agent_limit=None,
+                cell_limit=None):
+    """
+    Return whether a model is small enough to draw in full detail.
+
+    Parameters
+    ----------
+    num_of_agents : int
+        Number of agents in the model.
+    num_of_cells : int
+        Number of environment cells within the environment limits.
+    agent_limit : int, optional
+        Maximum number of agents. If None, `detail_agent_limit` is used.
+    cell_limit : int, optional
+        Maximum number of environment cells. If None, `detail_cell_limit`
+        is used.
+
+    Returns
+    -------
+    bool
+        True if the model should be drawn in full detail.
+
+    """
+
+    if agent_limit is None:
+        agent_limit = detail_agent_limit
+    if cell_limit is None:
+        cell_limit = detail_cell_limit
+    return num_of_agents <= agent_limit and num_of_cells <= cell_limit
+
+
+def draw_model(axes, model, size, agent_limit=None, cell_limit=None,
+               drawing=None):
+    """
+    Draw the model environment and agents on the given axes.
+
+    Parameters
+    ----------
+    axes : matplotlib.axes.Axes
+        Axes to draw on, which are cleared unless an earlier drawing on them
+        is reused.
+    model : Model
+        The model to draw.
+    size : tuple[int, int]
+        Drawing height and width, in pixels.
+    agent_limit : int, optional
+        Maximum number of agents to draw in full detail. If None,
+        `detail_agent_limit` is used.
+    cell_limit : int, optional
+        Maximum number of environment cells to draw in full detail. If None,
+        `detail_cell_limit` is used.
+    drawing : ModelDrawing, optional
+        Drawing of an earlier state on the same axes. Its artists are
+        updated in place, unless the environment size, drawing size or level
+        of detail has changed. The default is None.
+
+    Returns
+    -------
+    ModelDrawing
+        The drawing, to pass in when drawing the next state.
+
+    """
+
+    environment = model.environment
+    y_length = environment.y_length
+    x_length = environment.x_length
+    ys, xs, active = agent_positions(model.agents)
+    detailed = is_detailed(len(ys), y_length * x_length, agent_limit,
+                           cell_limit)
+
+    # Draw the full plane in detail, otherwise only within its limits
+    if detailed:
+        plane = environment.plane
+    else:
+        plane = environment.limited_plane
+
+    # Start a new drawing unless the earlier one still fits
+    if drawing is None or drawing.axes is not axes or \
+            not drawing.fits(y_length, x_length, size, detailed):
+        axes.clear()
+        drawing = ModelDrawing(axes, y_length, x_length, size, detailed)
+    drawing.update(plane, ys, xs, active)
+    return drawing
+
+
+
+class ModelDrawing():
+    """
+    The ModelDrawing class draws model states on a set of axes, reusing the
+    same artists for each state.
+
+    Public Methods:
+
+        update - draws the given model state
+
+        fits - returns whether the drawing suits an environment and drawing
+               size
+    """
+
+    def __init__(self, axes, y_length, x_length, size, detailed=True):
+        """
+        Instantiate a ModelDrawing.
+
+        Parameters
+        ----------
+        axes : matplotlib.axes.Axes
+            Empty axes to draw on.
+        y_length : int
+            Environment y-axis length.
+        x_length : int
+            Environment x-axis length.
+        size : tuple[int, int]
+            Drawing height and width, in pixels.
+        detailed : bool, optional
+            Whether to draw in full detail, rather than as a density map.
+            The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.axes = axes
+        self.y_length = y_length
+        self.x_length = x_length
+        self.rows, self.columns = (max(int(length), 1) for length in size)
+        self.detailed = detailed
+        axes.set_ylim(0, y_length)
+        axes.set_xlim(0, x_length)
+
+        # Artists are created with the first state
+        self._environment_image = None
+        self._agents_artist = None
+
+
+    def fits(self, y_length, x_length, size, detailed=True):
+        """
+        Return whether the drawing suits the given environment and drawing
+        size, so its artists can be reused.
+
+        Parameters
+        ----------
+        y_length : int
+            Environment y-axis length.
+        x_length : int
+            Environment x-axis length.
+        size : tuple[int, int]
+            Drawing height and width, in pixels.
+        detailed : bool, optional
+            Whether to draw in full detail. The default is True.
+
+        Returns
+        -------
+        bool
+            True if the drawing can be reused.
+
+        """
+
+        rows, columns = (max(int(length), 1) for length in size)
+        return (self.y_length, self.x_length, self.rows, self.columns,
+                self.detailed) == (y_length, x_length, rows, columns,
+                                   detailed)
+
+
+    def update(self, plane, ys, xs, active):
+        """
+        Draw the given model state.
+
+        Parameters
+        ----------
+        plane : numpy.ndarray
+            Environment plane.
+        ys : numpy.ndarray
+            Agent y-axis positions.
+        xs : numpy.ndarray
+            Agent x-axis positions.
+        active : numpy.ndarray
+            Whether each agent can still eat.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.detailed:
+            # Draw the environment and each agent
+            colors = numpy.where(active, agent_color_active,
+                                 agent_color_inactive)
+            if self._environment_image is None:
+                self._environment_image = self.axes.imshow(plane)
+                self._agents_artist = self.axes.scatter(xs, ys, color=colors)
+            else:
+                # Fit the image to a plane of a different shape
+                if plane.shape != self._environment_image.get_array().shape:
+                    self._environment_image.set_extent(
+                        (-0.5, plane.shape[1] - 0.5, plane.shape[0] - 0.5,
+                         -0.5))
+                self._environment_image.set_data(plane)
+                self._environment_image.autoscale()
+                self._agents_artist.set_offsets(numpy.column_stack((xs, ys)))
+                self._agents_artist.set_color(colors)
+            return
+
+        # Draw the environment averaged down to the drawing size, with the
+        # matching agent density on top
+        plane = downsample(plane, self.rows, self.columns)
+        density = numpy.ma.masked_equal(agent_density(
+            ys, xs, self.y_length, self.x_length, self.rows, self.columns), 0)
+        if self._environment_image is None:
+            extent = (-0.5, self.x_length - 0.5, self.y_length - 0.5, -0.5)
+            self._environment_image = self.axes.imshow(plane, extent=extent)
+            self._agents_artist = self.axes.imshow(density, extent=extent,
+                                                   cmap="Greys", alpha=0.8)
+        else:
+            self._environment_image.set_data(plane)
+            self._environment_image.autoscale()
+            self._agents_artist.set_data(density)
+            self._agents_artist.autoscale()
+
+
+
+class RenderingTestCase(unittest.TestCase):
+    """
+    The RenderingTestCase class provides a collection of unit tests for the
+    rendering functions.
+    """
+
+    class FakeModel():
+        """
+        A minimal model holding an environment and agents.
+        """
+
+        def __init__(self, agents):
+            self.environment = agents.environment
+            self.agents = agents
+
+
+    def test_downsample(self):
+        """
+        Test that planes are averaged down in blocks.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        plane = numpy.arange(25, dtype=numpy.float64).reshape(5, 5)
+        self.assertIs(downsample(plane, 5, 5), plane)
+
+        # Verify uneven blocks are averaged over their own cells
+        small = downsample(plane, 2, 2)
+        self.assertEqual(small.shape, (2, 2))
+        self.assertEqual(small[0, 0], plane[:3, :3].mean())
+        self.assertEqual(small[1, 1], plane[3:, 3:].mean())
+
+
+    def test_agent_density(self):
+        """
+        Test that agents are counted in the downsampled blocks.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        density = agent_density(numpy.array([0, 2, 4]),
+                                numpy.array([0, 2, 4]), 5, 5, 2, 2)
+        self.assertEqual(density.tolist(), [[2, 0], [0, 1]])
+
+
+    def test_draw_model(self):
+        """
+        Test that large models are drawn with a bounded number of pixels.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        import matplotlib.figure
+        environment = agentframework.Environment(
+            numpy.ones((400, 300)))
+        rng = numpy.random.default_rng(0)
+        model = self.FakeModel(agentframework.AgentArrays(
+            environment, rng.integers(0, 400, 1000),
+            rng.integers(0, 300, 1000)))
+
+        # Verify small limits switch to the downsampled drawing
+        axes = matplotlib.figure.Figure().add_subplot()
+        draw_model(axes, model, (40, 30), agent_limit=100)
+        self.assertEqual([image.get_array().shape for image in axes.images],
+                         [(40, 30), (40, 30)])
+        self.assertEqual(axes.images[1].get_array().sum(), 1000)
+
+        # Verify the full detail drawing otherwise
+        axes = matplotlib.figure.Figure().add_subplot()
+        drawing = draw_model(axes, model, (40, 30))
+        self.assertEqual(axes.images[0].get_array().shape, (400, 300))
+        self.assertEqual(len(axes.collections[0].get_offsets()), 1000)
+
+        # Verify the artists are reused for later states, unless the
+        # drawing size changes
+        model.agents.y[:] = 0
+        self.assertIs(draw_model(axes, model, (40, 30), drawing=drawing),
+                      drawing)
+        self.assertEqual((len(axes.images), len(axes.collections)), (1, 1))
+        self.assertEqual(axes.collections[0].get_offsets()[:, 1].max(), 0)
+        self.assertIsNot(draw_model(axes, model, (40, 31), drawing=drawing),
+                         drawing)
+        self.assertEqual((len(axes.images), len(axes.collections)), (1, 1))
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
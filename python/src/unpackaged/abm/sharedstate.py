@@ -0,0 +1,389 @@
+"""
+Shared Model State
+==================
+
+Holds the environment and agent state in shared memory, so other processes
+can use it without copying.
+
+The process that shares the state owns the shared memory. It sends a small
+descriptor to other processes, which attach to the same memory using that
+descriptor. The owner releases the memory when the state is closed.
+"""
+
+import multiprocessing
+import multiprocessing.shared_memory
+import pickle
+import unittest
+import weakref
+import numpy
+import agentframework
+
+# Blocks that could not be closed because arrays still refer to them,
+# closed once those arrays are gone
+_lingering = []
+
+
+def _close_lingering():
+    """
+    Close any lingering blocks no longer referred to by arrays.
+    """
+    for block in list(_lingering):
+        try:
+            block.close()
+        except BufferError:
+            continue
+        _lingering.remove(block)
+
+
+def _release(blocks, owner):
+    """
+    Close the given shared memory blocks, unlinking them if owned.
+    """
+    _close_lingering()
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            # Keep the block open until the arrays using it are gone
+            _lingering.append(block)
+        if owner:
+            block.unlink()
+
+
+
+class SharedArrays():
+    """
+    The SharedArrays class holds a set of named arrays in shared memory.
+
+    Public Methods:
+
+        descriptor - returns a small description used to attach to the arrays
+
+        close - detaches from the arrays, releasing them if owned
+    """
+
+    def __init__(self, arrays=None, descriptor=None):
+        """
+        Instantiate a SharedArrays.
+
+        Either `arrays` or `descriptor` must be given.
+
+        Parameters
+        ----------
+        arrays : dict[str, numpy.ndarray], optional
+            Arrays to copy into new shared memory, which this instance will
+            own.
+        descriptor : dict, optional
+            Descriptor of existing shared arrays to attach to.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.owner = descriptor is None
+        self.arrays = {}
+        self._descriptor = {}
+        blocks = []
+        _close_lingering()
+
+        if self.owner:
+            # Copy each array into a new block
+            for key, array in arrays.items():
+                array = numpy.asarray(array)
+                block = multiprocessing.shared_memory.SharedMemory(
+                    create=True, size=max(array.nbytes, 1))
+                shared = numpy.ndarray(array.shape, array.dtype,
+                                       buffer=block.buf)
+                shared[...] = array
+                blocks.append(block)
+                self.arrays[key] = shared
+                self._descriptor[key] = (block.name, array.shape,
+                                         array.dtype.str)
+        else:
+            # Attach to each existing block
+            for key, (name, shape, dtype) in descriptor.items():
+                block = multiprocessing.shared_memory.SharedMemory(name=name)
+                blocks.append(block)
+                self.arrays[key] = numpy.ndarray(shape, dtype,
+                                                 buffer=block.buf)
+            self._descriptor = dict(descriptor)
+
+        # Release the blocks if the arrays are not closed explicitly
+        self._finalizer = weakref.finalize(self, _release, blocks,
+                                           self.owner)
+
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+
+    def descriptor(self):
+        """
+        Return a description of the arrays that can be sent to another
+        process and used to attach to them.
+
+        Returns
+        -------
+        dict
+            Shared memory name, shape and type of each array.
+
+        """
+
+        return dict(self._descriptor)
+
+
+    def close(self):
+        """
+        Detach from the arrays, releasing the shared memory if owned.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        self.arrays = {}
+        self._finalizer()
+
+
+
+class SharedState():
+    """
+    The SharedState class holds the model environment and agents in shared
+    memory.
+
+    When sharing, the given agents are updated to use the shared memory and
+    a new environment using the shared plane is provided as `environment`.
+    When attaching, `environment` and `agents` use the memory shared by the
+    owner.
+
+    Public Methods:
+
+        descriptor - returns a small description used to attach to the state
+
+        close - detaches from the state, releasing it if owned
+    """
+
+    def __init__(self, environment=None, agents=None, descriptor=None):
+        """
+        Instantiate a SharedState.
+
+        Either `environment` and `agents`, or `descriptor` must be given.
+
+        Parameters
+        ----------
+        environment : agentframework.Environment, optional
+            Environment to share. Only the plane within the environment
+            limits is shared.
+        agents : agentframework.AgentArrays, optional
+            Agents to share.
+        descriptor : dict, optional
+            Descriptor of existing shared state to attach to.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if descriptor is None:
+            # Copy the plane within the environment limits
+            y_length = environment.y_length
+            x_length = environment.x_length
+            plane = numpy.array(environment.limited_plane,
+                                dtype=numpy.float64)
+
+            # Copy the state into shared memory, wrapping agent positions
+            # into the shared plane
+            self._arrays = SharedArrays({
+                "plane": plane,
+                "y": agents.y % y_length,
+                "x": agents.x % x_length,
+                "store": agents.store,
+            })
+            self._settings = {"species": agents.species,
+                              "bounds": agents.bounds.tolist()}
+
+            # Point the agents and a new environment at the shared state
+            self.environment = agentframework.Environment(
+                self._arrays["plane"])
+            agents.environment = self.environment
+            agents.y = self._arrays["y"]
+            agents.x = self._arrays["x"]
+            agents.store = self._arrays["store"]
+            agents._views.clear()
+            self.agents = agents
+        else:
+            # Attach to the shared state
+            self._arrays = SharedArrays(descriptor=descriptor["arrays"])
+            self._settings = dict(descriptor["settings"])
+            self.environment = agentframework.Environment(
+                self._arrays["plane"])
+            self.agents = agentframework.AgentArrays(
+                self.environment, [], [], None)
+            self.agents.y = self._arrays["y"]
+            self.agents.x = self._arrays["x"]
+            self.agents.store = self._arrays["store"]
+            self.agents.species = self._settings["species"]
+            self.agents.bounds = numpy.array(self._settings["bounds"])
+
+
+    @property
+    def owner(self):
+        """
+        Get whether this process owns the shared memory.
+        """
+        return self._arrays.owner
+
+
+    def descriptor(self):
+        """
+        Return a description of the state that can be sent to another
+        process and used to attach to it.
+
+        Returns
+        -------
+        dict
+            Shared array descriptors and agent settings.
+
+        """
+
+        return {"arrays": self._arrays.descriptor(),
+                "settings": dict(self._settings)}
+
+
+    def close(self):
+        """
+        Detach from the state, releasing the shared memory if owned.
+
+        The agents and environment are first copied into local memory, so
+        they remain usable.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        if self.agents.y is self._arrays.arrays.get("y"):
+            self.environment = agentframework.Environment(
+                numpy.array(self.environment.plane))
+            self.agents.environment = self.environment
+            self.agents.y = numpy.array(self.agents.y)
+            self.agents.x = numpy.array(self.agents.x)
+            self.agents.store = numpy.array(self.agents.store)
+            self.agents._views.clear()
+        self._arrays.close()
+
+
+
+def _eat_in_process(descriptor):
+    """
+    Attach to shared state and have the first agent eat, for testing.
+    """
+    state = SharedState(descriptor=descriptor)
+    state.agents[0].eat()
+    state.agents.x[1] = 1
+    state.close()
+
+
+
+class SharedStateTestCase(unittest.TestCase):
+    """
+    The SharedStateTestCase class provides a collection of unit tests for
+    the SharedArrays and SharedState classes.
+    """
+
+    def create_state(self):
+        """
+        Return shared state for a small environment with two agents.
+        """
+        environment = agentframework.Environment(
+            [[50] * 4 for _ in range(3)], 3, 2)
+        agents = agentframework.AgentArrays(environment, [0, 1], [0, 4],
+                                            None, 100, 10)
+        return SharedState(environment, agents)
+
+
+    def test_share(self):
+        """
+        Test that state is shared within the environment limits.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        state = self.create_state()
+        try:
+            self.assertTrue(state.owner)
+            self.assertEqual(state.environment.plane.shape, (2, 3))
+            self.assertEqual(state.agents.x.tolist(), [0, 1])
+
+            # Verify the descriptor is small enough to send cheaply
+            self.assertLess(len(pickle.dumps(state.descriptor())), 1000)
+        finally:
+            state.close()
+
+
+    def test_attach_in_process(self):
+        """
+        Test that changes made by an attached process are shared.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        state = self.create_state()
+        try:
+            process = multiprocessing.Process(target=_eat_in_process,
+                                              args=(state.descriptor(),))
+            process.start()
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+            # Verify the changes are visible to the owner
+            self.assertEqual(state.environment.plane[0][0], 40)
+            self.assertEqual(state.agents.store.tolist(), [10, 0])
+            self.assertEqual(state.agents.x.tolist(), [0, 1])
+        finally:
+            state.close()
+
+
+    def test_close(self):
+        """
+        Test that agents remain usable after the state is closed.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        state = self.create_state()
+        agents = state.agents
+        state.close()
+        agents[0].eat()
+        self.assertEqual(agents.store[0], 10)
+        self.assertEqual(agents.environment.plane[0][0], 40)
+        self.assertEqual(_lingering, [])
+
+        # Verify blocks still in use are closed once their arrays are gone
+        block = multiprocessing.shared_memory.SharedMemory(create=True,
+                                                           size=80)
+        values = numpy.frombuffer(block.buf)
+        _release([block], True)
+        self.assertEqual(_lingering, [block])
+        del values
+        SharedArrays({"values": numpy.zeros(1)}).close()
+        self.assertEqual(_lingering, [])
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+"""
+Store Sharing
+=============
+
+Shares agent stores with their neighbours, found in bulk as a sparse
+adjacency by `neighbourhood.neighbour_graph`.
+
+Two modes are provided:
+
+    sequential - each agent, in turn order, sets its store and the store of
+                 each of its neighbours to their average, one neighbour at
+                 a time in agent order. This is the same result as calling
+                 `Agent.share_with_neighbours` for each agent in turn.
+
+    diffusion - every agent moves towards the mean of its neighbourhood in
+                a single array operation. Agent `i` takes a fraction
+                1 / (1 + max(d_i, d_j)) of the difference with each
+                neighbour `j`, where `d` is the number of neighbours. An
+                isolated pair of agents ends up with their average, as in
+                sequential mode.
+
+Both modes conserve the total store. Each sequential step replaces two
+stores by two copies of their average, and diffusion moves the same amount
+in each direction between every pair of neighbours. Totals may only differ
+by floating point rounding. Neither mode can take a store below zero: in
+sequential mode stores are only replaced by averages, and in diffusion mode
+each new store is a weighted average of the stores in its neighbourhood.
+
+Only agents taking a turn start sharing, but they share with all of their
+neighbours, as in a sequential iteration.
+"""
+
+import unittest
+import numpy
+import agentframework
+import neighbourhood
+
+# Sharing modes
+modes = ("sequential", "diffusion")
+
+
+def share_sequential(stores, order, indptr, indices):
+    """
+    Share stores with each neighbour in turn, in turn order.
+
+    Parameters
+    ----------
+    stores : numpy.ndarray
+        Agent stores, updated in place.
+    order : numpy.ndarray
+        Indices of the agents taking a turn, in turn order.
+    indptr : numpy.ndarray
+        CSR row pointers of the neighbour adjacency.
+    indices : numpy.ndarray
+        CSR column indices of the neighbour adjacency.
+
+    Returns
+    -------
+    int
+        Number of share events.
+
+    """
+
+    values = stores.tolist()
+    pointers = indptr.tolist()
+    neighbours = indices.tolist()
+
+    # Average the store of each agent with each neighbour in turn
+    for i in order.tolist():
+        store = values[i]
+        for k in range(pointers[i], pointers[i + 1]):
+            j = neighbours[k]
+            store = values[j] = (store + values[j]) / 2
+        values[i] = store
+
+    stores[:] = values
+    return int(numpy.sum(indptr[order + 1] - indptr[order]))
+
+
+def share_diffusion(stores, order, indptr, indices):
+    """
+    Move every store towards the mean of its neighbourhood at once.
+
+    Parameters
+    ----------
+    stores : numpy.ndarray
+        Agent stores, updated in place.
+    order : numpy.ndarray
+        Indices of the agents taking a turn.
+    indptr : numpy.ndarray
+        CSR row pointers of the neighbour adjacency.
+    indices : numpy.ndarray
+        CSR column indices of the neighbour adjacency.
+
+    Returns
+    -------
+    int
+        Number of share events, counted as in sequential mode.
+
+    """
+
+    num_of_agents = len(stores)
+    active = numpy.zeros(num_of_agents, dtype=bool)
+    active[order] = True
+
+    # Keep the pairs where either agent is taking a turn
+    rows = numpy.repeat(numpy.arange(num_of_agents), numpy.diff(indptr))
+    keep = active[rows] | active[indices]
+    rows = rows[keep]
+    columns = indices[keep]
+
+    # Move each store by a symmetric fraction of each difference
+    degrees = numpy.bincount(rows, minlength=num_of_agents)
+    weights = 1 / (1 + numpy.maximum(degrees[rows], degrees[columns]))
+    stores += numpy.bincount(rows, weights=weights * (stores[columns]
+                                                      - stores[rows]),
+                             minlength=num_of_agents)
+    return int(numpy.count_nonzero(active[rows]))
+
+
+def share(stores, order, indptr, indices, mode="sequential"):
+    """
+    Share stores between neighbours using the given mode.
+
+    Parameters
+    ----------
+    stores : numpy.ndarray
+        Agent stores, updated in place.
+    order : numpy.ndarray
+        Indices of the agents taking a turn, in turn order.
+    indptr : numpy.ndarray
+        CSR row pointers of the neighbour adjacency.
+    indices : numpy.ndarray
+        CSR column indices of the neighbour adjacency.
+    mode : str, optional
+        One of `modes`. The default is "sequential".
+
+    Raises
+    ------
+    ValueError
+        If the mode is unknown.
+
+    Returns
+    -------
+    int
+        Number of share events.
+
+    """
+
+    if mode == "sequential":
+        return share_sequential(stores, order, indptr, indices)
+    if mode == "diffusion":
+        return share_diffusion(stores, order, indptr, indices)
+    raise ValueError("Unknown sharing mode: {}".format(mode))
+
+
+
+class SharingTestCase(unittest.TestCase):
+    """
+    The SharingTestCase class provides a collection of unit tests for the
+    sharing modes.
+    """
+
+    def create_agents(self, num_of_agents=80, length=30):
+        """
+        Return randomly placed agents with random stores, and their
+        neighbour graph.
+        """
+        rng = numpy.random.default_rng(0)
+        environment = agentframework.Environment(
+            numpy.zeros((length, length)))
+        agents = agentframework.AgentArrays(
+            environment, rng.integers(0, length, num_of_agents),
+            rng.integers(0, length, num_of_agents),
+            rng.integers(0, 100, num_of_agents))
+        graph = neighbourhood.neighbour_graph(agents.y, agents.x, 4, length,
+                                              length)
+        return agents, graph, rng.permutation(num_of_agents)[:60]
+
+
+    def test_sequential(self):
+        """
+        Test that sequential sharing matches sharing agent by agent.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        agents, graph, order = self.create_agents()
+        stores = agents.store.copy()
+        share_events = share(stores, order, *graph)
+        for i in order:
+            agents[i].share_with_neighbours(4)
+        self.assertTrue(numpy.array_equal(stores, agents.store))
+        self.assertEqual(share_events,
+                         sum(len(agents[i].neighbours(4)) for i in order))
+
+
+    def test_diffusion(self):
+        """
+        Test that diffusion conserves the total store, keeps stores within
+        the range of their neighbourhood and averages isolated pairs.
+
+        Returns
+        -------
+        None.
+
+        """
+
+        agents, graph, order = self.create_agents()
+        total = agents.store.sum()
+        low, high = agents.store.min(), agents.store.max()
+        share(agents.store, order, *graph, mode="diffusion")
+        self.assertAlmostEqual(agents.store.sum(), total)
+        self.assertTrue((agents.store >= low).all())
+        self.assertTrue((agents.store <= high).all())
+
+        # Verify an isolated pair ends up with its average
+        stores = numpy.array([10.0, 30.0, 5.0])
+        share_diffusion(stores, numpy.array([0]), numpy.array([0, 1, 2, 2]),
+                        numpy.array([1, 0]))
+        self.assertEqual(stores.tolist(), [20, 20, 5])
+
+        with self.assertRaises(ValueError):
+            share(stores, order, *graph, mode="unknown")
+
+
+# Run unit tests when invoked as a script
+if __name__ == '__main__':
+    unittest.main()